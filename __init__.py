@@ -1,56 +1,191 @@
 import numpy as np
 import numpy.linalg as linalg
 import logging
-from typing import Type, Iterator, Optional
+from typing import Type, Iterator, Iterable, Optional, TYPE_CHECKING
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 import nltk
 from nltk.stem.api import StemmerI
-from collections import Counter
+from collections import Counter, deque
 import math
+import copy
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
 import xml.etree.ElementTree as ET
-import spacy
-from spacy.tokens import Doc
+from .matrix import QueryBatch, top_k as top_k_ids
+from .segments import SegmentedIndex
+from .terms import TERMS, count_terms
+from . import storage
+from .cache import TokenCache, ResultCache
+from .dense import EmbeddingMatrix, unit_vector
+from .ann import IVFIndex, META_FILE as ANN_META_FILE
+from .fusion import linear_fusion, reciprocal_rank_fusion
+from .scoring import ScoringModel, Cosine
+from .tokenizer import FastTokenizer
+from .profiling import PROFILER
+if TYPE_CHECKING:
+    from spacy.language import Language
+    from spacy.tokens import Doc
 log = logging.getLogger(__name__)
 
-#Owen stuff. Takes spacy doc and normalizes it, returns as string
-nlp = spacy.load("en_core_web_lg")
+TOKENIZERS = ("nltk", "fast")
+# raw tokens for tokenizer = "fast", shared by every instance
+RAW_TOKENIZER = FastTokenizer()
+
+DEFAULT_SPACY_MODEL = "en_core_web_lg"
+# components normalization never looks at; lemmas only need the tagger and attribute ruler
+DEFAULT_SPACY_DISABLE = ("parser", "ner")
+# where in a saved SpacyInfoRet index its trained IVFIndex goes
+ANN_DIR = "ann"
+
+_spacy_models: dict[tuple[str, tuple[str, ...]], "Language"] = {}
+
+def load_spacy_model(
+    name: str = DEFAULT_SPACY_MODEL,
+    disable: Iterable[str] = DEFAULT_SPACY_DISABLE,
+) -> "Language":
+    """Load a spaCy pipeline on first use and keep it for the life of the process."""
+    key = (name, tuple(sorted(disable)))
+    try:
+        return _spacy_models[key]
+    except KeyError:
+        pass
+    # importing spacy alone takes seconds, so only do it when a model is needed
+    import spacy
+    log.info("loading spaCy model %s without %s", name, ", ".join(key[1]) or "nothing")
+    model = spacy.load(name, disable = list(key[1]))
+    _spacy_models[key] = model
+    return model
+
+def __getattr__(name: str):
+    # `inforet.nlp` used to be loaded at import time; keep it working, lazily
+    if name == "nlp":
+        return load_spacy_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def normalize_spacy_doc(doc: Doc, stem: bool, stop: bool, punct: bool):
+#Owen stuff. Takes spacy doc and normalizes it, returns as string
+def normalize_spacy_doc(doc: "Doc", stem: bool, stop: bool, punct: bool):
+    return normalize_spacy_attributes(spacy_token_attributes(doc), stem, stop, punct)
+
+def spacy_token_attributes(doc: "Doc") -> list[tuple[str, bool, str, bool]]:
+    # (text, is_stop, lemma, lemma is_stop) per token: everything the
+    # normalization needs, without keeping the Doc alive
+    return [(token.text, token.is_stop, token.lemma_, doc.vocab[token.lemma_].is_stop)
+            for token in doc]
+
+def normalize_spacy_attributes(
+    attributes: list[tuple[str, bool, str, bool]],
+    stem: bool,
+    stop: bool,
+    punct: bool,
+) -> list[str]:
     if stem:
-        lemmas = [nlp.vocab[token.lemma_] for token in doc]
+        lemmas = [(lemma, lemma_is_stop) for (_, _, lemma, lemma_is_stop) in attributes]
     else:
-        lemmas = [token for token in doc]
+        lemmas = [(text, is_stop) for (text, is_stop, _, _) in attributes]
 
     if stop:
-        stopped = [token for token in lemmas
-                   if not token.is_stop]
+        stopped = [(text, is_stop) for (text, is_stop) in lemmas
+                   if not is_stop]
     else:
         stopped = lemmas
 
     if punct:
         punctuations="?:!.,;"
-        depuncted = [token for token in stopped
-                     if token.text not in punctuations]
+        depuncted = [(text, is_stop) for (text, is_stop) in stopped
+                     if text not in punctuations]
     else:
         depuncted = stopped
 
-    return [token.text for token in depuncted]
+    return [text for (text, _) in depuncted]
+
+class StageTimer:
+    """Accumulates wall-clock seconds per named stage."""
+
+    def __init__(self):
+        self.stages: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            # also a profiler stage, when profiling is on
+            with PROFILER.stage(name):
+                yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def merge(self, other: "StageTimer"):
+        for (name, seconds) in other.stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
 
 class Document:
+    """A normalized text as the ids of its distinct terms and their counts.
+
+    Both arrays are in order of first occurrence, the order a Counter of the
+    text iterates in. Term ids come from the process-wide `terms.TERMS`.
+    """
+
+    __slots__ = ("ident", "terms", "counts", "length")
+
     ident: int
-    word_frequencies: Counter
+    terms: np.ndarray   # int32 term ids
+    counts: np.ndarray  # int32
     length: int
 
     def __init__(self, ident: int, text: list[str]):
         assert text
         self.ident = ident
-        self.word_frequencies = Counter(text)
+        (self.terms, self.counts) = count_terms(TERMS.intern_all(text))
         self.length = len(text)
 
+    @classmethod
+    def from_arrays(cls, ident: int, terms: np.ndarray, counts: np.ndarray, length: int) -> "Document":
+        # rebuild an already normalized document, e.g. from a saved index
+        doc = cls.__new__(cls)
+        doc.ident = ident
+        doc.terms = terms
+        doc.counts = counts
+        doc.length = length
+        return doc
+
+    @property
+    def word_frequencies(self) -> Counter:
+        """Term counts keyed by term, built on each access."""
+        return Counter(dict(zip(TERMS.strings(self.terms), self.counts.tolist())))
+
+    def frequency(self, term: str) -> int:
+        found = np.flatnonzero(self.terms == TERMS.lookup(term))
+        return int(self.counts[found[0]]) if len(found) else 0
+
+    def frequencies_of(self, term_ids: np.ndarray) -> np.ndarray:
+        """The count of each of `term_ids` in this document, 0 where it does not occur."""
+        order = np.argsort(self.terms)
+        found = order[np.searchsorted(self.terms, term_ids, sorter=order).clip(max=len(order) - 1)]
+        return np.where(self.terms[found] == term_ids, self.counts[found], 0)
+
+    def __reduce__(self):
+        # term ids only mean something in this process; send the terms themselves
+        return (_rebuild_document, (type(self), self.ident, TERMS.strings(self.terms), self.counts, self.length))
+
+
+def _rebuild_document(cls: type, ident: int, terms: list[str], counts: np.ndarray, length: int) -> Document:
+    return cls.from_arrays(ident, TERMS.intern_all(terms), counts, length)
+
 
 class Query(Document):
+    __slots__ = ()
+
     def unique_tokens(self) -> Iterator[str]:
-        # Counter has a consistent iteration order
-        return self.word_frequencies.elements()
+        # each term once per occurrence, in a consistent order
+        return iter(TERMS.strings(self.unique_terms()))
+
+    def unique_terms(self) -> np.ndarray:
+        """Term ids in the order of unique_tokens."""
+        return np.repeat(self.terms, self.counts)
 
 
 class InfoRet:
@@ -61,6 +196,13 @@ class InfoRet:
     stemmer: Optional[StemmerI]
     downcase: bool
     inclusion_threshold: int = 0.0001 # minimum similarity to include in results
+    query_batch_size: int = 64 # queries scored per matrix product in perform_queries
+    flush_size: int = 256 # documents buffered before the index seals a segment
+    background_merges: bool = False # merge index segments on a worker thread
+    tokenizer_name: str = "nltk" # "nltk" or "fast"; also names the raw token layer in token_cache
+    # collection-wide N, df and lengths to score with in place of the index's
+    # own, when the index is one shard of several (see shards.py)
+    global_statistics = None
 
     def __init__(
         self,
@@ -68,18 +210,71 @@ class InfoRet:
         stopwords = None,
         stemmer = None,
         downcase = False,
+        token_cache: Optional[TokenCache] = None,
+        scoring: Optional[ScoringModel] = None,
+        result_cache: Optional[ResultCache] = None,
+        tokenizer: str = "nltk",
     ):
-        self.documents: set[Document] = set()
+        if tokenizer not in TOKENIZERS:
+            raise ValueError(f"unknown tokenizer {tokenizer!r}, expected one of {', '.join(TOKENIZERS)}")
+        # "fast" gives the same tokens as "nltk", memoized; see tokenizer.py
+        self.tokenizer_name = tokenizer
+        self._fast_tokenizer: Optional[FastTokenizer] = None
+        # may be shared by several instances to tokenize each text only once
+        self.token_cache = token_cache
+        # ranked results of earlier queries; one per instance, as it tracks this index
+        self.result_cache = result_cache
+        # how the sparse path scores documents; tf-idf cosine unless given
+        self.scoring = scoring if scoring is not None else Cosine()
+        self.clear()
+        # per-stage timings of the most recent perform_query, and totals over all of them
+        self.last_query_timings = StageTimer()
+        self.query_timings = StageTimer()
         self.downcase = downcase
         self.stopwords = stopwords
         self.stemmer = stemmer
     
+    def clear(self):
+        """Drop every indexed document, keeping the normalization settings."""
+        # documents in the order they were indexed; position is the index doc id,
+        # and a deleted document leaves None behind
+        self.document_table: list[Optional[Document]] = []
+        self.doc_ids_by_ident: dict[int, int] = {}
+        self.index = SegmentedIndex(self.flush_size, background_merges = self.background_merges)
+
+    def empty_copy(self) -> "InfoRet":
+        """An instance with the same settings and no documents."""
+        clone = copy.copy(self)
+        clone.clear()
+        if self.result_cache is not None:
+            clone.result_cache = ResultCache(self.result_cache.max_bytes)
+        return clone
+
     def is_stopword(self, word: str) -> bool:
         if self.stopwords:
             return word in self.stopwords
         else:
             return False
 
+    @property
+    def documents(self) -> set[Document]:
+        return {doc for doc in self.document_table if doc is not None}
+
+    @property
+    def statistics(self):
+        """What scoring takes N, df and document lengths from."""
+        return self.index if self.global_statistics is None else self.global_statistics
+
+    def normalization_settings(self) -> dict:
+        """Everything that changes how text is normalized, as plain JSON values."""
+        return {
+            "class": type(self).__name__,
+            "downcase": self.downcase,
+            "stopwords": sorted(self.stopwords) if self.stopwords else None,
+            "stemmer": type(self.stemmer).__name__ if self.stemmer else None,
+            "tokenizer": self.tokenizer_name,
+        }
+
     def normalize_word(self, word: str) -> Iterator[str]:
         if self.downcase:
             yield word.lower()
@@ -87,18 +282,142 @@ class InfoRet:
             yield word
 
     def tokenize(self, seq: str) -> list[str]:
+        if self.tokenizer_name == "fast":
+            return RAW_TOKENIZER.tokenize(seq)
         return nltk.word_tokenize(seq)
 
-    def normalize_text(self, text: str) -> list[str]:
-        return [norm_word for word in self.tokenize(text)
+    def fast_tokenizer(self) -> FastTokenizer:
+        """A FastTokenizer that normalizes as normalize_tokens does, rebuilt if the settings change."""
+        settings = (self.downcase, self.stemmer, self.stopwords)
+        if self._fast_tokenizer is None or self._fast_settings != settings:
+            self._fast_tokenizer = FastTokenizer(self.normalize_tokens)
+            self._fast_settings = settings
+        return self._fast_tokenizer
+
+    def normalize_tokens(self, tokens: list[str]) -> list[str]:
+        return [norm_word for word in tokens
                 for norm_word in self.normalize_word(word)
                 if not self.is_stopword(norm_word)]
 
-    def add_document(self, ident: int, text: str) -> Document:
-        doc = self.document_class(ident, self.normalize_text(text))
-        self.documents.add(doc)
+    def normalize_text(self, text: str) -> list[str]:
+        with PROFILER.stage("normalize"):
+            if self.token_cache is not None:
+                return self.cached_normalize_text(text)
+            if self.tokenizer_name == "fast":
+                return self.fast_tokenizer().tokenize(text)
+            return self.normalize_tokens(self.tokenize(text))
+
+    def cached_normalize_text(self, text: str, tokens: Optional[list[str]] = None) -> list[str]:
+        """normalize_text with each step memoized as a layer of token_cache.
+
+        `tokens`, if given, is the already computed tokenize(text).
+        """
+        cache = self.token_cache
+        layer = (self.tokenizer_name,)
+        if tokens is None:
+            words = cache.layer(layer, text, lambda: self.tokenize(text))
+        else:
+            words = tokens
+            cache.put(layer, text, tokens)
+        if self.downcase:
+            layer += ("lower",)
+            words = cache.layer(layer, text, lambda: [norm_word for word in words
+                                                      for norm_word in self.normalize_word(word)])
+        if self.stopwords:
+            layer += ("stop", frozenset(self.stopwords))
+            words = cache.layer(layer, text, lambda: [word for word in words
+                                                      if not self.is_stopword(word)])
+        return words
+
+    def normalize_documents(
+        self,
+        documents: Iterable[tuple[int, str]],
+        workers: int = 1,
+        chunksize: int = 32,
+    ) -> Iterator[Document]:
+        """Build a Document for each (ident, text) pair, in order, on up to `workers` processes."""
+        if workers <= 1:
+            for (ident, text) in documents:
+                yield self.document_class(ident, self.normalize_text(text))
+            return
+        documents = iter(documents)
+        # each worker gets its own settings-only copy rather than pickling the corpus per task
+        worker = self.empty_copy()
+        worker.token_cache = None
+        with ProcessPoolExecutor(workers, initializer=_init_normalizer,
+                                 initargs=(worker,)) as pool:
+            # Executor.map submits everything up front, so feed it bounded windows
+            while window := list(itertools.islice(documents, workers * chunksize * 4)):
+                if self.token_cache is None:
+                    yield from pool.map(_normalize_in_worker, window, chunksize=chunksize)
+                    continue
+                # only tokenize what the cache lacks; the per-token filters are cheap
+                layer = (self.tokenizer_name,)
+                missing = list({text: None for (_, text) in window
+                                if not self.token_cache.contains(layer, text)})
+                tokenized = dict(zip(missing, pool.map(_tokenize_in_worker, missing,
+                                                       chunksize=chunksize)))
+                for (ident, text) in window:
+                    yield self.document_class(ident, self.cached_normalize_text(text, tokenized.get(text)))
+
+    def index_document(self, doc: Document) -> Document:
+        with PROFILER.stage("index_document"), self.index.lock:
+            doc_id = self.index.add(doc.terms, doc.counts)
+            self.document_table.append(doc)
+            self.doc_ids_by_ident[doc.ident] = doc_id
         return doc
 
+    def delete_document(self, ident: int) -> Document:
+        """Remove the document with `ident` from the index; KeyError if there is none."""
+        with self.index.lock:
+            doc_id = self.doc_ids_by_ident[ident]
+            self.index.delete(doc_id)
+            del self.doc_ids_by_ident[ident]
+            doc = self.document_table[doc_id]
+            self.document_table[doc_id] = None
+        return doc
+
+    def update_document(self, ident: int, text: str) -> Document:
+        """Replace the text of document `ident`, atomically for concurrent queries."""
+        doc = self.document_class(ident, self.normalize_text(text))
+        with self.index.lock:
+            self.delete_document(ident)
+            return self.index_document(doc)
+
+    def add_document(self, ident: int, text: str) -> Document:
+        return self.index_document(self.document_class(ident, self.normalize_text(text)))
+
+    def add_documents(
+        self,
+        documents: Iterable[tuple[int, str]],
+        workers: int = 1,
+        chunksize: int = 32,
+    ) -> list[Document]:
+        """Bulk add_document for (ident, text) pairs.
+
+        Documents are indexed in input order, so the index is the same
+        whatever the number of workers.
+        """
+        with PROFILER.stage("add_documents"):
+            return [self.index_document(doc)
+                    for doc in self.normalize_documents(documents, workers, chunksize)]
+
+    def save_index(self, path: Path):
+        # deleted documents are dropped, so doc ids are compacted in the saved index
+        storage.save_index(path, [doc for doc in self.document_table if doc is not None],
+                           self.normalization_settings())
+
+    def load_index(self, path: Path):
+        """Replace this instance's corpus with a memory-mapped saved index.
+
+        Raises storage.IndexSettingsMismatch if the index was built with
+        different normalization settings.
+        """
+        self.index, self.document_table = storage.load_index(
+            path, self.normalization_settings(), self.document_class)
+        self.doc_ids_by_ident = {ident: doc_id
+                                 for (doc_id, ident) in enumerate(self.document_table.idents.tolist())}
+
     def parse_document(self, path: str) -> Document:
         doc = ET.parse(path)
         text = ""
@@ -109,19 +428,16 @@ class InfoRet:
         return self.query_class(ident, self.normalize_text(text))
 
     def term_idf(self, term: str) -> float:
-        freq = sum(doc.word_frequencies[term] for doc in self.documents)
-        return math.log(len(self.documents) / (1 + freq))
+        return float(self.statistics.idfs(np.array([TERMS.lookup(term)]))[0])
 
     def document_term_freq(self, term: str, doc: Document) -> float:
-        return doc.word_frequencies[term] / doc.length
+        return doc.frequency(term) / doc.length
 
     def query_idf_vector(self, query: Query) -> np.ndarray:
-        return np.array([self.term_idf(term) for term in query.unique_tokens()])
+        return self.statistics.idfs(query.unique_terms())
 
     def document_tf_vector(self, query: Query, doc: Document) -> np.ndarray:
-        return np.array([self.document_term_freq(term, doc)
-                         for term
-                         in query.unique_tokens()])
+        return doc.frequencies_of(query.unique_terms()) / doc.length
 
     def document_tf_idf_vector(
         self,
@@ -131,37 +447,234 @@ class InfoRet:
     ) -> np.ndarray:
         return self.document_tf_vector(query, doc) * idfs
 
-    def query_all_document_vectors(
-        self,
-        query: Query,
-        idfs: np.ndarray,
-    ) -> dict[Document, np.ndarray]:
-        return { doc: self.document_tf_idf_vector(doc, query, idfs) for doc in self.documents }
-
     def vector_similarity(self, left: np.ndarray, right: np.ndarray) -> float:
         # cosine similarity!
         return np.dot(left, right) / (linalg.norm(left) * linalg.norm(right))
         
 
-    def sort_results(
+    def max_score_results(self, query: Query, top_k: int) -> list[tuple[Document, float]]:
+        """Top k by MaxScore dynamic pruning over the query's postings.
+
+        Restricted to the terms S a document contains, its cosine is at most
+        |q_S| / |q| (Cauchy-Schwarz), so each term's bound is its share of
+        the squared query norm. Terms whose cumulative bound cannot beat the
+        current k-th best score are non-essential: documents only found in
+        their postings are never visited. Documents that are visited score
+        exactly as in perform_queries.
+        """
+        if top_k <= 0 or not self.statistics.doc_count:
+            return []
+        # the idfs of the scores themselves: collection-wide ones when this index is a shard
+        batch = QueryBatch([query], self.statistics.idfs)
+        bounds = dict(zip(TERMS.strings(batch.terms), (batch.counts * batch.weights * batch.weights).tolist()))
+        query_norm2 = sum(bounds.values())
+        if query_norm2 == 0:
+            return []
+        # ascending bound, so non-essential terms are always a prefix
+        terms = sorted((term for term in bounds if self.index.term_postings(term)),
+                       key=lambda term: bounds[term])
+        prefix = list(itertools.accumulate(bounds[term] for term in terms))
+        postings = [self.index.term_postings(term) for term in terms]
+        cursors = [0] * len(terms)
+        slack = 1 + 1e-9 # never prune on a rounding error
+
+        heap = []
+        threshold = self.inclusion_threshold
+        first_essential = 0
+        while True:
+            while (first_essential < len(terms)
+                   and math.sqrt(prefix[first_essential] / query_norm2) * slack <= threshold):
+                first_essential += 1
+            if first_essential == len(terms):
+                break
+            doc_id = min((postings[i][cursors[i]][0]
+                          for i in range(first_essential, len(terms))
+                          if cursors[i] < len(postings[i])), default=None)
+            if doc_id is None:
+                break
+            bound = prefix[first_essential - 1] if first_essential else 0.0
+            for i in range(first_essential, len(terms)):
+                if cursors[i] < len(postings[i]) and postings[i][cursors[i]][0] == doc_id:
+                    bound += bounds[terms[i]]
+                    cursors[i] += 1
+            if math.sqrt(bound / query_norm2) * slack <= threshold:
+                continue
+            doc = self.document_table[doc_id]
+            score = batch.document_cosine(doc.frequencies_of(batch.terms), doc.length)
+            if PROFILER.enabled:
+                PROFILER.count("documents scored")
+            if not score > threshold:
+                continue
+            # doc ids only grow, so an equal score never displaces an earlier document
+            entry = (score, -doc_id, doc)
+            if len(heap) < top_k:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heapreplace(heap, entry)
+            if len(heap) == top_k:
+                threshold = max(self.inclusion_threshold, heap[0][0])
+        return [(doc, score) for (score, _, doc) in sorted(heap, key=lambda entry: entry[:2], reverse = True)]
+
+    def result_settings(self) -> tuple:
+        """Everything besides the query terms and the index that decides a query's results."""
+        return (type(self).__name__, repr(self.scoring), self.inclusion_threshold)
+
+    def result_key(self, query: Query, top_k: Optional[int], path) -> tuple:
+        # queries normalizing to the same terms share results, whatever their text
+        return (frozenset(zip(query.terms.tolist(), query.counts.tolist())), top_k, path, self.result_settings())
+
+    def cached_results(
+        self,
+        queries: list[Query],
+        top_k: Optional[int],
+        path,
+        compute,
+    ) -> list[list[tuple[Document, float]]]:
+        """Results from result_cache, calling compute(queries) for the ones it lacks."""
+        with self.index.lock:
+            cache = self.result_cache
+            cache.validate(self.index)
+            keys = [self.result_key(query, top_k, path) for query in queries]
+            found = {}
+            for key in keys:
+                if key not in found:
+                    found[key] = cache.get(key)
+            # each distinct missing term set is computed once
+            missing = {key: query for (key, query) in zip(keys, queries) if found[key] is None}
+            if missing:
+                for (key, ranked) in zip(missing, compute(list(missing.values()))):
+                    cache.put(key, ranked)
+                    found[key] = ranked
+            # copies, so callers cannot change what is cached
+            return [list(found[key]) for key in keys]
+
+    def perform_query(
         self,
-        results: dict[Document, np.ndarray],
-        query: Query
+        query: Query,
+        top_k: Optional[int] = None,
+        prune: bool = False,
     ) -> list[tuple[Document, float]]:
-        idfs = self.query_idf_vector(query)
-        query_tfidf = self.document_tf_idf_vector(query, query, idfs)
-        doc_vecs = self.query_all_document_vectors(query, idfs)
-        tuples = []
-        for (doc, doc_tfidf) in doc_vecs.items():
-            score = self.vector_similarity(query_tfidf, doc_tfidf)
-            if score > self.inclusion_threshold:
-                tuples.append((doc, score))
-        return sorted(tuples, key=lambda pair: pair[1], reverse = True)
-
-    def perform_query(self, query: Query) -> list[tuple[Document, float]]:
-        idfs = self.query_idf_vector(query)
-        docs = self.query_all_document_vectors(query, idfs)
-        return self.sort_results(docs, query)
+        with PROFILER.stage("perform_query"):
+            if self.result_cache is None:
+                return self.score_query(query, top_k, prune)
+            return self.cached_results([query], top_k, ("query", prune),
+                                       lambda queries: [self.score_query(queries[0], top_k, prune)])[0]
+
+    def perform_queries(
+        self,
+        queries: list[Query],
+        top_k: Optional[int] = None,
+    ) -> list[list[tuple[Document, float]]]:
+        """Batched equivalent of calling perform_query on each query."""
+        with PROFILER.stage("perform_queries"):
+            if self.result_cache is None:
+                return self.score_queries(queries, top_k)
+            return self.cached_results(queries, top_k, "batch",
+                                       lambda missing: self.score_queries(missing, top_k))
+
+    def score_query(
+        self,
+        query: Query,
+        top_k: Optional[int] = None,
+        prune: bool = False,
+    ) -> list[tuple[Document, float]]:
+        """perform_query without the result cache."""
+        if not (prune and top_k is not None and self.scoring.vector_space):
+            # a batch of one through the same kernel as perform_queries, so
+            # both give the same scores and so the same order of ties
+            return self.score_queries([query], top_k)[0]
+        # the MaxScore bounds are cosine specific. The lock keeps index
+        # updates out until the query is done
+        timer = StageTimer()
+        with self.index.lock:
+            with timer.stage("score"):
+                ranked = self.max_score_results(query, top_k)
+        self.last_query_timings = timer
+        self.query_timings.merge(timer)
+        return ranked
+
+    def score_queries(
+        self,
+        queries: list[Query],
+        top_k: Optional[int] = None,
+    ) -> list[list[tuple[Document, float]]]:
+        """perform_queries without the result cache."""
+        timer = StageTimer()
+        results = []
+        with self.index.lock:
+            for (doc_ids, scores) in self.query_score_rows(queries, timer):
+                with timer.stage("rank"):
+                    results.append([(self.document_table[doc_ids[i]], float(scores[i]))
+                                    for i in top_k_ids(scores, self.inclusion_threshold, top_k).tolist()])
+        self.last_query_timings = timer
+        self.query_timings.merge(timer)
+        return results
+
+    def query_score_rows(
+        self,
+        queries: list[Query],
+        timer: Optional[StageTimer] = None,
+    ) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """Each query's (doc ids, scores), query_batch_size queries at a time.
+
+        Only the live documents sharing a term with the query are scored,
+        so the cost follows their postings, not the collection; doc ids
+        ascend, so `matrix.top_k` over the scores breaks ties as a dense
+        row would. Each batch sees one state of the index; hold
+        `index.lock` around the whole iteration to look the doc ids up in
+        that same state. `timer` gets the stages of every batch: for the
+        vector space models "idf" and "query_vector", the query side, then
+        for all models "score", one pass over the postings of the query
+        terms that weighs the candidate documents and scores them.
+        """
+        timer = StageTimer() if timer is None else timer
+        for start in range(0, len(queries), self.query_batch_size):
+            statistics = self.statistics
+            with PROFILER.stage("score_batch"):
+                batch = QueryBatch(queries[start:start + self.query_batch_size], statistics.idfs)
+                if self.scoring.vector_space:
+                    # computed once per batch and shared by every segment
+                    with timer.stage("idf"):
+                        batch.idfs
+                    with timer.stage("query_vector"):
+                        (batch.weights, batch.norms)
+                with timer.stage("score"), self.index.lock:
+                    parts = []
+                    for segment in self.index.segment_views():
+                        if not segment.live_count:
+                            continue
+                        with PROFILER.stage("segment"):
+                            (owner, local, scores) = self.scoring.scores(segment, statistics, batch)
+                            live = segment.live[local]
+                            parts.append((owner[live], segment.doc_ids[local[live]], scores[live]))
+                        if PROFILER.enabled:
+                            PROFILER.count("documents scored", int(live.sum()))
+                    (owner, doc_ids, scores) = (np.concatenate([part[column] for part in parts] or [np.zeros(0)])
+                                                for column in range(3))
+                    # segments interleave in doc id order once merged
+                    order = np.lexsort((doc_ids, owner))
+                    (doc_ids, scores) = (doc_ids[order].astype(np.int64), scores[order])
+                    bounds = np.searchsorted(owner[order], np.arange(batch.size + 1))
+            # outside the stage: the caller's work between queries is not ours
+            for (begin, end) in zip(bounds.tolist(), bounds[1:].tolist()):
+                yield doc_ids[begin:end], scores[begin:end]
+
+# process pool state for InfoRet.normalize_documents and the query server
+_normalizer: Optional[InfoRet] = None
+
+def _init_normalizer(instance: InfoRet):
+    global _normalizer
+    _normalizer = instance
+
+def _normalize_in_worker(pair: tuple[int, str]) -> Document:
+    (ident, text) = pair
+    return _normalizer.document_class(ident, _normalizer.normalize_text(text))
+
+def _tokenize_in_worker(text: str) -> list[str]:
+    return _normalizer.tokenize(text)
+
+def _normalize_text_in_worker(text: str) -> list[str]:
+    return _normalizer.normalize_text(text)
 
 #Subclassed some things to integrate spacy -Owen
 class SpacyInfoRet(InfoRet):
@@ -170,6 +683,9 @@ class SpacyInfoRet(InfoRet):
     stemmer: bool
     punct: bool
     use_vector: int
+    model: str
+    disable: tuple[str, ...]
+    ann_rerank: int = 4 # candidates per requested result re-scored exactly under PQ
 
     def __init__(
         self,
@@ -178,52 +694,299 @@ class SpacyInfoRet(InfoRet):
         punct = False,
         stemmer = False,
         downcase = False,
-        use_vector = 0
-
+        use_vector = 0,
+        token_cache = None,
+        scoring = None,
+        result_cache = None,
+        model = DEFAULT_SPACY_MODEL,
+        disable = DEFAULT_SPACY_DISABLE,
+        ann: Optional[IVFIndex] = None,
     ):
-        self.documents: set[Document] = set()
-        self.downcase = downcase
-        self.stopwords = stopwords
+        # approximate search for the word vector modes when a top_k is asked for
+        self.ann = ann
+        super().__init__(stopwords = stopwords, stemmer = stemmer, downcase = downcase,
+                         token_cache = token_cache, scoring = scoring, result_cache = result_cache)
         self.punct = punct
-        self.stemmer = stemmer
         self.use_vector = use_vector
+        self.model = model
+        self.disable = tuple(disable)
 
-    def add_document(self, ident: int, text: str) -> Document:
-        spacy_doc = nlp(text)
-        doc = self.document_class(ident, normalize_spacy_doc(spacy_doc, self.stemmer, self.stopwords, self.punct))
-        self.documents.add(doc)
-        return doc
+    @property
+    def nlp(self) -> "Language":
+        # loaded by the first document or query, not by constructing the instance
+        return load_spacy_model(self.model, self.disable)
 
-    def make_query(self, ident: int, text: str) -> Query:
-        spacy_doc = nlp(text)
-        return self.query_class(ident, normalize_spacy_doc(spacy_doc, self.stemmer, self.stopwords, self.punct))
+    def spacy_layer(self) -> tuple:
+        return ("spacy", self.model)
+
+    def spacy_attributes(self, text: str) -> list[tuple[str, bool, str, bool]]:
+        if self.token_cache is None:
+            return spacy_token_attributes(self.nlp(text))
+        return self.token_cache.layer(self.spacy_layer(), text,
+                                      lambda: spacy_token_attributes(self.nlp(text)))
+
+    def normalize_text(self, text: str) -> list[str]:
+        return normalize_spacy_attributes(self.spacy_attributes(text),
+                                          self.stemmer, self.stopwords, self.punct)
 
-    def sort_results(
+    def normalize_documents(
         self,
-        results: dict[Document, np.ndarray],
-        query: Query
+        documents: Iterable[tuple[int, str]],
+        workers: int = 1,
+        chunksize: int = 32,
+    ) -> Iterator[Document]:
+        # spaCy does its own multiprocessing and batching. Only texts missing
+        # from token_cache go through nlp.pipe; `pending` holds everything read
+        # so far, so documents still come out in input order.
+        layer = self.spacy_layer()
+        pending = deque()
+
+        def uncached_texts():
+            for (ident, text) in documents:
+                attributes = None
+                if self.token_cache is not None:
+                    attributes = self.token_cache.get(layer, text)
+                pending.append((ident, text, attributes))
+                if attributes is None:
+                    yield text
+
+        def finish(ident, attributes):
+            return self.document_class(
+                ident, normalize_spacy_attributes(attributes, self.stemmer, self.stopwords, self.punct))
+
+        for spacy_doc in self.nlp.pipe(uncached_texts(), n_process = workers, batch_size = chunksize):
+            while pending[0][2] is not None:
+                (ident, _, attributes) = pending.popleft()
+                yield finish(ident, attributes)
+            (ident, text, _) = pending.popleft()
+            attributes = spacy_token_attributes(spacy_doc)
+            if self.token_cache is not None:
+                self.token_cache.put(layer, text, attributes)
+            yield finish(ident, attributes)
+        for (ident, _, attributes) in pending:
+            yield finish(ident, attributes)
+
+    def normalization_settings(self) -> dict:
+        return {
+            "class": type(self).__name__,
+            "model": self.model,
+            "downcase": self.downcase,
+            "stopwords": self.stopwords,
+            "stemmer": self.stemmer,
+            "punct": self.punct,
+        }
+
+    def clear(self):
+        # an ANN index given to the constructor, trained or loaded, is kept for
+        # the documents about to be added; one holding this instance's own
+        # documents goes with them
+        if self.ann is not None and hasattr(self, "embeddings"):
+            self.ann = self.ann.untrained_copy()
+        super().clear()
+        # unit document embeddings for the word vector modes, row = doc id
+        self.embeddings = EmbeddingMatrix()
+
+    def save_index(self, path: Path):
+        super().save_index(path)
+        (Path(path) / ANN_DIR / ANN_META_FILE).unlink(missing_ok = True)
+        # the saved index compacts doc ids, which the ANN index's would not match
+        if self.ann is not None and self.ann.trained and self.index.doc_count == len(self.document_table):
+            self.ann.save(Path(path) / ANN_DIR)
+
+    def load_index(self, path: Path):
+        super().load_index(path)
+        # embeddings are not part of the saved index; rebuild them from the documents
+        self.embeddings = EmbeddingMatrix()
+        if (Path(path) / ANN_DIR / ANN_META_FILE).exists():
+            self.ann = IVFIndex.load(Path(path) / ANN_DIR)
+        elif self.ann is not None and self.ann.count != len(self.document_table):
+            self.ann = self.ann.untrained_copy()
+        if self.use_vector != 0:
+            for doc in self.document_table:
+                self.embeddings.append(self.embedding(doc))
+
+    def index_document(self, doc: Document) -> Document:
+        super().index_document(doc)
+        if self.use_vector != 0:
+            self.embeddings.append(self.embedding(doc))
+        return doc
+
+    def text_vector(self, doc: Document) -> np.ndarray:
+        """Mean word vector of the document's tokens that have one."""
+        vocab = self.nlp.vocab
+        total = np.zeros(vocab.vectors_length, dtype=np.float32)
+        count = 0
+        for (term, freq) in zip(TERMS.strings(doc.terms), doc.counts.tolist()):
+            if vocab.has_vector(term):
+                total += freq * vocab.get_vector(term)
+                count += freq
+        return total / count if count else total
+
+    def text_vector_norm(self, doc: Document) -> np.ndarray:
+        """Like text_vector, but every word vector is scaled to unit length first."""
+        vocab = self.nlp.vocab
+        total = np.zeros(vocab.vectors_length, dtype=np.float32)
+        count = 0
+        for (term, freq) in zip(TERMS.strings(doc.terms), doc.counts.tolist()):
+            if vocab.has_vector(term):
+                total += freq * unit_vector(vocab.get_vector(term))
+                count += freq
+        return total / count if count else total
+
+    def embedding(self, doc: Document) -> np.ndarray:
+        if self.use_vector == 1:
+            return unit_vector(self.text_vector(doc))
+        return unit_vector(self.text_vector_norm(doc))
+
+    def ann_index(self) -> IVFIndex:
+        # trained on first use, then topped up with documents added since;
+        # retrained if it holds more documents than this instance has
+        if self.ann.count > len(self.embeddings):
+            self.ann = self.ann.untrained_copy()
+        if not self.ann.trained:
+            self.ann.train(self.embeddings.matrix)
+        elif self.ann.count < len(self.embeddings):
+            self.ann.add(self.embeddings.matrix[self.ann.count:])
+        return self.ann
+
+    def ann_results(self, query_vecs: np.ndarray, top_k: int) -> list[list[tuple[Document, float]]]:
+        ann = self.ann_index()
+        candidates = top_k * self.ann_rerank if ann.pq_subspaces else top_k
+        results = []
+        for (query_vec, (doc_ids, scores)) in zip(query_vecs, ann.search(query_vecs, candidates)):
+            if ann.pq_subspaces:
+                # PQ scores are estimates; re-score the candidates exactly
+                scores = self.embeddings.matrix[doc_ids] @ query_vec
+            # deleted documents stay in the ANN index until it is rebuilt
+            scores = np.where([self.document_table[doc_id] is not None for doc_id in doc_ids.tolist()],
+                              scores, np.nan)
+            results.append([(self.document_table[doc_ids[i]], float(scores[i]))
+                            for i in top_k_ids(scores, self.inclusion_threshold, top_k)])
+        return results
+
+    def result_settings(self) -> tuple:
+        ann = None if self.ann is None else (self.ann.n_lists, self.ann.nprobe, self.ann.pq_subspaces,
+                                             self.ann_rerank)
+        return super().result_settings() + (self.use_vector, ann)
+
+    def score_queries(
+        self,
+        queries: list[Query],
+        top_k: Optional[int] = None,
+    ) -> list[list[tuple[Document, float]]]:
+        if self.use_vector == 0:
+            return super().score_queries(queries, top_k)
+        # dense mode: one product against the embedding matrix per batch
+        timer = StageTimer()
+        results = []
+        with self.index.lock:
+            for start in range(0, len(queries), self.query_batch_size):
+                batch = queries[start:start + self.query_batch_size]
+                with timer.stage("query_vector"):
+                    query_vecs = np.stack([self.embedding(query) for query in batch])
+                if self.ann is not None and top_k is not None and len(self.embeddings):
+                    with timer.stage("ann_search"):
+                        results.extend(self.ann_results(query_vecs, top_k))
+                    continue
+                with timer.stage("score"):
+                    scores = self.embeddings.scores(query_vecs)
+                    if self.index.doc_count < len(self.document_table):
+                        scores[:, ~self.index.live_mask()] = np.nan
+                with timer.stage("rank"):
+                    for row in scores:
+                        results.append([(self.document_table[doc_id], float(row[doc_id]))
+                                        for doc_id in top_k_ids(row, self.inclusion_threshold, top_k)])
+        self.last_query_timings = timer
+        self.query_timings.merge(timer)
+        return results
+
+    def score_query(
+        self,
+        query: Query,
+        top_k: Optional[int] = None,
+        prune: bool = False,
     ) -> list[tuple[Document, float]]:
-        tuples = []
         if self.use_vector == 0:
-            idfs = self.query_idf_vector(query)
-            query_tfidf = self.document_tf_idf_vector(query, query, idfs)
-            doc_vecs = self.query_all_document_vectors(query, idfs)
-            for (doc, doc_tfidf) in doc_vecs.items():
-                score = self.vector_similarity(query_tfidf, doc_tfidf)
-                if score > self.inclusion_threshold:
-                    tuples.append((doc, score))
-        elif self.use_vector == 1:
-            queryvec = self.text_vector(query)
-            for doc in self.documents:
-                docvec = self.text_vector(doc)
-                score = self.vector_similarity(queryvec, docvec)
-                if score > self.inclusion_threshold:
-                    tuples.append((doc, score))
-        else:
-            queryvec = self.text_vector_norm(query)
-            for doc in self.documents:
-                docvec = self.text_vector_norm(doc)
-                score = self.vector_similarity(queryvec, docvec)
-                if score > self.inclusion_threshold:
-                    tuples.append((doc, score))
-        return sorted(tuples, key=lambda pair: pair[1], reverse = True)
\ No newline at end of file
+            return super().score_query(query, top_k, prune)
+        # the pruning bounds only hold for tf-idf cosine
+        return self.score_queries([query], top_k)[0]
+
+
+class HybridInfoRet(SpacyInfoRet):
+    """Two-stage retrieval: tf-idf picks candidates, word vectors re-rank them.
+
+    The lexical stage is the batched sparse cosine, cut off at `candidates`
+    documents. Only those are compared with the query embedding (`use_vector`
+    1 or 2 selects which), and the two scores are fused: by min-max scaled
+    interpolation weighted by `alpha` ("linear"), or by reciprocal rank with
+    constant `rrf_k` ("rrf"). The ANN index is not used.
+    """
+
+    candidates: int
+    fusion: str
+    alpha: float
+    rrf_k: int
+
+    def __init__(
+        self,
+        *,
+        candidates = 100,
+        fusion = "linear",
+        alpha = 0.5,
+        rrf_k = 60,
+        use_vector = 1,
+        **kwargs,
+    ):
+        if fusion not in ("linear", "rrf"):
+            raise ValueError(f"unknown fusion {fusion!r}, expected 'linear' or 'rrf'")
+        if use_vector == 0:
+            raise ValueError("HybridInfoRet needs a word vector mode, use_vector = 1 or 2")
+        super().__init__(use_vector = use_vector, **kwargs)
+        self.candidates = candidates
+        self.fusion = fusion
+        self.alpha = alpha
+        self.rrf_k = rrf_k
+
+    def fuse(self, lexical: np.ndarray, dense: np.ndarray) -> np.ndarray:
+        if self.fusion == "linear":
+            return linear_fusion(lexical, dense, self.alpha)
+        return reciprocal_rank_fusion(lexical, dense, self.rrf_k)
+
+    def result_settings(self) -> tuple:
+        return super().result_settings() + (self.candidates, self.fusion, self.alpha, self.rrf_k)
+
+    def score_queries(
+        self,
+        queries: list[Query],
+        top_k: Optional[int] = None,
+    ) -> list[list[tuple[Document, float]]]:
+        timer = StageTimer()
+        results = []
+        with self.index.lock:
+            rows = self.query_score_rows(queries)
+            for query in queries:
+                with timer.stage("lexical"):
+                    (doc_ids, scores) = next(rows)
+                    picked = top_k_ids(scores, self.inclusion_threshold, self.candidates)
+                    (doc_ids, lexical) = (doc_ids[picked], scores[picked])
+                if not len(doc_ids):
+                    results.append([])
+                    continue
+                with timer.stage("rerank"):
+                    dense = self.embeddings.matrix[doc_ids] @ self.embedding(query)
+                    fused = self.fuse(lexical, dense)
+                    # candidates are in lexical order, so fused ties keep it
+                    results.append([(self.document_table[doc_ids[i]], float(fused[i]))
+                                    for i in top_k_ids(fused, -np.inf, top_k)])
+        self.last_query_timings = timer
+        self.query_timings.merge(timer)
+        return results
+
+    def score_query(
+        self,
+        query: Query,
+        top_k: Optional[int] = None,
+        prune: bool = False,
+    ) -> list[tuple[Document, float]]:
+        # the first stage is the batched sparse product, so prune is not used
+        return self.score_queries([query], top_k)[0]
@@ -0,0 +1,246 @@
+"""Approximate nearest-neighbour search over unit vectors (inner product).
+
+`IVFIndex` is an inverted file: k-means splits the collection into `n_lists`
+cells, and a query only scans the `nprobe` cells whose centroids are closest
+to it. Raising nprobe trades speed for recall. With `pq_subspaces` set,
+each vector's residual from its cell centroid is stored as product-
+quantization codes (one byte per subspace) and scored by table lookup; the
+caller can re-rank the surviving candidates against the exact vectors.
+"""
+import json
+import math
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+FORMAT_VERSION = 2
+META_FILE = "meta.json"
+
+
+def kmeans(
+    points: np.ndarray,
+    k: int,
+    iterations: int,
+    rng: np.random.Generator,
+    spherical: bool,
+) -> np.ndarray:
+    """Lloyd's k-means. Spherical mode assigns by inner product and keeps unit centroids."""
+    k = min(k, len(points))
+    centroids = points[rng.choice(len(points), k, replace = False)].astype(np.float32)
+    for _ in range(iterations):
+        assignment = assign(points, centroids, spherical)
+        counts = np.bincount(assignment, minlength = k)
+        # per-cell sums via one sorted reduceat, much faster than np.add.at
+        order = np.argsort(assignment, kind = "stable")
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        sums[filled] = np.add.reduceat(points[order], starts, axis = 0)
+        empty = counts == 0
+        # reseed empty cells with random points rather than letting them die
+        sums[empty] = points[rng.choice(len(points), int(empty.sum()))]
+        counts[empty] = 1
+        centroids = sums / counts[:, None]
+        if spherical:
+            norms = np.linalg.norm(centroids, axis = 1, keepdims = True)
+            centroids = centroids / np.where(norms > 0, norms, 1)
+    return centroids.astype(np.float32)
+
+
+def assign(points: np.ndarray, centroids: np.ndarray, spherical: bool) -> np.ndarray:
+    if spherical:
+        return np.argmax(points @ centroids.T, axis = 1)
+    distances = (centroids * centroids).sum(axis = 1) - 2 * points @ centroids.T
+    return np.argmin(distances, axis = 1)
+
+
+class IVFIndex:
+    """Inverted-file ANN index, optionally product-quantized.
+
+    Row ids are positions in the matrix passed to `train`/`add`, so for
+    SpacyInfoRet they are doc ids.
+    """
+
+    n_lists: Optional[int]
+    nprobe: int
+    pq_subspaces: int
+    count: int
+
+    def __init__(
+        self,
+        n_lists: Optional[int] = None,
+        nprobe: int = 8,
+        pq_subspaces: int = 0,
+        iterations: int = 20,
+        training_sample: int = 256,
+        seed: int = 0,
+    ):
+        self.n_lists = n_lists  # default 4 * sqrt(N) at training time
+        self.nprobe = nprobe
+        self.pq_subspaces = pq_subspaces
+        self.iterations = iterations
+        self.training_sample = training_sample  # points per cell used for k-means
+        self.seed = seed
+        self.count = 0
+        self.centroids: Optional[np.ndarray] = None
+        self.codebooks: Optional[np.ndarray] = None  # (subspaces, 256, width)
+        # per-list rows, grown by add(); packed into arrays for searching
+        self._lists: Optional[list[list[int]]] = []
+        self._payloads: Optional[list[list[np.ndarray]]] = []
+        self._packed = None
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def untrained_copy(self) -> "IVFIndex":
+        """A fresh index with the same parameters."""
+        return IVFIndex(self.n_lists, self.nprobe, self.pq_subspaces, self.iterations,
+                        self.training_sample, self.seed)
+
+    def train(self, vectors: np.ndarray):
+        """Fit the coarse quantizer (and PQ codebooks) to `vectors` and index them."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        rng = np.random.default_rng(self.seed)
+        n_lists = self.n_lists or max(1, int(4 * math.sqrt(len(vectors))))
+        sample_size = min(len(vectors), n_lists * self.training_sample)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace = False)]
+        self.centroids = kmeans(sample, n_lists, self.iterations, rng, spherical = True)
+        if self.pq_subspaces:
+            dims = vectors.shape[1]
+            if dims % self.pq_subspaces:
+                raise ValueError(f"{dims} dimensions do not split into {self.pq_subspaces} subspaces")
+            width = dims // self.pq_subspaces
+            residuals = sample - self.centroids[assign(sample, self.centroids, spherical = True)]
+            self.codebooks = np.stack([
+                kmeans(residuals[:, s * width:(s + 1) * width], 256, self.iterations, rng, spherical = False)
+                for s in range(self.pq_subspaces)])
+        self._lists = [[] for _ in range(len(self.centroids))]
+        self._payloads = [[] for _ in range(len(self.centroids))]
+        self.count = 0
+        self.add(vectors)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        width = self.codebooks.shape[2]
+        codes = np.empty((len(vectors), self.pq_subspaces), dtype=np.uint8)
+        for s in range(self.pq_subspaces):
+            codes[:, s] = assign(vectors[:, s * width:(s + 1) * width], self.codebooks[s], spherical = False)
+        return codes
+
+    def add(self, vectors: np.ndarray):
+        """Append rows `count ...` to their nearest cells; the quantizer is not retrained."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+        if self._lists is None:
+            self._unpack()
+        cells = assign(vectors, self.centroids, spherical = True)
+        payloads = self.encode(vectors - self.centroids[cells]) if self.pq_subspaces else vectors
+        for (offset, cell) in enumerate(cells.tolist()):
+            self._lists[cell].append(self.count + offset)
+            self._payloads[cell].append(payloads[offset])
+        self.count += len(vectors)
+        self._packed = None
+
+    def _unpack(self):
+        # back to growable per-cell lists, e.g. after load()
+        (indptr, ids, payload) = self._packed
+        cells = range(len(indptr) - 1)
+        self._lists = [ids[indptr[c]:indptr[c + 1]].tolist() for c in cells]
+        self._payloads = [list(payload[indptr[c]:indptr[c + 1]]) for c in cells]
+
+    def _pack(self):
+        # one contiguous id array and payload array, cells laid out back to back
+        if self._packed is None:
+            indptr = np.zeros(len(self._lists) + 1, dtype=np.int64)
+            np.cumsum([len(ids) for ids in self._lists], out = indptr[1:])
+            ids = np.fromiter((i for ids in self._lists for i in ids), dtype=np.int64, count = indptr[-1])
+            width = self.pq_subspaces or self.centroids.shape[1]
+            dtype = np.uint8 if self.pq_subspaces else np.float32
+            payload = (np.stack([row for rows in self._payloads for row in rows])
+                       if indptr[-1] else np.zeros((0, width), dtype = dtype))
+            self._packed = (indptr, ids, payload)
+        return self._packed
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """(ids, scores) of the best k rows for each unit query, best first.
+
+        Scores are exact inner products, or PQ estimates for a quantized index.
+        """
+        (indptr, ids, payload) = self._pack()
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        coarse = queries @ self.centroids.T
+        probes = np.argpartition(-coarse, nprobe - 1, axis = 1)[:, :nprobe]
+        results = []
+        if self.pq_subspaces:
+            width = self.codebooks.shape[2]
+        for (query_id, (query, cells)) in enumerate(zip(queries, probes)):
+            sizes = indptr[cells + 1] - indptr[cells]
+            positions = np.concatenate([np.arange(indptr[c], indptr[c + 1]) for c in cells])
+            if self.pq_subspaces:
+                # q . x = q . centroid + q . residual; the latter from a
+                # per-subspace table of q . codeword
+                tables = np.einsum("sw,scw->sc", query.reshape(self.pq_subspaces, width), self.codebooks)
+                scores = (np.repeat(coarse[query_id, cells], sizes)
+                          + tables[np.arange(self.pq_subspaces), payload[positions]].sum(axis = 1))
+            else:
+                scores = payload[positions] @ query
+            if k < len(scores):
+                best = np.argpartition(-scores, k - 1)[:k]
+            else:
+                best = np.arange(len(scores))
+            best = best[np.argsort(-scores[best], kind = "stable")]
+            results.append((ids[positions[best]], scores[best]))
+        return results
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.mkdir(parents = True, exist_ok = True)
+        (path / META_FILE).unlink(missing_ok = True)
+        (indptr, ids, payload) = self._pack()
+        np.save(path / "centroids.npy", self.centroids)
+        np.save(path / "indptr.npy", indptr)
+        np.save(path / "ids.npy", ids)
+        np.save(path / "payload.npy", payload)
+        if self.pq_subspaces:
+            np.save(path / "codebooks.npy", self.codebooks)
+        with open(path / META_FILE, "w") as out:
+            json.dump({
+                "format": FORMAT_VERSION,
+                "nprobe": self.nprobe,
+                "pq_subspaces": self.pq_subspaces,
+                # only used to train again, by untrained_copy
+                "iterations": self.iterations,
+                "training_sample": self.training_sample,
+                "seed": self.seed,
+                "count": self.count,
+            }, out)
+
+    @classmethod
+    def load(cls, path: Path) -> "IVFIndex":
+        path = Path(path)
+        with open(path / META_FILE) as inp:
+            meta = json.load(inp)
+        if meta["format"] != FORMAT_VERSION:
+            raise ValueError(f"{path} has ANN format {meta['format']}, expected {FORMAT_VERSION}")
+        index = cls(nprobe = meta["nprobe"], pq_subspaces = meta["pq_subspaces"], iterations = meta["iterations"],
+                    training_sample = meta["training_sample"], seed = meta["seed"])
+        index.centroids = np.load(path / "centroids.npy")
+        index.n_lists = len(index.centroids)
+        if index.pq_subspaces:
+            index.codebooks = np.load(path / "codebooks.npy")
+        indptr = np.load(path / "indptr.npy")
+        ids = np.load(path / "ids.npy", mmap_mode = "r")
+        payload = np.load(path / "payload.npy", mmap_mode = "r")
+        index._packed = (indptr, ids, payload)
+        # searching reads the mapped arrays; the lists are only rebuilt if add() is called
+        index._lists = None
+        index._payloads = None
+        index.count = meta["count"]
+        return index
@@ -0,0 +1,89 @@
+"""Recall@k and queries/sec of IVFIndex (flat and PQ) against exact search.
+
+usage: python ann_benchmark.py [--docs N] [--dims D] [--k K]
+       python ann_benchmark.py --cranfield cran.all.1400 cran.qry [--k K]
+
+The default corpus is synthetic: unit vectors drawn around random cluster
+centres, which is roughly how document embeddings behave. --cranfield uses
+SpacyInfoRet word-vector embeddings of the real collection instead.
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from inforet.ann import IVFIndex
+
+
+def synthetic(docs: int, queries: int, dims: int, clusters: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dims))
+    def draw(n):
+        points = centres[rng.integers(clusters, size = n)] + 0.6 * rng.standard_normal((n, dims))
+        return (points / np.linalg.norm(points, axis = 1, keepdims = True)).astype(np.float32)
+    return draw(docs), draw(queries)
+
+
+def cranfield(docs: Path, queries: Path):
+    from inforet import SpacyInfoRet
+    from inforet.cranfield import parse_cran_docs, parse_cran_queries
+    instance = SpacyInfoRet(stopwords = True, punct = True, use_vector = 1)
+    parse_cran_docs(docs, instance)
+    query_vecs = np.stack([instance.embedding(query) for query in parse_cran_queries(queries, instance)])
+    return instance.embeddings.matrix, query_vecs
+
+
+def exact(vectors, query_vecs, k):
+    scores = query_vecs @ vectors.T
+    best = np.argpartition(-scores, k - 1, axis = 1)[:, :k]
+    return [set(row.tolist()) for row in best]
+
+
+def recall(truth, found):
+    return np.mean([len(t & set(ids.tolist())) / len(t) for (t, (ids, _)) in zip(truth, found)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cranfield", nargs = 2, type = Path)
+    parser.add_argument("--docs", type = int, default = 100_000)
+    parser.add_argument("--queries", type = int, default = 500)
+    parser.add_argument("--dims", type = int, default = 96)
+    parser.add_argument("--k", type = int, default = 10)
+    args = parser.parse_args()
+
+    if args.cranfield:
+        vectors, query_vecs = cranfield(*args.cranfield)
+    else:
+        vectors, query_vecs = synthetic(args.docs, args.queries, args.dims, clusters = 200)
+    k = args.k
+
+    start = time.perf_counter()
+    truth = exact(vectors, query_vecs, k)
+    exact_qps = len(query_vecs) / (time.perf_counter() - start)
+    print(f"{len(vectors)} docs, {vectors.shape[1]} dims, {len(query_vecs)} queries, k={k}")
+    print(f"{'index':<10}{'nprobe':>8}{'recall@k':>10}{'qps':>10}{'train s':>9}")
+    print(f"{'exact':<10}{'-':>8}{1.0:>10.3f}{exact_qps:>10.0f}{'-':>9}")
+
+    for pq in (0, 8):
+        if pq and vectors.shape[1] % pq:
+            continue
+        index = IVFIndex(pq_subspaces = pq)
+        start = time.perf_counter()
+        index.train(vectors)
+        trained = time.perf_counter() - start
+        # round-trip through disk so the timed index is the memory-mapped one
+        with tempfile.TemporaryDirectory() as tmp:
+            index.save(Path(tmp))
+            index = IVFIndex.load(Path(tmp))
+            for nprobe in (1, 2, 4, 8, 16, 32):
+                start = time.perf_counter()
+                found = index.search(query_vecs, k * (4 if pq else 1), nprobe)
+                qps = len(query_vecs) / (time.perf_counter() - start)
+                if pq:
+                    # what SpacyInfoRet does: exact re-rank of the PQ candidates
+                    found = [(ids[np.argsort(-(vectors[ids] @ q), kind = "stable")[:k]], None)
+                             for (q, (ids, _)) in zip(query_vecs, found)]
+                name = f"ivf-pq{pq}" if pq else "ivf-flat"
+                print(f"{name:<10}{nprobe:>8}{recall(truth, found):>10.3f}{qps:>10.0f}{trained:>9.2f}")
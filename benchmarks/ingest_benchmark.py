@@ -0,0 +1,39 @@
+"""Ingestion throughput of InfoRet.add_documents against worker count.
+
+usage: python ingest_benchmark.py cran.all.1400 [workers ...] [--spacy]
+"""
+import os
+import time
+from sys import argv
+from pathlib import Path
+from inforet import InfoRet, SpacyInfoRet
+from inforet.cranfield import iter_cran_docs, class_stop_words
+
+
+def make_instance(spacy: bool) -> InfoRet:
+    if spacy:
+        return SpacyInfoRet(stopwords = True, stemmer = True, punct = True)
+    return InfoRet(stopwords = set(class_stop_words))
+
+
+def postings_of(instance: InfoRet) -> dict:
+    return {term: instance.index.term_postings(term) for term in instance.index}
+
+
+if __name__ == "__main__":
+    args = [arg for arg in argv[1:] if not arg.startswith("--")]
+    spacy = "--spacy" in argv
+    docs = list(iter_cran_docs(Path(args[0])))
+    worker_counts = [int(n) for n in args[1:]] or sorted({1, 2, 4, os.cpu_count() or 1})
+
+    baseline = None
+    print(f"{'workers':>8}{'seconds':>10}{'docs/sec':>12}{'same index':>12}")
+    for workers in worker_counts:
+        instance = make_instance(spacy)
+        start = time.perf_counter()
+        instance.add_documents(docs, workers)
+        elapsed = time.perf_counter() - start
+        postings = postings_of(instance)
+        if baseline is None:
+            baseline = postings
+        print(f"{workers:>8}{elapsed:>10.2f}{len(docs) / elapsed:>12.1f}{str(postings == baseline):>12}")
@@ -0,0 +1,103 @@
+"""Closed-loop load against inforet.server: client-side latency and throughput.
+
+usage: python load_generator.py cran.qry [--concurrency C] [--requests N]
+       python load_generator.py cran.qry --serve cran.all.1400 [server options]
+
+Each of C connections sends a query, waits for the answer, and sends the
+next, cycling through the queries in cran.qry. With --serve the server is
+started as a subprocess first and stopped afterwards. The server's own
+counters are fetched at the end and printed next to the client's.
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from inforet.collection import iter_cran_records
+
+
+async def client(host: str, port: int, texts: list[str], count: int, offset: int, top_k: int) -> list[float]:
+    (reader, writer) = await asyncio.open_connection(host, port)
+    latencies = []
+    for i in range(count):
+        request = {"id": i, "query": texts[(offset + i) % len(texts)], "top_k": top_k}
+        start = time.perf_counter()
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        reply = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - start)
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+    writer.close()
+    return latencies
+
+
+async def server_stats(host: str, port: int) -> dict:
+    (reader, writer) = await asyncio.open_connection(host, port)
+    writer.write(b'{"id": 0, "stats": true}\n')
+    await writer.drain()
+    stats = json.loads(await reader.readline())["stats"]
+    writer.close()
+    return stats
+
+
+async def wait_for_server(host: str, port: int, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            (_, writer) = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def run(args, texts: list[str]):
+    per_client = [args.requests // args.concurrency + (i < args.requests % args.concurrency)
+                  for i in range(args.concurrency)]
+    start = time.perf_counter()
+    results = await asyncio.gather(*(client(args.host, args.port, texts, count, i * 7, args.top_k)
+                                     for (i, count) in enumerate(per_client)))
+    elapsed = time.perf_counter() - start
+    latencies = np.array([latency for result in results for latency in result]) * 1000
+    print(f"{'concurrency':>12}{'requests':>10}{'qps':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    print(f"{args.concurrency:>12}{len(latencies):>10}{len(latencies) / elapsed:>10.1f}"
+          f"{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 99):>10.2f}")
+    print("server:", json.dumps(await server_stats(args.host, args.port)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("queries", type = Path)
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--concurrency", type = int, default = 32)
+    parser.add_argument("--requests", type = int, default = 5000)
+    parser.add_argument("--top-k", type = int, default = 10)
+    parser.add_argument("--serve", type = Path, metavar = "DOCS", help = "start a server on DOCS first")
+    parser.add_argument("--workers", type = int, default = 2)
+    parser.add_argument("--max-batch", type = int, default = 64)
+    parser.add_argument("--max-wait-ms", type = float, default = 2.0)
+    args = parser.parse_args()
+
+    texts = [record.text().replace("\n", " ") for record in iter_cran_records(args.queries)]
+    server = None
+    if args.serve:
+        server = subprocess.Popen([sys.executable, "-m", "inforet.server", str(args.serve),
+                                   "--host", args.host, "--port", str(args.port),
+                                   "--workers", str(args.workers), "--max-batch", str(args.max_batch),
+                                   "--max-wait-ms", str(args.max_wait_ms)])
+    try:
+        if server is not None:
+            asyncio.run(wait_for_server(args.host, args.port, timeout = 120))
+        asyncio.run(run(args, texts))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
@@ -0,0 +1,135 @@
+"""Bytes per document and per posting, array-backed index vs. the layout it replaced.
+
+usage: python memory_benchmark.py cran.all.1400 [--synthetic-docs N] [--vocabulary V] [--mean-length L]
+
+Two corpora: cran.all.1400 normalized with the class stopwords, and N
+synthetic documents (default 1,000,000) of Zipf-distributed terms. Each
+is indexed into a SegmentedIndex as InfoRet does, and sized two ways:
+
+  before  a Counter of term strings per Document, in its instance dict,
+          and per segment int64 doc ids, float64 tfs and float64 tf/length
+          for every posting, plus a term -> row dict. Tokenizers return a
+          new string per token, so each Counter held its own copies of its
+          terms.
+  after   Documents with __slots__ and int32 term id and count arrays, and
+          varbyte coded postings; the shared term table is counted apart.
+
+Documents are sized with sys.getsizeof, container by container; postings
+by the bytes of their arrays.
+"""
+import argparse
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+from inforet import Document, InfoRet
+from inforet.cranfield import class_stop_words, iter_cran_docs
+from inforet.segments import SegmentedIndex
+from inforet.terms import TERMS
+from zipf import vocabulary_words, zipf_documents
+
+SMALL_INTS = 256  # CPython shares int objects up to here
+
+
+class LegacyDocument:
+    def __init__(self, ident: int, text: list[str]):
+        self.ident = ident
+        self.word_frequencies = Counter(text)
+        self.length = len(text)
+
+
+def legacy_document_bytes(doc: LegacyDocument) -> int:
+    counts = doc.word_frequencies
+    return (sys.getsizeof(doc) + sys.getsizeof(doc.__dict__) + sys.getsizeof(counts)
+            + sum(sys.getsizeof(term) for term in counts)
+            + sum(sys.getsizeof(tf) for tf in counts.values() if tf > SMALL_INTS))
+
+
+def document_bytes(doc: Document) -> int:
+    return sys.getsizeof(doc) + sys.getsizeof(doc.terms) + sys.getsizeof(doc.counts)
+
+
+def legacy_postings_bytes(index: SegmentedIndex) -> int:
+    total = 0
+    for segment in index.segment_views():
+        matrix = segment.matrix
+        vocabulary = dict(zip(TERMS.strings(matrix.terms), range(len(matrix.terms))))
+        total += 24 * int(matrix.indptr[-1]) + matrix.indptr.nbytes + sys.getsizeof(vocabulary)
+    return total
+
+
+def term_table_bytes() -> int:
+    return (sys.getsizeof(TERMS.ids) + sys.getsizeof(TERMS.terms)
+            + sum(sys.getsizeof(term) for term in TERMS.terms))
+
+
+def cran_documents(path: Path) -> Iterator[tuple[int, list[str]]]:
+    normalizer = InfoRet(stopwords = set(class_stop_words))
+    for (ident, text) in iter_cran_docs(path):
+        yield ident, normalizer.normalize_text(text)
+
+
+def synthetic_documents(
+    count: int,
+    vocabulary: int,
+    mean_length: float,
+    seed: int = 0,
+) -> Iterator[tuple[int, list[str]]]:
+    words = vocabulary_words(vocabulary)
+    documents = zipf_documents(count, vocabulary, mean_length, np.random.default_rng(seed))
+    for (ident, ranks) in enumerate(documents):
+        # a new string per token, as a tokenizer would return
+        yield ident, ["".join(words[rank]) for rank in ranks]
+
+
+def measure(name: str, documents: Iterator[tuple[int, list[str]]]) -> dict:
+    start = time.perf_counter()
+    terms_before = term_table_bytes()
+    index = SegmentedIndex()
+    docs = []
+    before = after = 0
+    for (ident, text) in documents:
+        before += legacy_document_bytes(LegacyDocument(ident, text))
+        doc = Document(ident, text)
+        after += document_bytes(doc)
+        index.add(doc.terms, doc.counts)
+        docs.append(doc)
+    index.flush()
+    postings = sum(int(segment.matrix.indptr[-1]) for segment in index.segment_views())
+    return {
+        "corpus": name,
+        "docs": len(docs),
+        "postings": postings,
+        "segments": len(index.segment_views()),
+        "doc before": before / len(docs),
+        "doc after": after / len(docs),
+        "posting before": legacy_postings_bytes(index) / postings,
+        "posting after": sum(segment.matrix.nbytes for segment in index.segment_views()) / postings,
+        "term table MB": (term_table_bytes() - terms_before) / 2 ** 20,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("docs", type = Path)
+    parser.add_argument("--synthetic-docs", type = int, default = 1_000_000)
+    parser.add_argument("--vocabulary", type = int, default = 200_000)
+    parser.add_argument("--mean-length", type = float, default = 60)
+    args = parser.parse_args()
+
+    rows = [measure(args.docs.name, cran_documents(args.docs))]
+    if args.synthetic_docs:
+        rows.append(measure(f"synthetic {args.synthetic_docs}",
+                            synthetic_documents(args.synthetic_docs, args.vocabulary, args.mean_length)))
+    print(f"{'corpus':<20}{'docs':>9}{'postings':>12}{'B/doc':>16}{'B/posting':>16}"
+          f"{'terms MB':>10}{'seconds':>9}")
+    print(f"{'':<20}{'':>9}{'':>12}{'before':>8}{'after':>8}{'before':>8}{'after':>8}")
+    for row in rows:
+        print(f"{row['corpus']:<20}{row['docs']:>9}{row['postings']:>12}"
+              f"{row['doc before']:>8.0f}{row['doc after']:>8.0f}"
+              f"{row['posting before']:>8.2f}{row['posting after']:>8.2f}"
+              f"{row['term table MB']:>10.1f}{row['seconds']:>9.1f}")
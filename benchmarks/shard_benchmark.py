@@ -0,0 +1,58 @@
+"""Index and query time of a ShardedIndex against shard count, checked against one InfoRet.
+
+usage: python shard_benchmark.py cran.all.1400 cran.qry [shards ...] [--bm25]
+
+Every shard is a local process. Queries are the whole query file in one
+perform_queries call, top 100 each. The last columns compare the results
+with those of a single InfoRet over the whole collection: identical
+(doc ident, score) lists, and the largest score difference.
+"""
+import os
+import time
+from sys import argv
+from pathlib import Path
+from inforet import InfoRet
+from inforet.collection import iter_cran_records
+from inforet.cranfield import iter_cran_docs, class_stop_words
+from inforet.scoring import BM25
+from inforet.shards import ShardedIndex
+
+TOP_K = 100
+
+
+def make_instance(bm25: bool) -> InfoRet:
+    return InfoRet(stopwords = set(class_stop_words), downcase = True, tokenizer = "fast",
+                   scoring = BM25() if bm25 else None)
+
+
+if __name__ == "__main__":
+    args = [arg for arg in argv[1:] if not arg.startswith("--")]
+    bm25 = "--bm25" in argv
+    docs = list(iter_cran_docs(Path(args[0])))
+    query_texts = [(ident, record.text()) for (ident, record) in enumerate(iter_cran_records(Path(args[1])), start = 1)]
+    shard_counts = [int(n) for n in args[2:]] or sorted({1, 2, 4, os.cpu_count() or 1})
+
+    single = make_instance(bm25)
+    start = time.perf_counter()
+    single.add_documents(docs)
+    index_seconds = time.perf_counter() - start
+    queries = [single.make_query(ident, text) for (ident, text) in query_texts]
+    start = time.perf_counter()
+    expected = [[(doc.ident, score) for (doc, score) in ranked] for ranked in single.perform_queries(queries, TOP_K)]
+    query_seconds = time.perf_counter() - start
+
+    print(f"{'shards':>8}{'index s':>10}{'query s':>10}{'same results':>14}{'max diff':>10}")
+    print(f"{'none':>8}{index_seconds:>10.2f}{query_seconds:>10.2f}")
+    for shards in shard_counts:
+        with ShardedIndex(make_instance(bm25), shards) as sharded:
+            start = time.perf_counter()
+            sharded.add_documents(docs)
+            sharded.refresh()
+            index_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            results = sharded.perform_queries(queries, TOP_K)
+            query_seconds = time.perf_counter() - start
+        difference = max((abs(score - other) for (ranked, other_ranked) in zip(expected, results)
+                          for ((_, score), (_, other)) in zip(ranked, other_ranked)), default = 0.0)
+        print(f"{shards:>8}{index_seconds:>10.2f}{query_seconds:>10.2f}{str(results == expected):>14}"
+              f"{difference:>10.1e}")
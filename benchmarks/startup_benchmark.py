@@ -0,0 +1,66 @@
+"""Cold-start cost of the package: import, first query, and steady state.
+
+Each configuration runs in a fresh interpreter so nothing is already loaded.
+
+usage: python startup_benchmark.py cran.all.1400 cran.qry [queries]
+"""
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+def child(mode: str, docs: Path, queries: Path, count: int):
+    timings = {}
+    start = time.perf_counter()
+    import inforet
+    from inforet.cranfield import iter_cran_docs, parse_cran_queries, class_stop_words
+    timings["import"] = time.perf_counter() - start
+    timings["spacy imported"] = "spacy" in sys.modules
+    if mode == "import":
+        print(json.dumps(timings))
+        return
+
+    if mode == "spacy":
+        instance = inforet.SpacyInfoRet(stopwords = True, stemmer = True, punct = True)
+    else:
+        instance = inforet.InfoRet(stopwords = set(class_stop_words))
+    # a small corpus keeps this about startup rather than indexing
+    start = time.perf_counter()
+    first_text = next(iter_cran_docs(docs))
+    instance.add_documents([first_text])
+    timings["first document"] = time.perf_counter() - start
+
+    instance.add_documents(list(iter_cran_docs(docs))[1:200])
+    all_queries = parse_cran_queries(queries, instance)[:count]
+    start = time.perf_counter()
+    instance.perform_query(all_queries[0])
+    timings["first query"] = time.perf_counter() - start
+    start = time.perf_counter()
+    for query in all_queries[1:]:
+        instance.perform_query(query)
+    timings["steady query"] = (time.perf_counter() - start) / max(1, len(all_queries) - 1)
+    print(json.dumps(timings))
+
+
+if __name__ == "__main__":
+    if sys.argv[1] == "--child":
+        child(sys.argv[2], Path(sys.argv[3]), Path(sys.argv[4]), int(sys.argv[5]))
+        sys.exit()
+
+    docs, queries = sys.argv[1], sys.argv[2]
+    count = sys.argv[3] if len(sys.argv) > 3 else "20"
+    print(f"{'mode':<8}{'import s':>10}{'spacy?':>8}{'1st doc s':>11}{'1st query s':>13}{'steady ms':>11}")
+    for mode in ("import", "infoRet", "spacy"):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, __file__, "--child", mode, docs, queries, count],
+                             capture_output = True, text = True)
+        if out.returncode:
+            print(f"{mode:<8} failed: {out.stderr.strip().splitlines()[-1]}")
+            continue
+        t = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{mode:<8}{t['import']:>10.3f}{str(t['spacy imported']):>8}"
+              f"{t.get('first document', float('nan')):>11.3f}"
+              f"{t.get('first query', float('nan')):>13.3f}"
+              f"{t.get('steady query', float('nan')) * 1000:>11.3f}")
@@ -0,0 +1,269 @@
+"""Parse, index, query and evaluate times and memory over synthetic collections of growing size.
+
+usage: python suite.py [--sizes N ...] [--only NAME ...] [--spacy] [--data DIR]
+                       [--out results.json] [--compare baseline.json] [--tolerance 0.25]
+
+For each size (default 10,000, 100,000 and 1,000,000 documents) a
+collection is generated once into --data and reused by later runs: a
+Cranfield style .I/.W document file of Zipf-distributed words, a query
+file, and a cranqrel style judgements file. Each query is a few of the
+less common words of one document, plus a common one; that document is
+its only relevant one (a known-item search), so MAP is mostly a sanity
+check that the configuration still finds things.
+
+Every (size, configuration) pair runs in a fresh process, so its peak
+resident memory is its own, and times
+
+  parse     reading the document and query files
+  index     add_documents
+  query     perform_query one query at a time, for the latency
+            percentiles, over the first --latency-queries queries;
+            then perform_queries over all of them, top 100 each
+  evaluate  writing the batch results as a run file and scoring it
+            with cranfield_score
+
+with the peak RSS after each stage. The rows go to --out as JSON, with
+the commit and machine they were taken on. Given --compare, each timing
+is checked against the same row of an earlier file, and the suite exits
+with status 1 if any is more than --tolerance slower.
+"""
+import argparse
+import fnmatch
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+import traceback
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from inforet import InfoRet, SpacyInfoRet
+from inforet.collection import iter_cran_records
+from inforet.cranfield import class_stop_words, iter_cran_docs, print_results
+from inforet.cranfield_score import Judgements, evaluate, means
+from inforet.scoring import BM25
+from inforet.sweep import peak_rss_mb
+from zipf import vocabulary_words, zipf_documents
+
+TOP_K = 100
+SENTENCE = 20    # words between full stops
+COMMON = 100     # the most frequent words; one of them goes in every query
+TIMINGS = ("parse s", "index s", "query p50 ms", "query p99 ms", "batch s", "evaluate s")
+
+
+def configurations(spacy: bool) -> list[tuple[str, InfoRet]]:
+    tests = [
+        ("cosine", InfoRet(stopwords = set(class_stop_words))),
+        ("cosine fast", InfoRet(stopwords = set(class_stop_words), tokenizer = "fast")),
+        ("bm25 fast", InfoRet(stopwords = set(class_stop_words), tokenizer = "fast", scoring = BM25())),
+    ]
+    if spacy:
+        tests += [
+            ("spacy", SpacyInfoRet(stopwords = True, stemmer = True, punct = True)),
+            ("spacy bm25", SpacyInfoRet(stopwords = True, stemmer = True, punct = True, scoring = BM25())),
+        ]
+    return tests
+
+
+class Collection:
+    """The three files of one generated collection."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.docs = directory / "docs.all"
+        self.queries = directory / "queries.qry"
+        self.judgements = directory / "qrels"
+
+    def exists(self) -> bool:
+        # written last, so only there once the others are complete
+        return self.judgements.exists()
+
+
+def generate(
+    collection: Collection,
+    count: int,
+    vocabulary: int,
+    mean_length: float,
+    queries: int,
+    seed: int = 0,
+):
+    rng = np.random.default_rng(seed)
+    words = vocabulary_words(vocabulary)
+    seeds = set(rng.choice(count, min(queries, count), replace = False).tolist())
+    known = {}  # seed document ident -> its words' ranks
+    collection.directory.mkdir(parents = True, exist_ok = True)
+    with open(collection.docs, "w") as out:
+        for (ident, ranks) in enumerate(zipf_documents(count, vocabulary, mean_length, rng), start = 1):
+            text = [words[rank] for rank in ranks]
+            sentences = [" ".join(text[at:at + SENTENCE]) + " ." for at in range(0, len(text), SENTENCE)]
+            out.write(f".I {ident}\n.W\n" + "\n".join(sentences) + "\n")
+            if ident - 1 in seeds:
+                known[ident] = ranks
+
+    with open(collection.queries, "w") as out:
+        for (position, ident) in enumerate(sorted(known), start = 1):
+            rare = sorted(set(rank for rank in known[ident] if rank >= COMMON))
+            picked = rng.choice(rare, min(len(rare), int(rng.integers(2, 6))), replace = False).tolist() if rare else []
+            picked.append(int(rng.integers(COMMON)))
+            out.write(f".I {position:03}\n.W\n{' '.join(words[rank] for rank in picked)} .\n")
+    # numbered by position, as cranqrel does; 1 is the most relevant grade
+    judgements = "".join(f"{position} {ident} 1\n" for (position, ident) in enumerate(sorted(known), start = 1))
+    temporary = collection.judgements.with_suffix(".tmp")
+    temporary.write_text(judgements)
+    temporary.replace(collection.judgements)
+
+
+def run(task: tuple[int, str, InfoRet, Collection, int]) -> dict:
+    """One row: every stage of one configuration over one collection."""
+    (size, name, instance, collection, latency_queries) = task
+    row = {"docs": size, "configuration": name}
+    try:
+        start = time.perf_counter()
+        documents = list(iter_cran_docs(collection.docs))
+        query_texts = [(ident, record.text())
+                       for (ident, record) in enumerate(iter_cran_records(collection.queries), start = 1)]
+        row["parse s"] = time.perf_counter() - start
+        row["parse MB"] = peak_rss_mb()
+
+        start = time.perf_counter()
+        instance.add_documents(documents)
+        row["index s"] = time.perf_counter() - start
+        row["index MB"] = peak_rss_mb()
+        del documents
+
+        queries = [instance.make_query(ident, text) for (ident, text) in query_texts]
+        latencies = []
+        for query in queries[:latency_queries]:
+            start = time.perf_counter()
+            instance.perform_query(query, TOP_K)
+            latencies.append(time.perf_counter() - start)
+        row["query p50 ms"] = 1000 * float(np.percentile(latencies, 50))
+        row["query p99 ms"] = 1000 * float(np.percentile(latencies, 99))
+        start = time.perf_counter()
+        results = instance.perform_queries(queries, TOP_K)
+        row["batch s"] = time.perf_counter() - start
+        row["query MB"] = peak_rss_mb()
+
+        start = time.perf_counter()
+        run_path = collection.directory / f"run {name}"
+        with open(run_path, "w") as out:
+            for (query, ranked) in zip(queries, results):
+                print_results(query, ranked, out)
+        (metrics, missing) = evaluate(Judgements(collection.judgements), run_path)
+        row["evaluate s"] = time.perf_counter() - start
+        row["evaluate MB"] = peak_rss_mb()
+        row["MAP"] = means(metrics)["average precision"]
+        row["missing"] = len(missing)
+    except Exception:
+        row["error"] = traceback.format_exc(limit = 3).strip().splitlines()[-1]
+    return row
+
+
+def git_commit() -> Optional[str]:
+    try:
+        root = Path(__file__).resolve().parent.parent
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd = root, capture_output = True,
+                                text = True, check = True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd = root,
+                               capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def environment() -> dict:
+    return {
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(timespec = "seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(rows: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    """The timings of `rows` more than `tolerance` slower than the same row of `baseline`."""
+    before = {(row["docs"], row["configuration"]): row for row in baseline}
+    regressions = []
+    for row in rows:
+        old = before.get((row["docs"], row["configuration"]))
+        if old is None:
+            continue
+        for timing in TIMINGS:
+            if timing in row and old.get(timing):
+                ratio = row[timing] / old[timing]
+                if ratio > 1 + tolerance:
+                    regressions.append(f"{row['docs']} {row['configuration']} {timing}: "
+                                       f"{old[timing]:.3f} -> {row[timing]:.3f} ({ratio:.2f}x)")
+    return regressions
+
+
+def print_table(rows: list[dict]):
+    columns = TIMINGS + ("query MB", "MAP")
+    width = max(len(row["configuration"]) for row in rows)
+    print(f"{'docs':>9} {'configuration':<{width}}" + "".join(f"{column:>14}" for column in columns))
+    for row in rows:
+        if "error" in row:
+            print(f"{row['docs']:>9} {row['configuration']:<{width}}  {row['error']}")
+            continue
+        print(f"{row['docs']:>9} {row['configuration']:<{width}}"
+              + "".join(f"{row[column]:>14.3f}" for column in columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [10_000, 100_000, 1_000_000])
+    parser.add_argument("--only", nargs = "+", metavar = "NAME",
+                        help = "configurations to run, by name or glob (default all)")
+    parser.add_argument("--spacy", action = "store_true", help = "also run the SpacyInfoRet configurations")
+    parser.add_argument("--vocabulary", type = int, default = 200_000)
+    parser.add_argument("--mean-length", type = float, default = 60)
+    parser.add_argument("--queries", type = int, default = 200)
+    parser.add_argument("--latency-queries", type = int, default = 100,
+                        help = "queries timed one at a time; at a million documents each can take seconds")
+    parser.add_argument("--data", type = Path, default = Path("suite-data"), help = "where collections are kept")
+    parser.add_argument("--out", type = Path, default = Path("suite.json"))
+    parser.add_argument("--compare", type = Path, help = "an earlier --out file to check the timings against")
+    parser.add_argument("--tolerance", type = float, default = 0.25, help = "slowdown allowed before it is reported")
+    args = parser.parse_args()
+
+    tests = configurations(args.spacy)
+    if args.only:
+        tests = [(name, instance) for (name, instance) in tests
+                 if any(fnmatch.fnmatchcase(name, pattern) for pattern in args.only)]
+
+    rows = []
+    for size in args.sizes:
+        collection = Collection(args.data / f"zipf-{size}-{args.vocabulary}-{args.mean_length:g}-{args.queries}")
+        if not collection.exists():
+            print(f"generating {collection.directory}", file = sys.stderr, flush = True)
+            generate(collection, size, args.vocabulary, args.mean_length, args.queries)
+        for (name, instance) in tests:
+            print(f"running {name} on {size} documents", file = sys.stderr, flush = True)
+            # a process per run, so each one's peak memory is its own
+            with multiprocessing.Pool(1, maxtasksperchild = 1) as pool:
+                rows.append(pool.apply(run, ((size, name, instance, collection, args.latency_queries),)))
+
+    print_table(rows)
+    with open(args.out, "w") as out:
+        json.dump({"environment": environment(), "parameters": {
+            "vocabulary": args.vocabulary, "mean length": args.mean_length,
+            "queries": args.queries, "latency queries": args.latency_queries,
+        }, "rows": rows}, out, indent = 1)
+    print(f"results written to {args.out}")
+
+    if args.compare is not None:
+        with open(args.compare) as inp:
+            baseline = json.load(inp)
+        regressions = compare(rows, baseline["rows"], args.tolerance)
+        print(f"against {args.compare} ({baseline['environment'].get('commit')}): "
+              f"{len(regressions)} timings more than {args.tolerance:.0%} slower")
+        for regression in regressions:
+            print(f"  {regression}")
+        if regressions:
+            sys.exit(1)
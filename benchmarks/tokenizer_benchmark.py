@@ -0,0 +1,58 @@
+"""Normalization throughput in tokens/sec, nltk tokenizer vs. the fast one.
+
+usage: python tokenizer_benchmark.py cran.all.1400 [cran.qry] [--repeat N]
+
+Every text of the collection, and of the queries if given, is normalized
+by InfoRet under a few settings, once with tokenizer = "nltk" and then
+with tokenizer = "fast". The fast tokenizer's memo starts empty, so its
+first pass (cold) pays for tokenizing every distinct chunk; later passes
+(warm) are what indexing a large collection mostly looks like. The last
+column checks that both give the same words for every text.
+"""
+import argparse
+import time
+from pathlib import Path
+
+from inforet import InfoRet
+from inforet.collection import iter_cran_records
+from inforet.cranfield import class_stop_words
+
+
+def settings() -> list[tuple[str, dict]]:
+    stopwords = set(class_stop_words)
+    punct = {".", ",", "'", "?", "!", ";", ":"}
+    return [
+        ("plain", {}),
+        ("downcase", {"downcase": True}),
+        ("downcase punct stopwords", {"downcase": True, "stopwords": stopwords | punct}),
+    ]
+
+
+def normalize_all(instance: InfoRet, texts: list[str]) -> tuple[list[list[str]], float]:
+    start = time.perf_counter()
+    words = [instance.normalize_text(text) for text in texts]
+    return words, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("docs", type = Path)
+    parser.add_argument("queries", type = Path, nargs = "?")
+    parser.add_argument("--repeat", type = int, default = 3, help = "warm passes of the fast tokenizer")
+    args = parser.parse_args()
+
+    texts = [record.text() for record in iter_cran_records(args.docs)]
+    if args.queries is not None:
+        texts += [record.text() for record in iter_cran_records(args.queries)]
+    # the fast tokenizer's raw tokens are the ones counted for both
+    tokens = sum(len(InfoRet(tokenizer = "fast").tokenize(text)) for text in texts)
+
+    print(f"{len(texts)} texts, {tokens} tokens")
+    print(f"{'settings':<26}{'nltk':>12}{'fast cold':>12}{'fast warm':>12}{'speedup':>9}{'same words':>12}")
+    for (name, kwargs) in settings():
+        (expected, nltk_seconds) = normalize_all(InfoRet(**kwargs), texts)
+        fast = InfoRet(tokenizer = "fast", **kwargs)
+        (words, cold_seconds) = normalize_all(fast, texts)
+        warm_seconds = min(normalize_all(fast, texts)[1] for _ in range(args.repeat))
+        print(f"{name:<26}{tokens / nltk_seconds:>12.0f}{tokens / cold_seconds:>12.0f}"
+              f"{tokens / warm_seconds:>12.0f}{nltk_seconds / warm_seconds:>8.1f}x{str(words == expected):>12}")
@@ -0,0 +1,46 @@
+"""Latency of exhaustive ranking vs. partial-sort top k vs. MaxScore pruning.
+
+usage: python topk_benchmark.py cran.all.1400 cran.qry [k ...]
+"""
+import time
+from sys import argv
+from pathlib import Path
+from statistics import mean, median
+from inforet import InfoRet
+from inforet.cranfield import parse_cran_docs, parse_cran_queries, class_stop_words
+
+
+def time_queries(instance, queries, **kwargs):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(instance.perform_query(query, **kwargs))
+        latencies.append(time.perf_counter() - start)
+    return latencies, results
+
+
+def same_ranking(left, right):
+    return all([(doc.ident, score) for (doc, score) in l]
+               == [(doc.ident, score) for (doc, score) in r]
+               for (l, r) in zip(left, right))
+
+
+if __name__ == "__main__":
+    docs = Path(argv[1])
+    queries = Path(argv[2])
+    ks = [int(k) for k in argv[3:]] or [10, 100]
+
+    instance = InfoRet(stopwords = set(class_stop_words))
+    parse_cran_docs(docs, instance)
+    all_queries = parse_cran_queries(queries, instance)
+
+    latencies, exhaustive = time_queries(instance, all_queries)
+    print(f"{'mode':<16}{'k':>6}{'mean ms':>10}{'p50 ms':>10}{'match':>8}")
+    print(f"{'exhaustive':<16}{'-':>6}{mean(latencies) * 1000:>10.3f}{median(latencies) * 1000:>10.3f}{'-':>8}")
+    for k in ks:
+        truncated = [ranked[:k] for ranked in exhaustive]
+        for (mode, prune) in (("partial sort", False), ("maxscore", True)):
+            latencies, results = time_queries(instance, all_queries, top_k = k, prune = prune)
+            print(f"{mode:<16}{k:>6}{mean(latencies) * 1000:>10.3f}"
+                  f"{median(latencies) * 1000:>10.3f}{str(same_ranking(truncated, results)):>8}")
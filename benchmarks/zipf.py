@@ -0,0 +1,34 @@
+"""Synthetic documents of Zipf-distributed words, shared by the benchmarks that generate collections."""
+from typing import Iterator
+
+import numpy as np
+
+# documents drawn at once
+CHUNK = 10_000
+
+
+def vocabulary_words(vocabulary: int) -> list[str]:
+    """The word of each rank, most common first."""
+    return [f"w{rank}" for rank in range(vocabulary)]
+
+
+def zipf_documents(
+    count: int,
+    vocabulary: int,
+    mean_length: float,
+    rng: np.random.Generator,
+) -> Iterator[list[int]]:
+    """The word ranks of `count` documents, in order.
+
+    Lengths are Poisson with mean `mean_length`, at least 1; words follow
+    Zipf's law, s = 1.1, over `vocabulary` words.
+    """
+    weights = 1 / np.arange(1, vocabulary + 1) ** 1.1
+    cumulative = np.cumsum(weights / weights.sum())
+    for start in range(0, count, CHUNK):
+        lengths = np.maximum(1, rng.poisson(mean_length, min(CHUNK, count - start)))
+        ranks = np.searchsorted(cumulative, rng.random(int(lengths.sum()))).clip(max = vocabulary - 1)
+        bounds = np.concatenate([[0], np.cumsum(lengths)]).tolist()
+        ranks = ranks.tolist()
+        for (begin, end) in zip(bounds, bounds[1:]):
+            yield ranks[begin:end]
@@ -0,0 +1,165 @@
+import sys
+import weakref
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from .profiling import PROFILER
+
+
+def estimate_size(text: str, value: list) -> int:
+    # rough: the key text, the list, and each element shallowly
+    return (sys.getsizeof(text) + sys.getsizeof(value)
+            + sum(sys.getsizeof(item) for item in value))
+
+
+class TokenCache:
+    """LRU cache of per-text normalization layers, shareable between instances.
+
+    Entries are keyed by (layer, text). A layer is a tuple naming the whole
+    chain of steps that produced it, e.g. ("nltk",) for raw tokens and
+    ("nltk", "lower", stopwords) for lowercased, stopped tokens, so an
+    instance reuses every prefix of its chain that another instance already
+    computed. Cached lists are shared and must not be mutated.
+    """
+
+    max_bytes: int
+    size: int
+    hits: int
+    misses: int
+
+    def __init__(self, max_bytes: int = 512 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[tuple, tuple[list, int]] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, layer: tuple, text: str) -> Optional[list]:
+        key = (layer, text)
+        entry = self.entries.get(key)
+        if PROFILER.enabled:
+            PROFILER.count("token cache misses" if entry is None else "token cache hits")
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def contains(self, layer: tuple, text: str) -> bool:
+        # a peek that counts as neither hit nor miss
+        return (layer, text) in self.entries
+
+    def put(self, layer: tuple, text: str, value: list):
+        key = (layer, text)
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        size = estimate_size(text, value)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            (_, (_, evicted)) = self.entries.popitem(last = False)
+            self.size -= evicted
+
+    def layer(self, layer: tuple, text: str, compute: Callable[[], list]) -> list:
+        value = self.get(layer, text)
+        if value is None:
+            value = compute()
+            self.put(layer, text, value)
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class ResultCache:
+    """LRU cache of ranked query results for one InfoRet instance.
+
+    Keys are built by `InfoRet.result_key`: the query's normalized term
+    multiset plus everything else that decides its results (top_k, the
+    query path, the scoring settings). Results are only valid for the
+    index state they were computed on, so the cache remembers which index,
+    at which generation, it was filled from and empties itself the first
+    time it is consulted after either changes.
+    """
+
+    max_bytes: int
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+
+    def __init__(self, max_bytes: int = 64 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[tuple, tuple[list, int]] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._index: Optional[weakref.ref] = None
+        self._generation = -1
+
+    def validate(self, index):
+        """Forget every entry unless `index` is the one they came from, unchanged."""
+        if (self._index is None or self._index() is not index
+                or self._generation != index.generation):
+            if self.entries:
+                self.invalidations += 1
+                self.clear()
+            self._index = weakref.ref(index)
+            self._generation = index.generation
+
+    def get(self, key: tuple) -> Optional[list]:
+        entry = self.entries.get(key)
+        if PROFILER.enabled:
+            PROFILER.count("result cache misses" if entry is None else "result cache hits")
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: tuple, results: list):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        # rough: the key's term pairs, the list, and a (document, score) tuple per result
+        size = (sys.getsizeof(key) + sys.getsizeof(key[0]) + 64 * len(key[0])
+                + sys.getsizeof(results) + 88 * len(results))
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (results, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            (_, (_, evicted)) = self.entries.popitem(last = False)
+            self.size -= evicted
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,127 @@
+"""Streaming reader for Cranfield-style `.I`/`.T`/`.A`/`.B`/`.W` collections.
+
+Records are found by searching for marker lines rather than reading line by
+line, and only carry field offsets into the source buffer; text is decoded
+when a field is asked for. With `use_mmap` the source is the memory-mapped
+file itself, so memory use does not grow with the collection.
+"""
+import mmap
+import re
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+# a field marker is a line starting with '.', a capital letter, then whitespace
+MARKER = re.compile(rb"\.([A-Z])(?=[ \t\r\n]|\Z)")
+
+
+class CranRecord:
+    """One `.I` record: its ident and (field, start, end) spans into `source`."""
+
+    __slots__ = ("ident", "source", "fields")
+
+    ident: int
+    source: bytes  # or the file's mmap
+    fields: list[tuple[str, int, int]]
+
+    def __init__(self, ident: int, source, fields: list[tuple[str, int, int]]):
+        self.ident = ident
+        self.source = source
+        self.fields = fields
+
+    def _decode(self, start: int, end: int) -> str:
+        # universal newlines, like reading the file in text mode
+        return self.source[start:end].decode("utf-8").replace("\r\n", "\n")
+
+    def field(self, name: str) -> str:
+        return "".join(self._decode(start, end)
+                       for (field, start, end) in self.fields if field == name)
+
+    def text(self, names: Optional[Iterable[str]] = None) -> str:
+        """Every field (or just `names`) concatenated in file order."""
+        if names is not None:
+            names = set(names)
+        return "".join(self._decode(start, end) for (field, start, end) in self.fields
+                       if names is None or field in names)
+
+
+def _scan(source, start: int, end: int) -> Iterator[tuple[str, bytes, int, int]]:
+    """Yield (marker, marker line remainder, body start, body end) for source[start:end].
+
+    Jumps from one line starting with '.' to the next, so body lines are
+    never looked at individually.
+    """
+    previous = None
+    pos = start
+    if source[pos:pos + 1] != b".":
+        pos = source.find(b"\n.", pos, end)
+        pos = end if pos < 0 else pos + 1
+    while pos < end:
+        match = MARKER.match(source, pos, end)
+        eol = source.find(b"\n", pos, end)
+        line_end = end if eol < 0 else eol + 1
+        if match:
+            if previous is not None:
+                (name, remainder, body_start) = previous
+                yield (name, remainder, body_start, max(body_start, pos))
+            remainder = source[pos + 2:line_end].strip()
+            # text after a field marker belongs to the field, as in `line[3:]`
+            body_start = pos + 3 if remainder and match.group(1) != b"I" else line_end
+            previous = (match.group(1).decode(), remainder, body_start)
+        nxt = source.find(b"\n.", line_end - 1, end)
+        pos = end if nxt < 0 else nxt + 1
+    if previous is not None:
+        (name, remainder, body_start) = previous
+        yield (name, remainder, body_start, max(body_start, end))
+
+
+def _records(source) -> Iterator[CranRecord]:
+    ident = None
+    fields = []
+    for (name, remainder, start, end) in _scan(source, 0, len(source)):
+        if name == "I":
+            if ident is not None:
+                yield CranRecord(ident, source, fields)
+            ident = int(remainder)
+            fields = []
+        elif ident is not None:
+            fields.append((name, start, end))
+    if ident is not None:
+        yield CranRecord(ident, source, fields)
+
+
+def iter_cran_records(path: Path, use_mmap: bool = True) -> Iterator[CranRecord]:
+    """Stream the records of a Cranfield-format file.
+
+    With `use_mmap` every record points into one mapping of the file, which
+    stays open until the generator finishes; decode what you need before
+    closing it. Without, the file is read in blocks and records point into
+    the block they came from.
+    """
+    with open(path, "rb") as inp:
+        if use_mmap:
+            try:
+                source = mmap.mmap(inp.fileno(), 0, access = mmap.ACCESS_READ)
+            except ValueError:
+                # empty file
+                return
+            with source:
+                yield from _records(source)
+        else:
+            yield from _block_records(inp)
+
+
+def _block_records(inp, block_size: int = 1 << 20) -> Iterator[CranRecord]:
+    # carry the possibly unfinished last record of each block into the next
+    pending = b""
+    while True:
+        block = inp.read(block_size)
+        data = pending + block
+        if not block:
+            yield from _records(data)
+            return
+        cut = data.rfind(b"\n.I ")
+        if cut < 0:
+            pending = data
+            continue
+        complete, pending = data[:cut + 1], data[cut + 1:]
+        yield from _records(complete)
@@ -1,9 +1,14 @@
-from inforet import SpacyInfoRet
+from inforet import SpacyInfoRet, HybridInfoRet
 from inforet import InfoRet, Query, Document
+from inforet.cache import TokenCache
+from inforet.profiling import PROFILER
+from inforet.scoring import BM25, BM25Plus, PivotedNormalization
+from inforet.collection import iter_cran_records
 from io import TextIOBase
-from typing import Type
+from typing import Type, Optional, Iterator
 from sys import argv
 from pathlib import Path
+from inforet.storage import IndexSettingsMismatch, META_FILE
 from nltk.corpus import stopwords
 from nltk.stem.snowball import EnglishStemmer
 
@@ -30,186 +35,222 @@ class_stop_words = ['a','the','an','and','or','but','about','above','after','alo
                            'you','your','yours','me','my','mine','I','we','us','much','and/or'
                            ]
 
-def parse_cran_docs(path: Path, instance: InfoRet):
-    with open(path, "r") as inp:
-        current_doc = ""
-        current_doc_id = 0
-        for line in inp.readlines():
-            if not line:
-                continue
-            if line[0:2] == ".I":
-                # finish the document and start a new one
-                if current_doc and current_doc_id:
-                    instance.add_document(current_doc_id, current_doc)
-                current_doc = ""
-                current_doc_id = int(line[3:])
-            elif line[0] == ".":
-                current_doc += line[3:]
-            else:
-                current_doc += line
-        # submit the final doc when there are no more lines
-        instance.add_document(current_doc_id, current_doc)
+def iter_cran_docs(path: Path, fields: Optional[str] = None) -> Iterator[tuple[int, str]]:
+    """(ident, text) for each document, text being `fields` (default all) joined."""
+    for record in iter_cran_records(path):
+        text = record.text(fields)
+        if text:
+            yield (record.ident, text)
+
+
+def parse_cran_docs(path: Path, instance: InfoRet, workers: int = 1):
+    with PROFILER.stage("parse_documents"):
+        instance.add_documents(iter_cran_docs(path), workers)
 
 
 def parse_cran_queries(path: Path, instance: InfoRet) -> list[Query]:
-    all_queries = []
-    with open(path, "r") as inp:
-        current_qry = ""
-        current_query_id = 0
-        for line in inp.readlines():
-            if not line:
-                continue
-            if line[0:2] == ".I":
-                # finish the current query and start a new one
-                if current_query_id:
-                    all_queries.append(instance.make_query(current_query_id, current_qry))
-                current_qry = ""
-                current_query_id += 1
-            elif line[0:2] == ".W":
-                current_qry += line[3:]
-            else:
-                current_qry += line
-    all_queries.append(instance.make_query(current_query_id, current_qry))
-    return all_queries
+    # queries are numbered by position, which is what cranqrel uses, not by .I
+    with PROFILER.stage("parse_queries"):
+        return [instance.make_query(query_id, record.text())
+                for (query_id, record) in enumerate(iter_cran_records(path), start = 1)]
+
+
+def print_results(query: Query, results: list[tuple[Document, float]], out: TextIOBase):
+    with PROFILER.stage("write"):
+        for (doc, score) in results:
+            out.write(f"{query.ident} {doc.ident} {score:.4f}\n")
+
 
 def query_and_print(instance: InfoRet, query: Query, out: TextIOBase):
-    for (doc, score) in instance.perform_query(query):
-        out.write(f"{query.ident} {doc.ident} {score:.4f}\n")
+    print_results(query, instance.perform_query(query), out)
 
 
 def run_cranqrel(
     documents_path: Path,
     queries_path: Path,
     output_path: Path,
-    instance: InfoRet = InfoRet()
+    instance: InfoRet = InfoRet(),
+    batch: bool = False,
+    index_path: Optional[Path] = None,
+    workers: int = 1,
 ):
-    parse_cran_docs(documents_path, instance)
+    # reuse a saved index for this configuration when there is one
+    loaded = False
+    if index_path is not None and (index_path / META_FILE).exists():
+        try:
+            with PROFILER.stage("load_index"):
+                instance.load_index(index_path)
+            loaded = True
+        except IndexSettingsMismatch as e:
+            print(f"rebuilding {index_path}: {e}")
+    if not loaded:
+        parse_cran_docs(documents_path, instance, workers)
+        if index_path is not None:
+            with PROFILER.stage("save_index"):
+                instance.save_index(index_path)
     with open(output_path, "w") as out:
-        for qry in parse_cran_queries(queries_path, instance):
-            query_and_print(instance, qry, out)
-
-
-if __name__ == "__main__":
-    docs = Path(argv[1])
-    queries = Path(argv[2])
-    try:
-        resultsdir = Path(argv[3])
-    except IndexError:
-        resultsdir = Path("results")
+        queries = parse_cran_queries(queries_path, instance)
+        if batch:
+            # every query through the sparse matrix backend in one call
+            for (qry, results) in zip(queries, instance.perform_queries(queries)):
+                print_results(qry, results, out)
+        else:
+            for qry in queries:
+                query_and_print(instance, qry, out)
 
-    resultsdir.mkdir(exist_ok = True)
 
+def configurations() -> list[tuple[str, InfoRet]]:
+    """Every configuration of the study, named as its results file."""
     stopwords = set(class_stop_words)
-
     punct = set([".", ",", "'", '?', '!', ';', ':'])
-
     punct_stopwords = stopwords.union(punct)
-
     stemmer = EnglishStemmer()
-
-    tests = [
-      #  ("00_simple",
-       #  InfoRet()),
+    return [
+        ("00_simple",
+         InfoRet()),
         # one feature
-   #     ("01_downcase",
-   #      InfoRet(downcase = True)),
-    #    ("02_punct",
-     #    InfoRet(stopwords = punct)),
+        ("01_downcase",
+         InfoRet(downcase = True)),
+        ("02_punct",
+         InfoRet(stopwords = punct)),
         ("03_nltkstopwords",
          InfoRet(stopwords = stopwords)),
- #       ("04_snowballstemmer",
-#         InfoRet(stemmer = stemmer)),
+        ("04_snowballstemmer",
+         InfoRet(stemmer = stemmer)),
         # two features, w/ downcase
-   #    ("05_downcase_punct",
-   #      InfoRet(downcase = True, stopwords = punct)),
-   #     ("06_downcase_nltkstopwords",
-  #       InfoRet(stopwords = stopwords, downcase = True)),
- #       ("07_downcase_snowballstemmer",
-#         InfoRet(downcase = True, stemmer = stemmer)),
-         #two features, w/ punct
+        ("05_downcase_punct",
+         InfoRet(downcase = True, stopwords = punct)),
+        ("06_downcase_nltkstopwords",
+         InfoRet(stopwords = stopwords, downcase = True)),
+        ("07_downcase_snowballstemmer",
+         InfoRet(downcase = True, stemmer = stemmer)),
+        # two features, w/ punct
         ("08_punct_nltkstopwords",
          InfoRet(stopwords = punct_stopwords)),
-     #   ("09_punct_snowballstemmer",
-     #    InfoRet(stopwords = punct, stemmer = stemmer)),
+        ("09_punct_snowballstemmer",
+         InfoRet(stopwords = punct, stemmer = stemmer)),
         # two features, w/ nltkstopwords
         ("10_nltkstopwords_snowballstemmer",
          InfoRet(stopwords = stopwords, stemmer = stemmer)),
-         #three features, not snowball
-    #    ("11_downcase_punct_nltkstopwords",
-     #    InfoRet(downcase = True, stopwords = punct_stopwords)),
+        # three features, not snowball
+        ("11_downcase_punct_nltkstopwords",
+         InfoRet(downcase = True, stopwords = punct_stopwords)),
         # three features, not punct
-       # ("12_downcase_nltkstopwords_snowballstemmer",
-      #   InfoRet(downcase = True, stemmer = stemmer, stopwords = stopwords)),
+        ("12_downcase_nltkstopwords_snowballstemmer",
+         InfoRet(downcase = True, stemmer = stemmer, stopwords = stopwords)),
         # three features, not nltkstopwords
-    #    ("13_downcase_punct_snowballstemmer",
-     #    InfoRet(downcase = True, stopwords = punct, stemmer = stemmer)),
+        ("13_downcase_punct_snowballstemmer",
+         InfoRet(downcase = True, stopwords = punct, stemmer = stemmer)),
         # three features, not downcase
         ("14_punct_nltkstopwords_snowballstemmer",
          InfoRet(stopwords = punct_stopwords, stemmer = stemmer)),
         # all four
         ("15_downcase_punct_nltkstopwords_snowballstemmer",
          InfoRet(downcase = True, stopwords = punct_stopwords, stemmer = stemmer)),
-        #Spacy stuff
-    #    ("16_spacy_full_normalization",
-     #    SpacyInfoRet(stopwords = True, stemmer = True, punct = True, use_vector = 0)),
-        #Spacy punct and stem
-     #  ("17_spacy_punct_stem",
-      #   SpacyInfoRet(stopwords = False, stemmer = True, punct = True, use_vector = 0)),
-        #Spacy stop and stem
-#        ("18_spacy_stop_stem",
- #        SpacyInfoRet(stopwords = True, stemmer = True, punct = False, use_vector = 0)),
-        #Spacy stop and punct
-  #      ("19_spacy_stop_punct",
-   #      SpacyInfoRet(stopwords = True, stemmer = False, punct = True, use_vector = 0)),
-        #Spacy stem
-    #    ("20_spacy_stem",
-     #    SpacyInfoRet(stopwords = False, stemmer = True, punct = False, use_vector = 0)),
-        #Spacy stop
-      #  ("21_spacy_stop",
-       #  SpacyInfoRet(stopwords = True, stemmer = False, punct = False, use_vector = 0)),
-         #Same but all w wordvec
-    #    ("22_spacy_full_normalization_wordvec",
-     #    SpacyInfoRet(stopwords = True, stemmer = True, punct = True, use_vector = 1)),
-        #Spacy punct and stem
-  #      ("23_spacy_punct_stem_wordvec",
-   #      SpacyInfoRet(stopwords = False, stemmer = True, punct = True, use_vector = 1)),
-        #Spacy stop and stem
-    #    ("24_spacy_stop_stem_wordvec",
-     #    SpacyInfoRet(stopwords = True, stemmer = True, punct = False, use_vector = 1)),
-        #Spacy stop and punct
- #       ("25_spacy_stop_punct_wordvec",
-  #       SpacyInfoRet(stopwords = True, stemmer = False, punct = True, use_vector = 1)),
-        #Spacy stem
-   #     ("26_spacy_stem_wordvec",
-    #     SpacyInfoRet(stopwords = False, stemmer = True, punct = False, use_vector = 1)),
-        #Spacy stop
-     #   ("27_spacy_stop_wordvec",
-      #   SpacyInfoRet(stopwords = True, stemmer = False, punct = False, use_vector = 1)),
-         #Same but all with wordvecnorm
- #       ("28_spacy_full_normalization_wordvecnorm",
-  #       SpacyInfoRet(stopwords = True, stemmer = True, punct = True, use_vector = 2)),
-        #Spacy punct and stem
- #       ("29_spacy_punct_stem_wordvecnorm",
-  #       SpacyInfoRet(stopwords = False, stemmer = True, punct = True, use_vector = 2)),
-        #Spacy stop and stem
- #       ("30_spacy_stop_stem_wordvecnorm",
-  #       SpacyInfoRet(stopwords = True, stemmer = True, punct = False, use_vector = 2)),
-        #Spacy stop and punct
-  #      ("31_spacy_stop_punct_wordvecnorm",
-   #      SpacyInfoRet(stopwords = True, stemmer = False, punct = True, use_vector = 2)),
-        #Spacy stem
- #       ("32_spacy_stem_wordvecnorm",
-  #       SpacyInfoRet(stopwords = False, stemmer = True, punct = False, use_vector = 2)),
-        #Spacy stop
- #       ("33_spacy_stop_wordvecnorm",
-  #       SpacyInfoRet(stopwords = True, stemmer = False, punct = False, use_vector = 2)),
+        # Spacy stuff
+        ("16_spacy_full_normalization",
+         SpacyInfoRet(stopwords = True, stemmer = True, punct = True, use_vector = 0)),
+        ("17_spacy_punct_stem",
+         SpacyInfoRet(stopwords = False, stemmer = True, punct = True, use_vector = 0)),
+        ("18_spacy_stop_stem",
+         SpacyInfoRet(stopwords = True, stemmer = True, punct = False, use_vector = 0)),
+        ("19_spacy_stop_punct",
+         SpacyInfoRet(stopwords = True, stemmer = False, punct = True, use_vector = 0)),
+        ("20_spacy_stem",
+         SpacyInfoRet(stopwords = False, stemmer = True, punct = False, use_vector = 0)),
+        ("21_spacy_stop",
+         SpacyInfoRet(stopwords = True, stemmer = False, punct = False, use_vector = 0)),
+        # Same but all w wordvec
+        ("22_spacy_full_normalization_wordvec",
+         SpacyInfoRet(stopwords = True, stemmer = True, punct = True, use_vector = 1)),
+        ("23_spacy_punct_stem_wordvec",
+         SpacyInfoRet(stopwords = False, stemmer = True, punct = True, use_vector = 1)),
+        ("24_spacy_stop_stem_wordvec",
+         SpacyInfoRet(stopwords = True, stemmer = True, punct = False, use_vector = 1)),
+        ("25_spacy_stop_punct_wordvec",
+         SpacyInfoRet(stopwords = True, stemmer = False, punct = True, use_vector = 1)),
+        ("26_spacy_stem_wordvec",
+         SpacyInfoRet(stopwords = False, stemmer = True, punct = False, use_vector = 1)),
+        ("27_spacy_stop_wordvec",
+         SpacyInfoRet(stopwords = True, stemmer = False, punct = False, use_vector = 1)),
+        # Same but all with wordvecnorm
+        ("28_spacy_full_normalization_wordvecnorm",
+         SpacyInfoRet(stopwords = True, stemmer = True, punct = True, use_vector = 2)),
+        ("29_spacy_punct_stem_wordvecnorm",
+         SpacyInfoRet(stopwords = False, stemmer = True, punct = True, use_vector = 2)),
+        ("30_spacy_stop_stem_wordvecnorm",
+         SpacyInfoRet(stopwords = True, stemmer = True, punct = False, use_vector = 2)),
+        ("31_spacy_stop_punct_wordvecnorm",
+         SpacyInfoRet(stopwords = True, stemmer = False, punct = True, use_vector = 2)),
+        ("32_spacy_stem_wordvecnorm",
+         SpacyInfoRet(stopwords = False, stemmer = True, punct = False, use_vector = 2)),
+        ("33_spacy_stop_wordvecnorm",
+         SpacyInfoRet(stopwords = True, stemmer = False, punct = False, use_vector = 2)),
+        # tf-idf candidates re-ranked by word vectors
+        ("34_spacy_stop_punct_hybrid_linear",
+         HybridInfoRet(stopwords = True, punct = True, use_vector = 1, fusion = "linear")),
+        ("35_spacy_stop_punct_hybrid_rrf",
+         HybridInfoRet(stopwords = True, punct = True, use_vector = 1, fusion = "rrf")),
+        # Other scoring models, best cosine normalization
+        ("36_punct_nltkstopwords_snowballstemmer_bm25",
+         InfoRet(stopwords = punct_stopwords, stemmer = stemmer, scoring = BM25())),
+        ("37_punct_nltkstopwords_snowballstemmer_bm25plus",
+         InfoRet(stopwords = punct_stopwords, stemmer = stemmer, scoring = BM25Plus())),
+        ("38_punct_nltkstopwords_snowballstemmer_pivoted",
+         InfoRet(stopwords = punct_stopwords, stemmer = stemmer, scoring = PivotedNormalization())),
     ]
 
+
+if __name__ == "__main__":
+    # --profile: time each stage and count the work done, into profile.json and
+    # profile.folded (flamegraph input) in the results directory;
+    # --profile-allocations: also trace allocations, at several times the run time
+    args = [arg for arg in argv[1:] if not arg.startswith("--")]
+    profile = "--profile" in argv or "--profile-allocations" in argv
+    docs = Path(args[0])
+    queries = Path(args[1])
+    try:
+        resultsdir = Path(args[2])
+    except IndexError:
+        resultsdir = Path("results")
+
+    resultsdir.mkdir(exist_ok = True)
+
+    # the configurations run by default; python -m inforet.sweep runs them all
+    selected = {
+        "03_nltkstopwords",
+        "08_punct_nltkstopwords",
+        "10_nltkstopwords_snowballstemmer",
+        "14_punct_nltkstopwords_snowballstemmer",
+        "15_downcase_punct_nltkstopwords_snowballstemmer",
+        "36_punct_nltkstopwords_snowballstemmer_bm25",
+        "37_punct_nltkstopwords_snowballstemmer_bm25plus",
+        "38_punct_nltkstopwords_snowballstemmer_pivoted",
+    }
+    tests = [(name, instance) for (name, instance) in configurations() if name in selected]
+
+    # every configuration tokenizes the collection the same way; do it once
+    token_cache = TokenCache()
+    for (_, instance) in tests:
+        instance.token_cache = token_cache
+
+    if profile:
+        PROFILER.enable(allocations = "--profile-allocations" in argv)
+
     for (name, instance) in tests:
         print(f"running {name}")
-        run_cranqrel(
-            documents_path = docs,
-            queries_path = queries,
-            output_path = resultsdir / name,
-            instance = instance,
-        )
+        with PROFILER.stage(name):
+            run_cranqrel(
+                documents_path = docs,
+                queries_path = queries,
+                output_path = resultsdir / name,
+                instance = instance,
+                index_path = resultsdir / "indexes" / name,
+            )
+        for (stage, seconds) in instance.query_timings.stages.items():
+            print(f"  {stage}: {seconds:.3f}s")
+
+    if profile:
+        PROFILER.write(resultsdir / "profile.json", resultsdir / "profile.folded")
+        print(PROFILER.summary())
+        print(f"profile written to {resultsdir / 'profile.json'} and {resultsdir / 'profile.folded'}")
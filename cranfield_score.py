@@ -1,143 +1,286 @@
 #!/usr/bin/env python3
+"""Score ranked runs against relevance judgements.
 
-import sys
-import re
-
-total_documents = 1400
-
-
-def mean(lst):
-    return sum(lst) / len(lst)
-
-
-def make_key_dict(key_file_name):
-    key_dict = dict()
-    with open(key_file_name) as key_file:
-        for line in key_file.readlines():
-            stripped = line.rstrip(" \r\n")
-            query, abstract, score = re.split(" +", stripped)
-            query = int(query)
-            abstract = int(abstract)
-            if abstract <= total_documents:
-                try:
-                    if abstract not in key_dict[query]:
-                        key_dict[query].append(abstract)
-                except KeyError:
-                    key_dict[query] = [abstract]
-    return key_dict
-
-
-def make_response_dict(resp_file_name):
-    resp_dict = dict()
-    with open(resp_file_name) as resp_file:
-        for line in resp_file.readlines():
-            stripped = line.rstrip(" \r\n")
-            query, abstract, score = re.split(" +", line)
-            try:
-                query = int(query)
-                abstract = int(abstract)
-                score = float(score)
-            except ValueError as e:
-                print('Warning: Each line should consist of 3 numbers with a space in between')
-                print('This line does not seem to comply:',line)
-                raise e
-            try:
-                if not abstract in resp_dict[query]:
-                    resp_dict[query].append(abstract)
-            except KeyError:
-                resp_dict[query] = [abstract]
-    return resp_dict
-
-
-def count_correct(keys, responses):
-    return sum(1 for doc in responses if doc in keys)
-
-
-def avg_precision(keys, responses):
-    total_answers = len(keys)
-    correct = 0
-    incorrect = 0
-    milestone = .1
-    precisions = []
-
-    for abstract in responses:
-        if abstract in keys:
-            correct += 1
-            recall = correct / total_answers
-            while recall > milestone:
-                precisions.append(correct / (correct + incorrect))
-                milestone += .1
-        else:
-            incorrect += 1
-    return mean(precisions)
+usage: cranfield_score.py cranqrel run [run ...] [--docs cran.all.1400] [--k 5 10 20]
+
+Judgements are cranqrel lines, `query doc code`, where every listed pair is
+relevant and code 1 is the most relevant (see cran/cranqrel.readme), or
+four-column TREC qrels, `query 0 doc grade`, where grades above 0 are
+relevant. Runs are the `query doc score` lines cranfield.py writes, or
+six-column TREC runs, `query Q0 doc rank score tag`. A query's documents
+are ranked in file order and a repeated document only counts the first time.
+
+Files are read in chunks straight into arrays, and each metric is computed
+for every query at once. Queries with relevant documents but no results are
+listed and left out of the means, as are queries nobody judged.
+"""
+import argparse
+import itertools
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+
+CHUNK_BYTES = 1 << 24
+
+# the columns holding (query, document, grade) in judgements, and (query,
+# document) in runs, by the number of fields on a line
+JUDGEMENT_COLUMNS = {3: (0, 1, 2), 4: (0, 2, 3)}
+RUN_COLUMNS = {3: (0, 1), 6: (0, 2)}
 
+# the recall levels the interpolated average precision samples at. They are
+# summed up one at a time, as the original per-query loop did, so a recall of
+# exactly 0.3 does not pass the third level (0.30000000000000004)
+RECALL_LEVELS = np.array(list(itertools.accumulate([0.1] * 11)))
 
-def precision(keys, responses):
-    return count_correct(keys, responses) / len(responses)
 
+def read_columns(path: Path, layouts: dict[int, Sequence[int]]) -> tuple[Optional[int], list[np.ndarray]]:
+    """Some columns of a whitespace-separated file, as arrays of byte strings.
 
-def recall(keys, responses):
-    return count_correct(keys, responses) / len(keys)
+    `layouts` maps a number of fields per line to the columns to keep; the
+    first line picks the layout and every other line must match it. Returns
+    the number of fields per line (None for an empty file) and the columns.
+    Only CHUNK_BYTES of text are held at a time.
+    """
+    width = None
+    parts: list[list[np.ndarray]] = []
+    with open(path, "rb") as f:
+        rest = b""
+        while True:
+            block = f.read(CHUNK_BYTES)
+            data = rest + block
+            if block:
+                # keep any partial last line for the next chunk
+                cut = data.rfind(b"\n") + 1
+                (data, rest) = (data[:cut], data[cut:])
+            fields = data.split()
+            if fields:
+                if width is None:
+                    width = len(next(line for line in data.splitlines() if line.strip()).split())
+                    if width not in layouts:
+                        raise ValueError(f"{path}: lines have {width} fields, expected "
+                                         + " or ".join(str(n) for n in layouts))
+                    parts = [[] for _ in layouts[width]]
+                lines = data.count(b"\n") + (not data.endswith(b"\n"))
+                if len(fields) != width * lines:
+                    check_widths(path, data, width)
+                for (part, column) in zip(parts, layouts[width]):
+                    part.append(np.array(fields[column::width]))
+            if not block:
+                break
+    if width is None:
+        return (None, [np.array([], dtype=bytes) for _ in next(iter(layouts.values()))])
+    return (width, [np.concatenate(part) for part in parts])
 
 
-def f_score(prec, rec):
+def check_widths(path: Path, data: bytes, width: int):
+    # the slow path, only taken when a chunk's field count is off: blank lines, or a bad line
+    for line in data.splitlines():
+        if line.strip() and len(line.split()) != width:
+            raise ValueError(f"{path}: every line should have {width} fields, not this one: "
+                             f"{line.decode(errors = 'replace')!r}")
+
+
+def as_ids(column: np.ndarray) -> np.ndarray:
+    """The column as integers if every entry is one, so "0184" and "184" match; else as it is."""
     try:
-        return 2 / ((1 / prec) + (1 / rec))
-    except ZeroDivisionError:
-        return 0
-
-
-def grade_responses(keys, responses):
-    average_precision = avg_precision(keys, responses)
-
-    total_precision = precision(keys, responses)
-    total_recall = recall(keys, responses)
-    total_f = f_score(total_precision, total_recall)
-
-    trunc_responses = responses[0:len(keys)]
-    trunc_precision = precision(keys, trunc_responses)
-    trunc_recall = recall(keys, trunc_responses)
-    trunc_f = f_score(trunc_precision, trunc_recall)
-
-    return average_precision, total_precision, total_recall, total_f, trunc_precision, trunc_recall, trunc_f
-
-
-def score (keyFileName, responseFileName):
-    key_dict = make_key_dict(keyFileName)
-    response_dict = make_response_dict(responseFileName)
-    
-    all_avg_precisions = []
-    all_total_precisions = []
-    all_total_recalls = []
-    all_total_f = []
-    all_trunc_p = []
-    all_trunc_r = []
-    all_trunc_f = []
-    missing_responses = []
-
-    for query in key_dict:
-        try:
-            avg_p, total_p, total_r, total_f, trunc_p, trunc_r, trunc_f = grade_responses(key_dict[query], response_dict[query])
-            all_avg_precisions.append(avg_p)
-            all_total_precisions.append(total_p)
-            all_total_recalls.append(total_r)
-            all_total_f.append(total_f)
-            all_trunc_p.append(trunc_p)
-            all_trunc_r.append(trunc_r)
-            all_trunc_f.append(trunc_f)
-        except KeyError:
-            missing_responses.append(query)
-
-    if missing_responses:
-        print (f"Queries with no responses: {missing_responses}")
-    print (f'Mean Average Precision is: {mean(all_avg_precisions)}')
-    print(f"Mean precision is {mean(all_total_precisions)}")
-    print(f"Mean recall is {mean(all_total_recalls)}")
-    print(f"Mean f-score is {mean(all_total_f)}")
-    print(f"Mean truncated precision is {mean(all_trunc_p)}")
-    print(f"Mean truncated recall is {mean(all_trunc_r)}")
-    print(f"Mean truncated f-score is {mean(all_trunc_f)}")
-
-
-if __name__ == '__main__':
-    score(*sys.argv[1:])
+        return column.astype(np.int64)
+    except ValueError:
+        return column
+
+
+def lookup(table: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Position of each of `values` in the sorted array `table`, or -1."""
+    if not len(table):
+        return np.full(len(values), -1, dtype=np.int64)
+    order = None
+    if table.dtype.kind != values.dtype.kind:
+        # numeric ids on one side only: compare as text, which sorts differently
+        table = table.astype(bytes)
+        order = np.argsort(table, kind="stable")
+        table = table[order]
+    # byte strings compare at the longer of the two lengths
+    dtype = np.promote_types(table.dtype, values.dtype)
+    (table, values) = (table.astype(dtype, copy=False), values.astype(dtype, copy=False))
+    positions = np.minimum(np.searchsorted(table, values), len(table) - 1)
+    found = np.where(table[positions] == values, positions, -1)
+    if order is not None:
+        found = np.where(found >= 0, order[np.maximum(found, 0)], -1)
+    return found
+
+
+def group_bounds(groups: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Start and size of each run of equal values in the sorted array `groups`."""
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]]) if len(groups) else groups
+    return (starts, np.diff(np.r_[starts, len(groups)]))
+
+
+def group_ranks(groups: np.ndarray) -> np.ndarray:
+    """1-based position of each element within its run of equal, sorted `groups`."""
+    (starts, sizes) = group_bounds(groups)
+    return np.arange(len(groups)) - np.repeat(starts, sizes) + 1
+
+
+class Judgements:
+    """Relevance judgements, as sorted (query, document) pairs with a gain each."""
+
+    queries: np.ndarray    # judged query ids, sorted
+    keys: np.ndarray       # query position * len(documents) + document position, sorted
+    gains: np.ndarray      # aligned with keys; > 0 means relevant
+    relevant: np.ndarray   # relevant documents per query
+    documents: np.ndarray  # judged document ids, sorted
+
+    def __init__(self, path: Path, documents: Optional[set[int]] = None):
+        (width, (queries, docs, grades)) = read_columns(path, JUDGEMENT_COLUMNS)
+        grades = grades.astype(np.int64)
+        if width == 3:
+            # cranqrel: 1 best to 4 least relevant, -1 relevant but ungraded
+            gains = np.where(grades >= 1, 5 - grades, 1)
+        else:
+            gains = np.maximum(grades, 0)
+        (queries, docs) = (as_ids(queries), as_ids(docs))
+        if documents is not None:
+            # judgements for documents outside the collection can never be retrieved
+            inside = np.isin(docs, np.fromiter(documents, dtype=np.int64, count=len(documents)))
+            (queries, docs, gains) = (queries[inside], docs[inside], gains[inside])
+        self.queries = np.unique(queries)
+        self.documents = np.unique(docs)
+        keys = lookup(self.queries, queries) * len(self.documents) + lookup(self.documents, docs)
+        # a pair judged twice keeps its first grade
+        (self.keys, first) = np.unique(keys, return_index=True)
+        self.gains = gains[first].astype(np.float64)
+        judged = self.keys // max(1, len(self.documents))
+        self.relevant = np.bincount(judged, weights=self.gains > 0, minlength=len(self.queries))
+        self._judged_queries = judged
+
+    def ideal_dcg(self, k: Optional[int] = None) -> np.ndarray:
+        """Per query DCG of the best possible ranking, cut at `k` if given."""
+        order = np.lexsort((-self.gains, self._judged_queries))
+        queries = self._judged_queries[order]
+        ranks = group_ranks(queries)
+        weights = self.gains[order] / np.log2(ranks + 1)
+        if k is not None:
+            weights = np.where(ranks <= k, weights, 0.0)
+        return np.bincount(queries, weights=weights, minlength=len(self.queries))
+
+
+def f_score(precision: np.ndarray, recall: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore"):
+        return np.where((precision > 0) & (recall > 0), 2 / ((1 / precision) + (1 / recall)), 0.0)
+
+
+def evaluate(judgements: Judgements, run_path: Path, ks: Sequence[int] = (5, 10, 20)) -> tuple[dict, np.ndarray]:
+    """Per query metrics of a run file, and the ids of queries with no results.
+
+    The metrics are arrays aligned with each other over the queries that
+    have both relevant documents and results, whose ids are under "query".
+    """
+    (_, (run_queries, run_docs)) = read_columns(run_path, RUN_COLUMNS)
+    return evaluate_run(judgements, as_ids(run_queries), as_ids(run_docs), ks)
+
+
+def evaluate_run(
+    judgements: Judgements,
+    run_queries: np.ndarray,
+    run_docs: np.ndarray,
+    ks: Sequence[int] = (5, 10, 20),
+) -> tuple[dict, np.ndarray]:
+    """`evaluate` for a run already in memory: its (query, document) lines as two arrays."""
+    n_queries = len(judgements.queries)
+
+    query_positions = lookup(judgements.queries, run_queries)
+    # repeats of a (query, document) pair only count at their first position
+    (_, doc_codes) = np.unique(run_docs, return_inverse=True)
+    pairs = query_positions * (int(doc_codes.max(initial=0)) + 1) + doc_codes
+    (_, first) = np.unique(pairs, return_index=True)
+    first.sort()
+    first = first[query_positions[first] >= 0]
+    order = first[np.argsort(query_positions[first], kind="stable")]
+    queries = query_positions[order]
+
+    doc_positions = lookup(judgements.documents, run_docs[order])
+    keys = queries * len(judgements.documents) + doc_positions
+    found = lookup(judgements.keys, np.where(doc_positions >= 0, keys, -1))
+    gains = np.where(found >= 0, judgements.gains[np.maximum(found, 0)], 0.0)
+    relevant_hit = (gains > 0).astype(np.float64)
+
+    (starts, sizes) = group_bounds(queries)
+    ranks = np.arange(len(queries)) - np.repeat(starts, sizes) + 1
+    hits = np.cumsum(relevant_hit)
+    # relevant documents so far within the query, not the whole run
+    hits -= np.repeat(hits[starts] - relevant_hit[starts], sizes)
+    precisions = hits / ranks
+
+    def per_query(weights):
+        return np.bincount(queries, weights=weights, minlength=n_queries)
+
+    relevant = judgements.relevant
+    retrieved = np.bincount(queries, minlength=n_queries)
+    correct = per_query(relevant_hit)
+    at_r = relevant_hit * (ranks <= relevant[queries])
+
+    # the recall levels each relevant document passes, for interpolated AP
+    with np.errstate(divide="ignore", invalid="ignore"):
+        recall_after = hits / relevant[queries]
+        recall_before = (hits - 1) / relevant[queries]
+    passed = relevant_hit * (np.searchsorted(RECALL_LEVELS, recall_after, side="left")
+                             - np.searchsorted(RECALL_LEVELS, recall_before, side="left"))
+    dcg_weights = gains / np.log2(ranks + 1)
+
+    scored = (relevant > 0) & (retrieved > 0)
+    missing = judgements.queries[(relevant > 0) & (retrieved == 0)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        metrics = {
+            "query": judgements.queries,
+            "average precision": per_query(relevant_hit * precisions) / relevant,
+            "interpolated average precision": np.nan_to_num(per_query(passed * precisions) / per_query(passed)),
+            "R-precision": per_query(at_r) / relevant,
+            **{f"P@{k}": per_query(relevant_hit * (ranks <= k)) / k for k in ks},
+            "nDCG": per_query(dcg_weights) / judgements.ideal_dcg(),
+            **{f"nDCG@{k}": per_query(dcg_weights * (ranks <= k)) / judgements.ideal_dcg(k) for k in ks},
+            "precision": correct / retrieved,
+            "recall": correct / relevant,
+            "truncated precision": per_query(at_r) / np.minimum(retrieved, relevant),
+            "truncated recall": per_query(at_r) / relevant,
+        }
+    metrics["f-score"] = f_score(metrics["precision"], metrics["recall"])
+    metrics["truncated f-score"] = f_score(metrics["truncated precision"], metrics["truncated recall"])
+    return ({name: values[scored] for (name, values) in metrics.items()}, missing)
+
+
+def means(metrics: dict) -> dict[str, float]:
+    return {name: float(values.mean()) if len(values) else 0.0
+            for (name, values) in metrics.items() if name != "query"}
+
+
+def score(key_file_name, response_file_name, documents: Optional[set[int]] = None):
+    (metrics, missing) = evaluate(Judgements(Path(key_file_name), documents), Path(response_file_name))
+    if len(missing):
+        print(f"Queries with no responses: {missing.tolist()}")
+    for (name, value) in means(metrics).items():
+        print(f"Mean {name} is: {value}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("judgements", type = Path)
+    parser.add_argument("runs", type = Path, nargs = "+")
+    parser.add_argument("--docs", type = Path,
+                        help = "the collection; judgements of documents not in it are dropped")
+    parser.add_argument("--k", type = int, nargs = "+", default = [5, 10, 20], help = "cutoffs for P@k and nDCG@k")
+    args = parser.parse_args()
+
+    documents = None
+    if args.docs is not None:
+        from inforet.collection import iter_cran_records
+        documents = {record.ident for record in iter_cran_records(args.docs)}
+        print(f"{len(documents)} documents in {args.docs}")
+    judgements = Judgements(args.judgements, documents)
+    for run in args.runs:
+        (metrics, missing) = evaluate(judgements, run, args.k)
+        if len(args.runs) > 1:
+            print(f"\n{run}")
+        if len(missing):
+            print(f"Queries with no responses: {missing.tolist()}")
+        for (name, value) in means(metrics).items():
+            print(f"Mean {name} is: {value}")
@@ -0,0 +1,54 @@
+import numpy as np
+
+
+def unit_vector(vector: np.ndarray) -> np.ndarray:
+    """`vector` as float32 scaled to length 1; all-zero vectors stay zero."""
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class EmbeddingMatrix:
+    """Contiguous float32 matrix with one unit-length row per document.
+
+    Rows are appended as documents are indexed, so row i belongs to doc id i.
+    Capacity doubles when full, and `matrix` is a view of the filled rows, so
+    scoring a batch of unit query vectors is a single product.
+    """
+
+    count: int
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self._data = None
+        self.count = 0
+
+    @property
+    def dimensions(self) -> int:
+        return 0 if self._data is None else self._data.shape[1]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        if self._data is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._data[:self.count]
+
+    def append(self, vector: np.ndarray) -> int:
+        if self._data is None:
+            self._data = np.empty((self.capacity, len(vector)), dtype=np.float32)
+        elif self.count == len(self._data):
+            grown = np.empty((2 * len(self._data), self._data.shape[1]), dtype=np.float32)
+            grown[:self.count] = self._data
+            self._data = grown
+        self._data[self.count] = vector
+        self.count += 1
+        return self.count - 1
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """Cosine of each unit query row against every document, shape (queries, docs)."""
+        if self.count == 0:
+            return np.zeros((len(queries), 0), dtype=np.float32)
+        return queries @ self.matrix.T
+
+    def __len__(self) -> int:
+        return self.count
@@ -0,0 +1,32 @@
+import numpy as np
+
+
+def min_max(scores: np.ndarray) -> np.ndarray:
+    """`scores` rescaled to [0, 1]; all-equal scores become all ones."""
+    low, high = scores.min(), scores.max()
+    if high > low:
+        return (scores - low) / (high - low)
+    return np.ones_like(scores)
+
+
+def linear_fusion(lexical: np.ndarray, dense: np.ndarray, alpha: float) -> np.ndarray:
+    """alpha * lexical + (1 - alpha) * dense, each min-max scaled first.
+
+    Word-vector cosines crowd into a narrow band near 1 while tf-idf cosines
+    spread across [0, 1], so raw scores would not weigh the two equally.
+    """
+    return alpha * min_max(lexical) + (1 - alpha) * min_max(dense)
+
+
+def reciprocal_rank_fusion(lexical: np.ndarray, dense: np.ndarray, k: int) -> np.ndarray:
+    """Sum of 1 / (k + rank) over both rankings, ranks counted from 1.
+
+    Only the order of each score list matters, not its scale.
+    """
+    fused = np.zeros(len(lexical))
+    for scores in (lexical, dense):
+        ranks = np.empty(len(scores))
+        ranks[np.argsort(-scores, kind="stable")] = np.arange(1, len(scores) + 1)
+        fused += 1 / (k + ranks)
+    return fused
+
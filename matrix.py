@@ -0,0 +1,290 @@
+import numpy as np
+from functools import cached_property
+from typing import Callable, Optional, Sequence
+
+from . import varbyte
+from .profiling import PROFILER
+from .terms import TERM_DTYPE
+
+
+class QueryBatch:
+    """A batch of queries flattened to one entry per (query, distinct term).
+
+    Entries run query by query, each query's terms in the order of its
+    `terms` array. `idf` maps an array of term ids to their idfs; the
+    tf-idf side of the batch is computed from it once, on first use, and
+    shared by every segment the batch is scored against.
+    """
+
+    size: int
+    owner: np.ndarray    # query of each entry
+    terms: np.ndarray    # term id of each entry
+    counts: np.ndarray   # occurrences of the term in the query
+    lengths: np.ndarray  # tokens in each query
+
+    def __init__(self, queries: Sequence, idf: Callable[[np.ndarray], np.ndarray]):
+        self.size = len(queries)
+        self.owner = np.repeat(np.arange(len(queries)), [len(query.terms) for query in queries])
+        self.terms = np.concatenate([query.terms for query in queries] or [np.zeros(0, dtype=TERM_DTYPE)])
+        self.counts = np.concatenate([query.counts for query in queries] or [np.zeros(0)]).astype(np.float64)
+        self.lengths = np.array([query.length for query in queries], dtype=np.float64)
+        self.idf = idf
+
+    @cached_property
+    def idfs(self) -> np.ndarray:
+        return self.idf(self.terms)
+
+    @cached_property
+    def weights(self) -> np.ndarray:
+        """tf / length * idf of every entry: the operation order of InfoRet.document_tf_idf_vector."""
+        return (self.counts / self.lengths[self.owner]) * self.idfs
+
+    @cached_property
+    def norms(self) -> np.ndarray:
+        """Norm of each query's full tf-idf vector.
+
+        `Query.unique_tokens` repeats a term once per occurrence, so a term
+        seen k times contributes k identical dimensions. Summed one entry at
+        a time, in order.
+        """
+        norms2 = [0.0] * self.size
+        for (query, square) in zip(self.owner.tolist(), (self.counts * self.weights * self.weights).tolist()):
+            norms2[query] += square
+        return np.sqrt(np.array(norms2))
+
+    def document_cosine(self, tfs: np.ndarray, length: int) -> float:
+        """`TermDocumentMatrix.cosine_scores` of one document against a batch of one query.
+
+        `tfs` are the document's counts of the batch's terms. The products
+        are summed entry by entry, as np.bincount sums them in the matrix,
+        so the two round the same way and give the same score.
+        """
+        dot = norm2 = 0.0
+        for (tf, idf, mult, weight) in zip(tfs.tolist(), self.idfs.tolist(),
+                                           self.counts.tolist(), self.weights.tolist()):
+            if tf:
+                doc_weight = (tf / length) * idf
+                dot += mult * weight * doc_weight
+                norm2 += mult * doc_weight * doc_weight
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return float(np.float64(dot) / (self.norms[0] * np.sqrt(norm2)))
+
+
+class TermDocumentMatrix:
+    """A frozen, term-major sparse tf matrix over a group of documents.
+
+    Storage is CSR over terms (equivalently CSC over documents): row r holds
+    the tf of term id `terms[r]` in every document containing it, in doc id
+    order, so a query only touches the rows for its own terms. Weights (tf /
+    length, idf and the like) are applied to the postings a query gathers,
+    at query time, so the matrix stays valid as collection statistics
+    change; only the documents it was built from are fixed.
+    """
+
+    terms: np.ndarray    # term id of each row
+    indptr: np.ndarray   # row r has postings indptr[r]:indptr[r + 1]
+    indices: np.ndarray  # doc ids
+    tfs: np.ndarray
+    lengths: np.ndarray  # tokens in each document
+    doc_count: int
+
+    def __init__(
+        self,
+        terms: np.ndarray,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        tfs: np.ndarray,
+        doc_lengths: Sequence[int],
+    ):
+        self._set_rows(terms, indptr, doc_lengths)
+        self.indices = indices
+        self.tfs = tfs
+
+    def _set_rows(self, terms: np.ndarray, indptr: np.ndarray, doc_lengths: Sequence[int]):
+        self.terms = terms
+        self.indptr = indptr
+        self.lengths = np.asarray(doc_lengths, dtype=np.float64)
+        self.doc_count = len(self.lengths)
+        # rows are in term id order when built here, not necessarily when loaded
+        self._sorter = None if np.all(terms[1:] > terms[:-1]) else np.argsort(terms, kind="stable")
+
+    @classmethod
+    def build(cls, frequencies: Sequence[tuple[np.ndarray, np.ndarray]]) -> "TermDocumentMatrix":
+        """The matrix of documents given as (term ids, counts) pairs; doc id is position."""
+        return cls(*transpose(frequencies))
+
+    def rows(self, term_ids: np.ndarray) -> np.ndarray:
+        """The row of each of `term_ids`, or -1 where the matrix has no postings for it."""
+        if not len(self.terms):
+            return np.full(len(term_ids), -1, dtype=np.int64)
+        positions = np.searchsorted(self.terms, term_ids, sorter=self._sorter).clip(max=len(self.terms) - 1)
+        rows = positions if self._sorter is None else self._sorter[positions]
+        return np.where(self.terms[rows] == term_ids, rows, -1)
+
+    def postings(self, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Every posting of every one of `rows` in one shot: (index into `rows`, doc id, tf)."""
+        starts = self.indptr[rows]
+        (owner, positions) = varbyte.ranges(starts, self.indptr[rows + 1] - starts)
+        if PROFILER.enabled:
+            PROFILER.count("postings traversed", len(positions))
+        return owner, self.indices[positions], self.tfs[positions]
+
+    def row_postings(self, row: int) -> tuple[np.ndarray, np.ndarray]:
+        (_, doc_ids, tfs) = self.postings(np.array([row]))
+        return doc_ids, tfs
+
+    @property
+    def nbytes(self) -> int:
+        return self.terms.nbytes + self.indptr.nbytes + self.indices.nbytes + self.tfs.nbytes
+
+    def gather(self, batch: QueryBatch) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """The postings of every batch entry, and the (query, document) pair each one adds to.
+
+        Returns (entry, doc id, tf, position in the pairs) per posting, and
+        the pairs themselves as query * doc_count + doc id, ascending. Only documents
+        sharing a term with a query make a pair with it.
+        """
+        rows = self.rows(batch.terms)
+        present = np.flatnonzero(rows >= 0)
+        (owner, doc_ids, tfs) = self.postings(rows[present])
+        entries = present[owner]
+        cells = batch.owner[entries] * self.doc_count + doc_ids
+        (pairs, inverse) = np.unique(cells, return_inverse=True)
+        return entries, doc_ids, tfs, inverse.reshape(-1), pairs
+
+    def sum_scores(
+        self,
+        batch: QueryBatch,
+        query_weights: np.ndarray,
+        posting_weights: Callable[[np.ndarray, np.ndarray], np.ndarray],
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Additive scores: sum over query terms of the entry's query weight times its posting weights.
+
+        `query_weights` is aligned with the batch entries, and
+        posting_weights(doc ids, tfs) weighs the postings gathered for them.
+        Returns (query, doc id, score) of every pair sharing a term, in
+        query then doc id order; documents sharing none would score 0.
+        """
+        (entries, doc_ids, tfs, inverse, pairs) = self.gather(batch)
+        scores = np.bincount(inverse, weights=query_weights[entries] * posting_weights(doc_ids, tfs),
+                             minlength=len(pairs))
+        return pairs // self.doc_count, pairs % self.doc_count, scores
+
+    def cosine_scores(self, batch: QueryBatch) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Cosine scores of the (query, document) pairs sharing a term.
+
+        The cosine of `InfoRet.vector_similarity` over the query-term
+        subspace: the document norm only covers the query's terms. Returns
+        (query, doc id, score) in query then doc id order; documents sharing
+        no term with a query would score nan. Each pair's sums are added in
+        posting order, as a dense np.bincount over every pair would add
+        them. Scores can differ from vector_similarity's in the last bit, as
+        the sums are in another order; InfoRet scores every query here, or
+        with `QueryBatch.document_cosine`.
+        """
+        (entries, doc_ids, tfs, inverse, pairs) = self.gather(batch)
+        # times idf after dividing: the operation order of InfoRet.document_tf_idf_vector
+        doc_weights = (tfs / self.lengths[doc_ids]) * batch.idfs[entries]
+        mults = batch.counts[entries]
+        dots = np.bincount(inverse, weights=mults * batch.weights[entries] * doc_weights,
+                           minlength=len(pairs))
+        doc_norms2 = np.bincount(inverse, weights=mults * doc_weights * doc_weights,
+                                 minlength=len(pairs))
+        queries = pairs // self.doc_count
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = dots / (batch.norms[queries] * np.sqrt(doc_norms2))
+        return queries, pairs % self.doc_count, scores
+
+
+class CompressedTermDocumentMatrix(TermDocumentMatrix):
+    """A `TermDocumentMatrix` whose postings stay varbyte coded.
+
+    Each row's doc ids are stored as gaps, and its tfs as they are, each
+    list in its own run of bytes; `postings` decodes only the rows asked
+    for. Usually two or three bytes a posting, against sixteen plain.
+    """
+
+    doc_bytes: np.ndarray    # uint8; row r's doc id gaps are doc_bytes[doc_offsets[r]:doc_offsets[r + 1]]
+    doc_offsets: np.ndarray
+    tf_bytes: np.ndarray
+    tf_offsets: np.ndarray
+
+    def __init__(
+        self,
+        terms: np.ndarray,
+        indptr: np.ndarray,
+        doc_bytes: np.ndarray,
+        doc_offsets: np.ndarray,
+        tf_bytes: np.ndarray,
+        tf_offsets: np.ndarray,
+        doc_lengths: Sequence[int],
+    ):
+        self._set_rows(terms, indptr, doc_lengths)
+        self.doc_bytes = doc_bytes
+        self.doc_offsets = doc_offsets
+        self.tf_bytes = tf_bytes
+        self.tf_offsets = tf_offsets
+
+    @classmethod
+    def build(cls, frequencies):
+        (terms, indptr, indices, tfs, lengths) = transpose(frequencies)
+        (doc_bytes, doc_offsets) = varbyte.encode_lists(indptr, indices, gaps=True)
+        (tf_bytes, tf_offsets) = varbyte.encode_lists(indptr, tfs)
+        # four bytes a row for each offset array, unless the segment is huge
+        (indptr, doc_offsets, tf_offsets) = (compact(offsets) for offsets in (indptr, doc_offsets, tf_offsets))
+        return cls(terms, indptr, doc_bytes, doc_offsets, tf_bytes, tf_offsets, lengths)
+
+    def postings(self, rows):
+        sizes = self.indptr[rows + 1] - self.indptr[rows]
+        owner = np.repeat(np.arange(len(rows)), sizes)
+        if PROFILER.enabled:
+            PROFILER.count("postings traversed", len(owner))
+            PROFILER.count("postings decoded", len(owner))
+        doc_ids = varbyte.decode_lists(self.doc_bytes, self.doc_offsets, sizes, rows, gaps=True)
+        tfs = varbyte.decode_lists(self.tf_bytes, self.tf_offsets, sizes, rows)
+        return owner, doc_ids, tfs
+
+    @property
+    def nbytes(self) -> int:
+        return (self.terms.nbytes + self.indptr.nbytes + self.doc_bytes.nbytes + self.doc_offsets.nbytes
+                + self.tf_bytes.nbytes + self.tf_offsets.nbytes)
+
+
+def transpose(
+    frequencies: Sequence[tuple[np.ndarray, np.ndarray]],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Term-major (terms, indptr, doc ids, tfs, doc lengths) of documents given as (term ids, counts)."""
+    term_ids = np.concatenate([terms for (terms, _) in frequencies])
+    counts = np.concatenate([counts for (_, counts) in frequencies]).astype(np.int64)
+    doc_ids = np.repeat(np.arange(len(frequencies), dtype=np.int64),
+                        [len(terms) for (terms, _) in frequencies])
+    # a stable sort by term keeps each postings list in doc id order
+    order = np.argsort(term_ids, kind="stable")
+    (terms, sizes) = np.unique(term_ids[order], return_counts=True)
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=indptr[1:])
+    # Document.length is the number of tokens, i.e. the sum of the counts
+    lengths = np.bincount(doc_ids, weights=counts, minlength=len(frequencies))
+    return terms.astype(TERM_DTYPE), indptr, doc_ids[order], counts[order], lengths
+
+
+def compact(offsets: np.ndarray) -> np.ndarray:
+    """Ascending `offsets` as int32 if they fit."""
+    return offsets.astype(np.int32) if offsets[-1] < 2 ** 31 else offsets
+
+
+def top_k(scores: np.ndarray, threshold: float, k: Optional[int] = None) -> np.ndarray:
+    """Indices of the best scores above `threshold`, highest first.
+
+    Ties keep ascending index order. nan never passes the threshold. A `k`
+    of 0 or less selects nothing.
+    """
+    if k is not None and k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    with np.errstate(invalid="ignore"):
+        passing = np.flatnonzero(scores > threshold)
+    if k is not None and k < len(passing):
+        kth = np.partition(scores[passing], len(passing) - k)[len(passing) - k]
+        passing = passing[scores[passing] >= kth]
+    order = np.argsort(-scores[passing], kind="stable")
+    return passing[order][:k]
@@ -0,0 +1,192 @@
+"""Opt-in instrumentation: nested stage timers, counters and allocations.
+
+`PROFILER` is off until enabled. Instrumented code either enters
+`PROFILER.stage(name)`, which while off is a shared do-nothing context
+manager, or checks `PROFILER.enabled` before counting, so an unprofiled
+run pays an attribute load or a method call per stage, never per posting
+or per token. Stages are only entered around whole steps: a query, a
+batch, a segment, a document.
+
+While on, a stage is timed under the path of the stages enclosing it on
+its thread, e.g. ("perform_queries", "score_batch", "segment"); counters
+are global. With `allocations`, tracemalloc also records, per stage, the
+bytes it left allocated and how far above its starting point memory
+peaked; tracemalloc slows everything down severalfold, so timings taken
+with it are only good relative to each other. A report exports as JSON
+or as folded stacks, one "outer;inner microseconds" line per stage path
+with the time spent in the stage itself, which flamegraph.pl, speedscope
+and the like read.
+"""
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Iterator, Optional
+
+
+class StageStats:
+    """Totals over every call of one stage path."""
+
+    calls: int
+    seconds: float
+    child_seconds: float  # spent in stages entered from this one
+    net_bytes: int        # allocated and still held when the stage ended
+    peak_bytes: int       # most memory in use above the stage's starting point
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.child_seconds = 0.0
+        self.net_bytes = 0
+        self.peak_bytes = 0
+
+
+class _Frame:
+    # one entered stage on a thread's stack
+    __slots__ = ("path", "start", "child_seconds", "memory", "peak")
+
+    def __init__(self, path: tuple[str, ...], memory: int):
+        self.path = path
+        self.child_seconds = 0.0
+        self.memory = memory  # traced bytes at entry
+        self.peak = memory    # highest traced bytes seen so far, children included
+        self.start = time.perf_counter()
+
+
+class Profiler:
+    enabled: bool
+    allocations: bool
+
+    def __init__(self):
+        self.enabled = False
+        self.allocations = False
+        self.started_tracing = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self.lock:
+            self.stages: dict[tuple[str, ...], StageStats] = {}
+            self.counters: dict[str, int] = {}
+            # whether any of the stages were recorded with allocations
+            self.traced = self.allocations
+
+    def enable(self, allocations: bool = False):
+        self.allocations = allocations
+        self.traced = self.traced or allocations
+        # leave tracemalloc running afterwards if someone else started it
+        self.started_tracing = allocations and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        self.allocations = False
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def stage(self, name: str):
+        """A context manager timing its block as stage `name`; does nothing while off."""
+        if not self.enabled:
+            return _OFF
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name: str) -> Iterator[None]:
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        memory = 0
+        if self.allocations:
+            (memory, peak) = tracemalloc.get_traced_memory()
+            if parent is not None:
+                # the peak is about to be reset; the parent keeps its part of it
+                parent.peak = max(parent.peak, peak)
+            tracemalloc.reset_peak()
+        frame = _Frame((parent.path if parent else ()) + (name,), memory)
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - frame.start
+            stack.pop()
+            if parent is not None:
+                parent.child_seconds += seconds
+            net = peak = 0
+            if self.allocations:
+                (current, traced_peak) = tracemalloc.get_traced_memory()
+                frame.peak = max(frame.peak, traced_peak)
+                if parent is not None:
+                    parent.peak = max(parent.peak, frame.peak)
+                net = current - frame.memory
+                peak = frame.peak - frame.memory
+            with self.lock:
+                stats = self.stages.get(frame.path)
+                if stats is None:
+                    stats = self.stages[frame.path] = StageStats()
+                stats.calls += 1
+                stats.seconds += seconds
+                stats.child_seconds += frame.child_seconds
+                stats.net_bytes += net
+                stats.peak_bytes = max(stats.peak_bytes, peak)
+
+    def _stack(self) -> list[_Frame]:
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def count(self, name: str, n: int = 1):
+        """Add `n` to counter `name`; callers check `enabled` first."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self) -> dict:
+        """Everything recorded, as plain JSON values."""
+        with self.lock:
+            stages = [{
+                "path": list(path),
+                "calls": stats.calls,
+                "seconds": stats.seconds,
+                "self_seconds": stats.seconds - stats.child_seconds,
+                **({"net_bytes": stats.net_bytes, "peak_bytes": stats.peak_bytes} if self.traced else {}),
+            } for (path, stats) in sorted(self.stages.items())]
+            return {"stages": stages, "counters": dict(sorted(self.counters.items()))}
+
+    def folded(self) -> str:
+        """Folded stacks: a "stage;stage;stage microseconds" line per path, of self time."""
+        with self.lock:
+            lines = [f"{';'.join(path)} {round(1e6 * (stats.seconds - stats.child_seconds))}"
+                     for (path, stats) in sorted(self.stages.items())]
+        return "".join(line + "\n" for line in lines)
+
+    def write(self, json_path: Optional[Path] = None, folded_path: Optional[Path] = None):
+        if json_path is not None:
+            with open(json_path, "w") as out:
+                json.dump(self.report(), out, indent = 1)
+        if folded_path is not None:
+            with open(folded_path, "w") as out:
+                out.write(self.folded())
+
+    def summary(self, limit: int = 20) -> str:
+        """The stages with the most self time, then the counters, as text."""
+        report = self.report()
+        stages = sorted(report["stages"], key = lambda stage: stage["self_seconds"], reverse = True)[:limit]
+        width = max([len(";".join(stage["path"])) for stage in stages] + [5])
+        lines = [f"{'stage':<{width}}{'calls':>10}{'total s':>10}{'self s':>10}"]
+        for stage in stages:
+            lines.append(f"{';'.join(stage['path']):<{width}}{stage['calls']:>10}"
+                         f"{stage['seconds']:>10.3f}{stage['self_seconds']:>10.3f}")
+        for (name, value) in report["counters"].items():
+            lines.append(f"{name}: {value}")
+        return "\n".join(lines)
+
+
+_OFF = nullcontext()
+
+PROFILER = Profiler()
@@ -0,0 +1,157 @@
+"""Scoring models for InfoRet's sparse query path.
+
+Models score one index segment at a time, taking collection statistics
+(N, df, average length) from the index. `Cosine` is the original tf-idf
+cosine over the query's terms. The others are additive: a document's score
+is the sum, over the query terms it contains, of a global per-term weight
+times a per-posting weight. Term weights are cached on the index until it
+changes; posting weights are computed with numpy for just the postings a
+batch of queries gathers, as they are decoded, so a query is a gather and
+a sum over its postings.
+"""
+from typing import Callable
+
+import numpy as np
+
+from .matrix import QueryBatch
+from .segments import Segment
+
+
+class ScoringModel:
+    # True when scores are vector similarities, so InfoRet's MaxScore pruning applies
+    vector_space: bool = False
+
+    def scores(self, segment: Segment, index, batch: QueryBatch) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(query, local doc id, score) of every pair sharing a term, in query then doc id order."""
+        raise NotImplementedError
+
+    def totals(self, index) -> dict[str, float]:
+        """Sums over the live documents of `index` the model needs besides N, df and lengths.
+
+        Models read them back with index.collection_totals(model), which a
+        shard of a sharded index answers with the sums over every shard.
+        """
+        return {}
+
+
+class Cosine(ScoringModel):
+    """tf / length * idf vectors compared by cosine, as InfoRet always has."""
+
+    vector_space = True
+
+    def scores(self, segment, index, batch):
+        return segment.matrix.cosine_scores(batch)
+
+    def __repr__(self) -> str:
+        return "Cosine()"
+
+
+class AdditiveModel(ScoringModel):
+
+    def term_weights(self, index, term_ids: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def posting_weights(self, segment: Segment, index, doc_ids: np.ndarray, tfs: np.ndarray) -> np.ndarray:
+        """Document-side weight of each posting (local doc id, tf) of `segment`."""
+        raise NotImplementedError
+
+    def query_weights(self, counts: np.ndarray) -> np.ndarray:
+        return counts
+
+    def cached(self, segment: Segment, index, key, compute: Callable[[], np.ndarray]) -> np.ndarray:
+        # valid until the index's statistics next change
+        entry = segment.weights.get(key)
+        if entry is None or entry[0] != index.generation:
+            entry = segment.weights[key] = (index.generation, compute())
+        return entry[1]
+
+    def scores(self, segment, index, batch):
+        term_weights = index.cached_term_weights(self, batch.terms,
+                                                 lambda term_ids: self.term_weights(index, term_ids))
+        return segment.matrix.sum_scores(batch, self.query_weights(batch.counts) * term_weights,
+                                         lambda doc_ids, tfs: self.posting_weights(segment, index, doc_ids, tfs))
+
+
+class BM25(AdditiveModel):
+    """Okapi BM25 with the non-negative idf log(1 + (N - df + 0.5) / (df + 0.5))."""
+
+    k1: float
+    b: float
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    def term_weights(self, index, term_ids):
+        dfs = index.document_frequencies(term_ids)
+        return np.log1p((index.doc_count - dfs + 0.5) / (dfs + 0.5))
+
+    def posting_weights(self, segment, index, doc_ids, tfs):
+        lengths = segment.lengths[doc_ids]
+        norm = self.k1 * (1 - self.b + self.b * lengths / index.average_length)
+        return tfs * (self.k1 + 1) / (tfs + norm)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(k1={self.k1}, b={self.b})"
+
+
+class BM25Plus(BM25):
+    """BM25+ (Lv & Zhai): `delta` added to every present term's tf part, so
+    long documents are not scored below ones lacking the term."""
+
+    delta: float
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, delta: float = 1.0):
+        super().__init__(k1, b)
+        self.delta = delta
+
+    def posting_weights(self, segment, index, doc_ids, tfs):
+        return super().posting_weights(segment, index, doc_ids, tfs) + self.delta
+
+    def __repr__(self) -> str:
+        return f"BM25Plus(k1={self.k1}, b={self.b}, delta={self.delta})"
+
+
+class PivotedNormalization(AdditiveModel):
+    """Pivoted cosine normalization (Singhal, Buckley & Mitra).
+
+    Postings weigh (1 + ln tf) * ln((N + 1) / df), divided by
+    (1 - slope) * pivot + slope * |d|, where |d| is the norm of the
+    document's full weight vector and the pivot is the mean norm.
+    """
+
+    slope: float
+
+    def __init__(self, slope: float = 0.2):
+        self.slope = slope
+
+    def term_weights(self, index, term_ids):
+        dfs = index.document_frequencies(term_ids)
+        # a term left only in deleted documents only reaches masked postings
+        with np.errstate(divide="ignore"):
+            return np.where(dfs > 0, np.log((index.doc_count + 1) / dfs), 0.0)
+
+    def norms(self, segment: Segment, index) -> np.ndarray:
+        def compute():
+            matrix = segment.matrix
+            idfs = index.cached_term_weights(self, matrix.terms,
+                                             lambda term_ids: self.term_weights(index, term_ids))
+            (rows, doc_ids, tfs) = matrix.postings(np.arange(len(matrix.terms)))
+            raw = (1 + np.log(tfs)) * idfs[rows]
+            return np.sqrt(np.bincount(doc_ids, weights=raw * raw, minlength=matrix.doc_count))
+        return self.cached(segment, index, (self, "norms"), compute)
+
+    def totals(self, index):
+        return {"norms": sum(self.norms(segment, index)[segment.live].sum() for segment in index.segment_views())}
+
+    def pivot(self, index) -> float:
+        total = index.collection_totals(self)["norms"]
+        return total / index.doc_count if index.doc_count else 0.0
+
+    def posting_weights(self, segment, index, doc_ids, tfs):
+        denominators = self.cached(segment, index, (self, "denominators"), lambda: (
+            (1 - self.slope) * self.pivot(index) + self.slope * self.norms(segment, index)))
+        return (1 + np.log(tfs)) / denominators[doc_ids]
+
+    def __repr__(self) -> str:
+        return f"PivotedNormalization(slope={self.slope})"
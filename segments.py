@@ -0,0 +1,409 @@
+"""Segment-based incremental index.
+
+New documents land in an in-memory buffer. Once it holds `flush_size`
+documents it is sealed into an immutable `Segment`, which has its own
+term-major matrix over local doc ids. Deletes only clear a bit in the
+owning segment's `live` mask (a tombstone); merges rewrite a group of
+segments into one, dropping tombstoned documents. Collection statistics
+(live N, df and term counts) are kept up to date on every add and delete,
+so nothing is rescanned and sealed segments never need rebuilding.
+
+Doc ids are global and never reused: they are the position in InfoRet's
+document table whichever segment a document currently lives in. Terms are
+`terms.TERMS` ids, and statistics are arrays indexed by them. Sealed
+segments keep their postings varbyte coded; the buffer, rebuilt on every
+add, keeps them plain.
+"""
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional
+
+import numpy as np
+
+from .matrix import CompressedTermDocumentMatrix, TermDocumentMatrix
+from .profiling import PROFILER
+from .terms import TERMS, TermCache
+
+
+class Segment:
+    """An immutable group of documents plus their tombstones."""
+
+    doc_ids: np.ndarray  # global doc id of each local doc id, ascending
+    lengths: np.ndarray
+    live: np.ndarray
+    matrix: TermDocumentMatrix
+
+    def __init__(
+        self,
+        doc_ids: np.ndarray,
+        matrix: TermDocumentMatrix,
+        lengths: np.ndarray,
+        frequencies: Optional[list[tuple[np.ndarray, np.ndarray]]] = None,
+    ):
+        self.doc_ids = doc_ids
+        self.matrix = matrix
+        self.lengths = lengths
+        # (term ids, counts) of each document, shared with the Documents, so
+        # deletes and merges need nothing else; None for a loaded index
+        self.frequencies = frequencies
+        self.live = np.ones(len(doc_ids), dtype=bool)
+        self.live_count = len(doc_ids)
+        # per-document arrays of additive scoring models, keyed by model, tagged with the index generation
+        self.weights: dict[object, tuple[int, np.ndarray]] = {}
+
+    @classmethod
+    def build(
+        cls,
+        doc_ids: Iterable[int],
+        frequencies: list[tuple[np.ndarray, np.ndarray]],
+        compress: bool = True,
+    ) -> "Segment":
+        matrix_class = CompressedTermDocumentMatrix if compress else TermDocumentMatrix
+        matrix = matrix_class.build(frequencies)
+        return cls(np.fromiter(doc_ids, dtype=np.int64, count=len(frequencies)),
+                   matrix, matrix.lengths, frequencies)
+
+    def local_id(self, doc_id: int) -> Optional[int]:
+        position = int(np.searchsorted(self.doc_ids, doc_id))
+        if position < len(self.doc_ids) and self.doc_ids[position] == doc_id:
+            return position
+        return None
+
+    def term_postings(self, term: str) -> list[tuple[int, int]]:
+        """(global doc id, tf) of the live documents containing `term`."""
+        row = int(self.matrix.rows(np.array([TERMS.lookup(term)]))[0])
+        if row < 0:
+            return []
+        (local, tfs) = self.matrix.row_postings(row)
+        keep = self.live[local]
+        return list(zip(self.doc_ids[local[keep]].tolist(), tfs[keep].tolist()))
+
+    def live_doc_ids(self, term_ids: np.ndarray) -> np.ndarray:
+        """Global doc ids of the live documents containing any of `term_ids`, possibly repeated."""
+        rows = self.matrix.rows(term_ids)
+        (_, local, _) = self.matrix.postings(rows[rows >= 0])
+        return self.doc_ids[local[self.live[local]]]
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+
+class SegmentedIndex:
+    """InfoRet's index: statistics and postings over segments, cheap to update, with deletes.
+
+    Every method takes `lock`, and so should any reader that needs a
+    consistent view across several calls (InfoRet holds it for a whole
+    query). With `background_merges`, merged segments are built on a worker
+    thread without the lock and swapped in under it.
+    """
+
+    flush_size: int
+    merge_factor: int
+    postings_cache_size: int = 2 ** 20  # postings term_postings keeps between calls
+    doc_count: int  # live documents, the N of idf
+    id_count: int   # doc ids handed out, live or not
+    total_length: int  # tokens in live documents
+
+    def __init__(self, flush_size: int = 256, merge_factor: int = 8, background_merges: bool = False):
+        self.flush_size = flush_size
+        self.merge_factor = merge_factor
+        self.background_merges = background_merges
+        self.segments: list[Segment] = []
+        self.buffer_ids: list[int] = []
+        self.buffer_frequencies: list[tuple[np.ndarray, np.ndarray]] = []
+        self.buffer_live: list[bool] = []
+        self._buffer_segment: Optional[Segment] = None
+        # by term id; ids past the end have never occurred in this index
+        self.term_counts = np.zeros(0, dtype=np.int64)
+        self.doc_frequencies = np.zeros(0, dtype=np.int64)
+        self.term_total = 0  # terms with a nonzero document frequency
+        self.doc_count = 0
+        self.id_count = 0
+        self.total_length = 0
+        # bumped on every change, so derived caches can tell they are stale
+        self.generation = 0
+        # per-term results, stale after every change
+        self._idfs = TermCache()
+        self._term_weights: dict[object, TermCache] = {}
+        self._postings_cache: OrderedDict[str, list[tuple[int, int]]] = OrderedDict()
+        self._postings_cached = 0
+        self.lock = threading.RLock()
+        self._merger: Optional[ThreadPoolExecutor] = None
+        self._merges: list[Future] = []
+        self._merging: set[int] = set()  # id() of segments a pending merge will replace
+
+    def __getstate__(self):
+        # locks and threads do not pickle; a copy starts without pending merges.
+        # Term ids are only meaningful in this process and ones forked from it
+        state = self.__dict__.copy()
+        state["lock"] = None
+        state["_merger"] = None
+        state["_merges"] = []
+        state["_merging"] = set()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    def _changed(self):
+        self.generation += 1
+        self._postings_cache.clear()
+        self._postings_cached = 0
+
+    def add(self, terms: np.ndarray, counts: np.ndarray) -> int:
+        """Index a document given as distinct term ids and their counts; its doc id."""
+        with self.lock:
+            doc_id = self.id_count
+            self.id_count += 1
+            self.buffer_ids.append(doc_id)
+            self.buffer_frequencies.append((terms, counts))
+            self.buffer_live.append(True)
+            self._buffer_segment = None
+            if len(self.term_counts) < len(TERMS):
+                self._grow_statistics(max(len(TERMS), 2 * len(self.term_counts)))
+            # a document's terms are distinct, so fancy indexing adds each once
+            self.term_total += int(np.count_nonzero(self.doc_frequencies[terms] == 0))
+            self.term_counts[terms] += counts
+            self.doc_frequencies[terms] += 1
+            self.doc_count += 1
+            self.total_length += int(counts.sum())
+            self._changed()
+            if len(self.buffer_ids) >= self.flush_size:
+                self.flush()
+            return doc_id
+
+    def _grow_statistics(self, size: int):
+        padding = np.zeros(size - len(self.term_counts), dtype=np.int64)
+        self.term_counts = np.concatenate([self.term_counts, padding])
+        self.doc_frequencies = np.concatenate([self.doc_frequencies, padding])
+
+    def delete(self, doc_id: int):
+        """Tombstone `doc_id`; KeyError if it is unknown or already deleted."""
+        with self.lock:
+            frequencies = self._tombstone(doc_id)
+            if frequencies is None:
+                raise KeyError(doc_id)
+            (terms, counts) = frequencies
+            self.term_counts[terms] -= counts
+            self.doc_frequencies[terms] -= 1
+            self.term_total -= int(np.count_nonzero(self.doc_frequencies[terms] == 0))
+            self.doc_count -= 1
+            self.total_length -= int(counts.sum())
+            self._changed()
+            self.maybe_merge()
+
+    def _tombstone(self, doc_id: int) -> Optional[tuple[np.ndarray, np.ndarray]]:
+        # the deleted document's term counts, or None if it was not live
+        for segment in self.segments:
+            local = segment.local_id(doc_id)
+            if local is not None:
+                if not segment.live[local]:
+                    return None
+                segment.live[local] = False
+                segment.live_count -= 1
+                return segment.frequencies[local]
+        # buffer ids are consecutive
+        if self.buffer_ids and doc_id >= self.buffer_ids[0]:
+            position = doc_id - self.buffer_ids[0]
+            if position < len(self.buffer_live) and self.buffer_live[position]:
+                self.buffer_live[position] = False
+                self._buffer_segment = None
+                return self.buffer_frequencies[position]
+        return None
+
+    def flush(self):
+        """Seal the buffer into a segment."""
+        with self.lock:
+            if not self.buffer_ids:
+                return
+            # the buffer's own segment is plain; this one is for keeps
+            with PROFILER.stage("flush"):
+                segment = Segment.build(self.buffer_ids, self.buffer_frequencies)
+            segment.live[:] = self.buffer_live
+            segment.live_count = sum(self.buffer_live)
+            self.segments.append(segment)
+            self.buffer_ids = []
+            self.buffer_frequencies = []
+            self.buffer_live = []
+            self._buffer_segment = None
+            self.maybe_merge()
+
+    def buffer_segment(self) -> Optional[Segment]:
+        # rebuilt after each change to the buffer; it is at most flush_size documents
+        if self._buffer_segment is None and self.buffer_ids:
+            with PROFILER.stage("buffer_segment"):
+                segment = Segment.build(self.buffer_ids, self.buffer_frequencies, compress=False)
+            segment.live[:] = self.buffer_live
+            segment.live_count = sum(self.buffer_live)
+            self._buffer_segment = segment
+        return self._buffer_segment
+
+    def segment_views(self) -> list[Segment]:
+        """Every segment a query has to score, the buffer included."""
+        buffer = self.buffer_segment()
+        return self.segments + ([buffer] if buffer is not None else [])
+
+    def live_mask(self) -> np.ndarray:
+        mask = np.zeros(self.id_count, dtype=bool)
+        for segment in self.segment_views():
+            mask[segment.doc_ids] = segment.live
+        return mask
+
+    # merging
+
+    def _tier(self, segment: Segment) -> int:
+        return int(math.log(max(1, segment.live_count / self.flush_size), self.merge_factor))
+
+    def merge_candidates(self) -> list[Segment]:
+        """Segments due for a merge: merge_factor of one size tier, or one mostly deleted."""
+        free = [segment for segment in self.segments if id(segment) not in self._merging]
+        for segment in free:
+            if segment.live_count < len(segment) / 2:
+                return [segment]
+        tiers: dict[int, list[Segment]] = {}
+        for segment in free:
+            tiers.setdefault(self._tier(segment), []).append(segment)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return sorted(tiers[tier], key=lambda segment: segment.live_count)[:self.merge_factor]
+        return []
+
+    def maybe_merge(self):
+        with self.lock:
+            while group := self.merge_candidates():
+                if self.background_merges:
+                    self._merging.update(id(segment) for segment in group)
+                    if self._merger is None:
+                        self._merger = ThreadPoolExecutor(1, thread_name_prefix="inforet-merge")
+                    self._merges.append(self._merger.submit(self._merge, group))
+                else:
+                    self._merge(group)
+
+    def merge(self):
+        """Merge every segment, and the buffer, into one; waits for background merges first."""
+        self.wait_for_merges()
+        with self.lock:
+            self.flush()
+            if len(self.segments) > 1 or any(segment.live_count < len(segment) for segment in self.segments):
+                self._merge(list(self.segments))
+
+    def wait_for_merges(self):
+        while self._merges:
+            self._merges.pop(0).result()
+
+    def _merge(self, group: list[Segment]):
+        with self.lock:
+            # tombstones as of now; any set while building are carried over below
+            snapshot = [segment.live.copy() for segment in group]
+        pairs = sorted((int(doc_id), counts)
+                       for (segment, live) in zip(group, snapshot)
+                       for (doc_id, counts, alive) in zip(segment.doc_ids, segment.frequencies, live)
+                       if alive)
+        with PROFILER.stage("merge"):
+            merged = (Segment.build((doc_id for (doc_id, _) in pairs), [counts for (_, counts) in pairs])
+                      if pairs else None)
+        with self.lock:
+            for (segment, before) in zip(group, snapshot if merged is not None else ()):
+                for local in np.flatnonzero(before & ~segment.live):
+                    position = merged.local_id(int(segment.doc_ids[local]))
+                    merged.live[position] = False
+                    merged.live_count -= 1
+            if merged is not None and not merged.live_count:
+                merged = None
+            members = {id(segment) for segment in group}
+            # the merged segment takes the place of the first of its members
+            position = min(i for (i, segment) in enumerate(self.segments) if id(segment) in members)
+            self.segments = [segment for segment in self.segments if id(segment) not in members]
+            if merged is not None:
+                self.segments.insert(position, merged)
+            self._merging -= members
+            self.generation += 1
+
+    @property
+    def average_length(self) -> float:
+        return self.total_length / self.doc_count if self.doc_count else 0.0
+
+    # by term string
+
+    def term_count(self, term: str) -> int:
+        return int(self.term_counts_of(np.array([TERMS.lookup(term)]))[0])
+
+    def document_frequency(self, term: str) -> int:
+        return int(self.document_frequencies(np.array([TERMS.lookup(term)]))[0])
+
+    def idf(self, term: str) -> float:
+        return float(self.idfs(np.array([TERMS.lookup(term)]))[0])
+
+    # and by arrays of term ids, for scoring
+
+    def term_counts_of(self, term_ids: np.ndarray) -> np.ndarray:
+        return _statistic(self.term_counts, term_ids)
+
+    def document_frequencies(self, term_ids: np.ndarray) -> np.ndarray:
+        return _statistic(self.doc_frequencies, term_ids)
+
+    def idfs(self, term_ids: np.ndarray) -> np.ndarray:
+        def compute(missing):
+            # math.log of Python numbers, as the idf has always been computed
+            doc_count = self.doc_count
+            if not doc_count:
+                # nothing left to score; every term weighs nothing
+                return [0.0] * len(missing)
+            return [math.log(doc_count / (1 + count)) for count in self.term_counts_of(missing).tolist()]
+        return self._idfs.get(term_ids, self.generation, compute)
+
+    def cached_term_weights(
+        self,
+        key,
+        term_ids: np.ndarray,
+        compute: Callable[[np.ndarray], np.ndarray],
+    ) -> np.ndarray:
+        """compute(ids), collection-level weights of terms, cached under `key` until the next change."""
+        return self._term_weights.setdefault(key, TermCache()).get(term_ids, self.generation, compute)
+
+    def collection_totals(self, model) -> dict[str, float]:
+        return model.totals(self)
+
+    def term_postings(self, term: str) -> list[tuple[int, int]]:
+        """(doc id, tf) of every live document containing `term`; shared, do not mutate."""
+        with self.lock:
+            postings = self._postings_cache.get(term)
+            if postings is not None:
+                self._postings_cache.move_to_end(term)
+                return postings
+            postings = [posting for segment in self.segment_views()
+                        for posting in segment.term_postings(term)]
+            # merges can leave segments out of doc id order
+            postings.sort()
+            # merges move postings between segments without changing them, so they stay cached
+            if len(postings) <= self.postings_cache_size:
+                self._postings_cache[term] = postings
+                self._postings_cached += len(postings)
+                while self._postings_cached > self.postings_cache_size:
+                    (_, evicted) = self._postings_cache.popitem(last=False)
+                    self._postings_cached -= len(evicted)
+            return postings
+
+    def candidates(self, terms: Iterable[str]) -> list[int]:
+        """Sorted doc ids of every live document containing at least one of `terms`."""
+        term_ids = TERMS.lookup_all(list(terms))
+        with self.lock:
+            found = [segment.live_doc_ids(term_ids) for segment in self.segment_views()]
+        return np.unique(np.concatenate(found)).tolist() if found else []
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(TERMS.strings(np.flatnonzero(self.doc_frequencies)))
+
+    def __len__(self) -> int:
+        return self.term_total
+
+
+def _statistic(values: np.ndarray, term_ids: np.ndarray) -> np.ndarray:
+    # -1 (an unknown term) and ids past the end are terms the index has never seen
+    known = (term_ids >= 0) & (term_ids < len(values))
+    found = np.zeros(len(term_ids), dtype=values.dtype)
+    found[known] = values[term_ids[known]]
+    return found
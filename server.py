@@ -0,0 +1,283 @@
+"""Asyncio query server around a built InfoRet.
+
+The protocol is JSON lines over TCP. A request is one object per line:
+
+    {"id": 7, "query": "what is the drag on a slender body", "top_k": 10}
+    {"id": 8, "stats": true}
+
+and each gets one line back carrying the same id, `{"id": 7, "results":
+[[doc ident, score], ...]}` or `{"id": 8, "stats": {...}}`, or `{"id": ...,
+"error": "..."}`. A connection may send requests without waiting, and
+replies come back as they finish, not necessarily in order.
+
+Queries are normalized on a process pool, so tokenization never blocks the
+event loop. Normalized queries that arrive within `max_wait` seconds of
+each other are scored together by one `perform_queries` call, up to
+`max_batch` at a time, on a scoring thread.
+
+usage: python -m inforet.server cran.all.1400 [--index DIR] [--port N] ...
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import signal
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from inforet import InfoRet, Query, _init_normalizer, _normalize_text_in_worker
+from inforet.cache import ResultCache
+
+
+class LatencyStats:
+    """Request counters plus latencies of the last `window` requests."""
+
+    requests: int
+    errors: int
+    batches: int
+    batched_queries: int
+
+    def __init__(self, window: int = 10_000):
+        self.latencies = deque(maxlen = window)
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_queries = 0
+        self.started = time.perf_counter()
+
+    def record(self, seconds: float):
+        self.requests += 1
+        self.latencies.append(seconds)
+
+    def record_batch(self, size: int):
+        self.batches += 1
+        self.batched_queries += size
+
+    def snapshot(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        if self.latencies:
+            (p50, p99) = np.percentile(np.array(self.latencies), [50, 99]) * 1000
+        else:
+            (p50, p99) = (0.0, 0.0)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "uptime_s": round(elapsed, 3),
+            "qps": round(self.requests / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(float(p50), 3),
+            "p99_ms": round(float(p99), 3),
+            "mean_batch": round(self.batched_queries / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+class QueryServer:
+    """Serves `instance` over the JSON line protocol; see the module docstring."""
+
+    max_batch: int
+    max_wait: float
+    top_k: Optional[int]
+
+    def __init__(
+        self,
+        instance: InfoRet,
+        *,
+        workers: int = 2,
+        max_batch: int = 64,
+        max_wait: float = 0.002,
+        top_k: Optional[int] = 10,
+    ):
+        self.instance = instance
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.top_k = top_k  # when a request does not say
+        self.stats = LatencyStats()
+        self.normalizer: Optional[Executor] = None
+        if workers > 0:
+            # like InfoRet.normalize_documents: each worker gets a settings-only copy
+            worker = instance.empty_copy()
+            worker.token_cache = None
+            self.normalizer = ProcessPoolExecutor(workers, initializer = _init_normalizer,
+                                                  initargs = (worker,))
+        # one scoring thread: batches are scored one after another
+        self.scorer = ThreadPoolExecutor(1, thread_name_prefix = "inforet-score")
+        self.pending: Optional[asyncio.Queue] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._idents = itertools.count(1)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.Server:
+        self.pending = asyncio.Queue()
+        self._batcher = asyncio.create_task(self.run_batches())
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def close(self):
+        if self._batcher is not None:
+            self._batcher.cancel()
+        if self.normalizer is not None:
+            self.normalizer.shutdown(cancel_futures = True)
+        self.scorer.shutdown(cancel_futures = True)
+
+    async def normalize(self, text: str) -> list[str]:
+        loop = asyncio.get_running_loop()
+        if self.normalizer is None:
+            return await loop.run_in_executor(None, self.instance.normalize_text, text)
+        return await loop.run_in_executor(self.normalizer, _normalize_text_in_worker, text)
+
+    async def query(self, text: str, top_k: Optional[int] = None) -> list[tuple[int, float]]:
+        """(doc ident, score) pairs for one query, scored in whatever batch it lands in."""
+        tokens = await self.normalize(text)
+        if not tokens:
+            # nothing left after normalization, e.g. only stopwords
+            return []
+        future = asyncio.get_running_loop().create_future()
+        await self.pending.put((self.instance.query_class(next(self._idents), tokens), top_k, future))
+        return await future
+
+    async def next_batch(self) -> list[tuple[Query, Optional[int], asyncio.Future]]:
+        # block for the first query, then take whatever arrives within max_wait
+        batch = [await self.pending.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch:
+            if not self.pending.empty():
+                batch.append(self.pending.get_nowait())
+                continue
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.pending.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.next_batch()
+            try:
+                limits = [top_k for (_, top_k, _) in batch]
+                # score once at the largest k asked for, then cut each result down
+                top_k = None if None in limits else max(limits)
+                results = await loop.run_in_executor(
+                    self.scorer, self.instance.perform_queries, [query for (query, _, _) in batch], top_k)
+            except Exception as e:
+                for (_, _, future) in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.stats.record_batch(len(batch))
+            for ((_, limit, future), ranked) in zip(batch, results):
+                if not future.done():
+                    future.set_result([(doc.ident, score) for (doc, score) in ranked[:limit]])
+
+    async def respond(self, line: bytes) -> dict:
+        start = time.perf_counter()
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            if request.get("stats"):
+                stats = self.stats.snapshot()
+                if self.instance.result_cache is not None:
+                    stats["result_cache"] = self.instance.result_cache.stats()
+                return {"id": request_id, "stats": stats}
+            top_k = request.get("top_k", self.top_k)
+            # anything else would fail the whole batch the query lands in
+            if top_k is not None and (type(top_k) is not int or top_k <= 0):
+                raise ValueError(f"top_k must be a positive integer or null, not {top_k!r}")
+            results = await self.query(str(request["query"]), top_k)
+        except Exception as e:
+            self.stats.errors += 1
+            return {"id": request_id, "error": f"{type(e).__name__}: {e}"}
+        self.stats.record(time.perf_counter() - start)
+        return {"id": request_id, "results": [[ident, round(score, 6)] for (ident, score) in results]}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        async def reply(line: bytes):
+            writer.write(json.dumps(await self.respond(line)).encode() + b"\n")
+            await writer.drain()
+
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(reply(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions = True)
+        finally:
+            writer.close()
+
+
+def top_k_argument(value: str) -> Optional[int]:
+    """--top-k: a positive integer, or "none" for every result."""
+    if value.lower() == "none":
+        return None
+    try:
+        top_k = int(value)
+    except ValueError:
+        top_k = 0
+    if top_k < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer or none, not {value!r}")
+    return top_k
+
+
+def load_instance(docs: Path, index_path: Optional[Path], workers: int, cache_bytes: int = 0) -> InfoRet:
+    from nltk.stem.snowball import EnglishStemmer
+    from inforet.cranfield import class_stop_words, parse_cran_docs
+    from inforet.storage import IndexSettingsMismatch, META_FILE
+    punct = {".", ",", "'", '?', '!', ';', ':'}
+    instance = InfoRet(stopwords = set(class_stop_words) | punct, stemmer = EnglishStemmer(),
+                       result_cache = ResultCache(cache_bytes) if cache_bytes else None)
+    if index_path is not None and (index_path / META_FILE).exists():
+        try:
+            instance.load_index(index_path)
+            return instance
+        except IndexSettingsMismatch as e:
+            print(f"rebuilding {index_path}: {e}")
+    parse_cran_docs(docs, instance, workers)
+    if index_path is not None:
+        instance.save_index(index_path)
+    return instance
+
+
+async def main(args):
+    instance = load_instance(args.docs, args.index, args.workers, int(args.result_cache_mb * 2 ** 20))
+    server = QueryServer(instance, workers = args.workers, max_batch = args.max_batch,
+                         max_wait = args.max_wait_ms / 1000, top_k = args.top_k)
+    listener = await server.start(args.host, args.port)
+    # stop serving on SIGTERM too, so the normalizer processes are shut down
+    serving = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+    # not instance.documents, which would build every document of a loaded index
+    print(f"serving {len(instance.doc_ids_by_ident)} documents on {args.host}:{args.port}", flush = True)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("docs", type = Path)
+    parser.add_argument("--index", type = Path, help = "saved index to load, or to create")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--workers", type = int, default = 2, help = "normalization processes; 0 for a thread")
+    parser.add_argument("--max-batch", type = int, default = 64)
+    parser.add_argument("--max-wait-ms", type = float, default = 2.0)
+    parser.add_argument("--top-k", type = top_k_argument, default = 10,
+                        help = "results for requests that give no top_k; none for all of them")
+    parser.add_argument("--result-cache-mb", type = float, default = 0, help = "cache ranked results; 0 for none")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
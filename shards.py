@@ -0,0 +1,420 @@
+"""A collection split across shard processes, queried by scatter-gather.
+
+`ShardedIndex` coordinates N shards. A shard is an ordinary InfoRet, an
+empty copy of the one the coordinator was given, in a process of its own:
+started locally, or a `serve` process on another machine reached over a
+socket. Coordinator and shard talk over a multiprocessing connection, a
+pipe or a socket, one request and one reply at a time. Documents go to a
+shard by a hash of their ident, and each shard normalizes and indexes its
+own.
+
+Scores depend on collection-wide statistics. Before the first query after
+any change, the coordinator gathers every shard's N, token count, and per
+term counts and document frequencies, adds them up and sends the totals
+back; terms travel as strings, as term ids only mean something in the
+process that gave them out. A model that needs more, like the pivot of
+PivotedNormalization, gets a second round for its `totals`. Each shard
+then scores its documents exactly as one index of the whole collection
+would. A batch of queries goes to every shard at once; each returns its
+top k, and the coordinator merges them, ties going to the document added
+first, as in a single index.
+
+usage: python -m inforet.shards HOST:PORT [--authkey KEY]
+
+serves one shard to the first coordinator that connects. The key is
+required, given with --authkey or in the INFORET_SHARD_AUTHKEY environment
+variable: both ends unpickle what the other sends, so a socket open to
+anyone without it would run whatever code they sent.
+"""
+import argparse
+import heapq
+import itertools
+import math
+import multiprocessing
+import os
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Callable, Iterable, Optional, Sequence
+
+import numpy as np
+from inforet import InfoRet, Query
+from inforet.matrix import top_k as top_k_ids
+from inforet.segments import Segment, SegmentedIndex
+from inforet.terms import TERMS, TermCache
+
+# (score, coordinator sequence number, doc ident) of a shard's result
+Hit = tuple[float, int, int]
+# where `python -m inforet.shards` looks for the key when --authkey is not given
+AUTHKEY_VARIABLE = "INFORET_SHARD_AUTHKEY"
+
+
+class GlobalStatistics:
+    """A shard's index, with the N, df and lengths of the whole collection.
+
+    Scoring models take it in place of the index: statistics are the
+    coordinator's totals, segments are the shard's own.
+    """
+
+    doc_count: int
+    total_length: int
+    generation: int
+
+    def __init__(self, index: SegmentedIndex):
+        self.index = index
+        self.doc_count = 0
+        self.total_length = 0
+        # by term id, like SegmentedIndex's own
+        self.term_counts = np.zeros(0, dtype=np.int64)
+        self.doc_frequencies = np.zeros(0, dtype=np.int64)
+        self.totals: dict[str, float] = {}
+        # bumped on every update, so derived caches can tell they are stale
+        self.generation = 0
+        self._idfs = TermCache()
+        self._term_weights: dict[object, TermCache] = {}
+
+    def update(
+        self,
+        doc_count: int,
+        total_length: int,
+        terms: list[str],
+        term_counts: np.ndarray,
+        doc_frequencies: np.ndarray,
+    ):
+        term_ids = TERMS.intern_all(terms)
+        self.term_counts = np.zeros(len(TERMS), dtype=np.int64)
+        self.term_counts[term_ids] = term_counts
+        self.doc_frequencies = np.zeros(len(TERMS), dtype=np.int64)
+        self.doc_frequencies[term_ids] = doc_frequencies
+        self.doc_count = doc_count
+        self.total_length = total_length
+        self.totals = {}
+        self.generation += 1
+
+    @property
+    def average_length(self) -> float:
+        return self.total_length / self.doc_count if self.doc_count else 0.0
+
+    def term_counts_of(self, term_ids: np.ndarray) -> np.ndarray:
+        return _statistic(self.term_counts, term_ids)
+
+    def document_frequencies(self, term_ids: np.ndarray) -> np.ndarray:
+        return _statistic(self.doc_frequencies, term_ids)
+
+    def idfs(self, term_ids: np.ndarray) -> np.ndarray:
+        def compute(missing):
+            # as SegmentedIndex.idfs, so a shard's idfs are a single index's to the bit
+            if not self.doc_count:
+                return [0.0] * len(missing)
+            return [math.log(self.doc_count / (1 + count)) for count in self.term_counts_of(missing).tolist()]
+        return self._idfs.get(term_ids, self.generation, compute)
+
+    def cached_term_weights(
+        self,
+        key,
+        term_ids: np.ndarray,
+        compute: Callable[[np.ndarray], np.ndarray],
+    ) -> np.ndarray:
+        return self._term_weights.setdefault(key, TermCache()).get(term_ids, self.generation, compute)
+
+    def collection_totals(self, model) -> dict[str, float]:
+        return self.totals
+
+    def segment_views(self) -> list[Segment]:
+        return self.index.segment_views()
+
+
+def _statistic(values: np.ndarray, term_ids: np.ndarray) -> np.ndarray:
+    # terms interned after the last update occur in no shard
+    known = (term_ids >= 0) & (term_ids < len(values))
+    found = np.zeros(len(term_ids), dtype=values.dtype)
+    found[known] = values[term_ids[known]]
+    return found
+
+
+class Shard:
+    """The shard side: an InfoRet holding some of the documents, scoring with global statistics."""
+
+    instance: InfoRet
+    sequence: list[int]  # the coordinator's sequence number of each local doc id
+
+    def __init__(self, instance: InfoRet):
+        self.instance = instance
+        # cached results would outlive a change of global statistics
+        instance.result_cache = None
+        self.global_statistics = GlobalStatistics(instance.index)
+        instance.global_statistics = self.global_statistics
+        self.sequence = []
+
+    def add(self, documents: list[tuple[int, int, str]]) -> int:
+        """Index (sequence number, ident, text) triples."""
+        instance = self.instance
+        normalized = instance.normalize_documents((ident, text) for (_, ident, text) in documents)
+        for ((sequence, _, _), doc) in zip(documents, normalized):
+            instance.index_document(doc)
+            self.sequence.append(sequence)
+        return len(documents)
+
+    def update(self, sequence: int, ident: int, text: str):
+        self.instance.update_document(ident, text)
+        # the new version has the next local doc id
+        self.sequence.append(sequence)
+
+    def delete(self, ident: int):
+        self.instance.delete_document(ident)
+
+    def statistics(self) -> tuple[int, int, list[str], np.ndarray, np.ndarray]:
+        """(N, tokens, terms, their term counts, their document frequencies) of this shard."""
+        index = self.instance.index
+        with index.lock:
+            term_ids = np.flatnonzero(index.doc_frequencies)
+            return (index.doc_count, index.total_length, TERMS.strings(term_ids),
+                    index.term_counts[term_ids], index.doc_frequencies[term_ids])
+
+    def set_statistics(self, *statistics):
+        self.global_statistics.update(*statistics)
+
+    def totals(self) -> dict[str, float]:
+        return self.instance.scoring.totals(self.global_statistics)
+
+    def set_totals(self, totals: dict[str, float]):
+        # nothing computed so far depends on them: only queries read them
+        self.global_statistics.totals = totals
+
+    def query(self, queries: list[Query], top_k: Optional[int]) -> list[list[Hit]]:
+        """Each query's best hits, highest score first, ties in sequence order."""
+        instance = self.instance
+        with instance.index.lock:
+            return [[(float(scores[i]), self.sequence[doc_ids[i]], instance.document_table[doc_ids[i]].ident)
+                     for i in top_k_ids(scores, instance.inclusion_threshold, top_k).tolist()]
+                    for (doc_ids, scores) in instance.query_score_rows(queries)]
+
+
+SHARD_COMMANDS = ("add", "update", "delete", "statistics", "set_statistics", "totals", "set_totals", "query")
+
+
+def run_shard(connection: Connection):
+    """Answer requests on `connection` until the coordinator closes it.
+
+    A request is (command, args) and its reply ("ok", value) or ("error",
+    exception). The first request must be ("init", (instance,)).
+    """
+    shard = None
+    while True:
+        try:
+            (command, args) = connection.recv()
+        except EOFError:
+            return
+        try:
+            if command == "close":
+                connection.send(("ok", None))
+                return
+            elif command == "init":
+                shard = Shard(*args)
+                value = None
+            elif command in SHARD_COMMANDS and shard is not None:
+                value = getattr(shard, command)(*args)
+            else:
+                raise ValueError(f"unexpected shard command {command!r}")
+        except Exception as e:
+            value = e
+            status = "error"
+        else:
+            status = "ok"
+        try:
+            connection.send((status, value))
+        except Exception as e:
+            # e.g. an exception that does not pickle
+            connection.send(("error", RuntimeError(repr(e))))
+
+
+def serve(address: tuple[str, int], authkey: bytes):
+    """Run one shard for the first coordinator to connect to `address` with `authkey`."""
+    if not authkey:
+        raise ValueError("a shard served over a socket needs an authkey")
+    with Listener(address, authkey = authkey) as listener:
+        with listener.accept() as connection:
+            run_shard(connection)
+
+
+def shard_of(ident: int, shards: int) -> int:
+    # a multiplicative hash spreads runs and strides of idents evenly
+    return (ident * 2654435761) % 2 ** 32 % shards
+
+
+def add_statistics(parts: list[tuple]) -> tuple[int, int, list[str], np.ndarray, np.ndarray]:
+    """Every shard's statistics added up: (N, tokens, terms, term counts, document frequencies)."""
+    terms = np.array([term for part in parts for term in part[2]], dtype = object)
+    (unique, inverse) = np.unique(terms, return_inverse = True)
+
+    def total(column: int) -> np.ndarray:
+        values = np.concatenate([part[column] for part in parts])
+        # exact: counts stay far below 2 ** 53
+        return np.bincount(inverse, weights = values, minlength = len(unique)).astype(np.int64)
+
+    return (sum(part[0] for part in parts), sum(part[1] for part in parts),
+            unique.tolist(), total(3), total(4))
+
+
+class ShardedIndex:
+    """Coordinator of an InfoRet collection split across shard processes.
+
+    `instance` gives every shard its settings, normalization and scoring
+    alike, and normalizes queries. `shards` processes are started on this
+    machine, and a shard is also connected to at each of `addresses`, each
+    a `serve` process given the same `authkey`, which connecting to any
+    requires. Results are (doc ident, score) pairs, ranked as
+    `instance.perform_queries` would rank them over the whole collection.
+    Only the sparse scoring path is sharded.
+    """
+
+    instance: InfoRet
+    batch_size: int = 1024  # documents sent to a shard per request
+
+    def __init__(
+        self,
+        instance: InfoRet,
+        shards: int = 2,
+        addresses: Sequence[tuple[str, int]] = (),
+        authkey: Optional[bytes] = None,
+    ):
+        if addresses and not authkey:
+            raise ValueError("connecting to shards over a socket needs an authkey")
+        self.instance = instance
+        # before starting any process, so a refused connection leaves none behind
+        remote = [Client(address, authkey = authkey) for address in addresses]
+        self.connections: list[Connection] = []
+        self.processes: list[multiprocessing.Process] = []
+        for position in range(shards):
+            (connection, child) = multiprocessing.Pipe()
+            process = multiprocessing.Process(target = run_shard, args = (child,), daemon = True,
+                                              name = f"inforet-shard-{position}")
+            process.start()
+            child.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+        self.connections.extend(remote)
+        if not self.connections:
+            raise ValueError("a sharded index needs at least one shard")
+
+        template = instance.empty_copy()
+        template.token_cache = None
+        template.result_cache = None
+        self.call_all("init", template)
+        self.added = 0  # documents sent so far; the next one's sequence number
+        self.stale = False  # whether the shards' global statistics are out of date
+        self.doc_count = 0
+
+    def request(self, shard: int, command: str, *args):
+        self.connections[shard].send((command, args))
+
+    def replies(self, shards: Iterable[int]) -> list:
+        """The pending reply of each of `shards`; every one is read before any error is raised."""
+        replies = [self.connections[shard].recv() for shard in shards]
+        for (status, value) in replies:
+            if status == "error":
+                raise value
+        return [value for (_, value) in replies]
+
+    def call(self, shard: int, command: str, *args):
+        self.request(shard, command, *args)
+        return self.replies([shard])[0]
+
+    def call_all(self, command: str, *args) -> list:
+        """Send one request to every shard, so they work on it at once; their replies."""
+        for shard in range(len(self.connections)):
+            self.request(shard, command, *args)
+        return self.replies(range(len(self.connections)))
+
+    def shard_of(self, ident: int) -> int:
+        return shard_of(ident, len(self.connections))
+
+    def add_documents(self, documents: Iterable[tuple[int, str]]):
+        """Index (ident, text) pairs, each on its shard; shards normalize and index in parallel."""
+        documents = iter(documents)
+        while window := list(itertools.islice(documents, self.batch_size * len(self.connections))):
+            parts = [[] for _ in self.connections]
+            for (ident, text) in window:
+                parts[self.shard_of(ident)].append((self.added, ident, text))
+                self.added += 1
+            busy = [shard for (shard, part) in enumerate(parts) if part]
+            for shard in busy:
+                self.request(shard, "add", parts[shard])
+            self.stale = True
+            self.replies(busy)
+
+    def add_document(self, ident: int, text: str):
+        self.add_documents([(ident, text)])
+
+    def update_document(self, ident: int, text: str):
+        """Replace the text of document `ident`; KeyError if there is none."""
+        self.stale = True
+        self.call(self.shard_of(ident), "update", self.added, ident, text)
+        self.added += 1
+
+    def delete_document(self, ident: int):
+        """Remove document `ident`; KeyError if there is none."""
+        self.stale = True
+        self.call(self.shard_of(ident), "delete", ident)
+
+    def refresh(self):
+        """Send every shard up to date global statistics, if anything has changed."""
+        if not self.stale:
+            return
+        statistics = add_statistics(self.call_all("statistics"))
+        self.call_all("set_statistics", *statistics)
+        # sums a model needs on top, under the new statistics
+        parts = self.call_all("totals")
+        self.call_all("set_totals", {key: sum(part[key] for part in parts) for key in parts[0]})
+        self.doc_count = statistics[0]
+        self.stale = False
+
+    def make_query(self, ident: int, text: str) -> Query:
+        return self.instance.make_query(ident, text)
+
+    def perform_queries(
+        self,
+        queries: list[Query],
+        top_k: Optional[int] = None,
+    ) -> list[list[tuple[int, float]]]:
+        """(doc ident, score) of each query's results, best first."""
+        self.refresh()
+        results = []
+        for hits in zip(*self.call_all("query", queries, top_k)):
+            # each shard's hits are already in order; merge the sorted lists
+            ranked = heapq.merge(*hits, key = lambda hit: (-hit[0], hit[1]))
+            results.append([(ident, score) for (score, _, ident) in itertools.islice(ranked, top_k)])
+        return results
+
+    def perform_query(self, query: Query, top_k: Optional[int] = None) -> list[tuple[int, float]]:
+        return self.perform_queries([query], top_k)[0]
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(("close", ()))
+                connection.recv()
+            except (EOFError, OSError):
+                pass
+            connection.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+    def __enter__(self) -> "ShardedIndex":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("address", help = "HOST:PORT to listen on")
+    parser.add_argument("--authkey", default = os.environ.get(AUTHKEY_VARIABLE),
+                        help = f"shared secret the coordinator must present; defaults to ${AUTHKEY_VARIABLE}")
+    args = parser.parse_args()
+    if not args.authkey:
+        parser.error(f"an authkey is required, with --authkey or ${AUTHKEY_VARIABLE}")
+
+    (host, port) = args.address.rsplit(":", 1)
+    serve((host, int(port)), args.authkey.encode())
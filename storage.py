@@ -0,0 +1,304 @@
+"""On-disk format for a built InfoRet index.
+
+An index is saved as a directory of `.npy` arrays plus `meta.json`, which
+records the format version and the normalization settings it was built with.
+Loading memory-maps the arrays, so a warm start only reads the vocabulary and
+several processes can share the same pages. Postings are saved varbyte
+coded, as sealed segments hold them, and decoded straight from the mapped
+bytes.
+"""
+import json
+import math
+import threading
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Type
+
+import numpy as np
+
+from . import varbyte
+from .matrix import CompressedTermDocumentMatrix, compact
+from .segments import Segment
+from .terms import TERMS, TermCache
+
+FORMAT_VERSION = 2
+META_FILE = "meta.json"
+
+
+class IndexSettingsMismatch(ValueError):
+    pass
+
+
+class MappedIndex:
+    """Read-only `SegmentedIndex` backed by memory-mapped postings arrays.
+
+    It is a single segment with no deletes, so its statistics never change.
+    """
+
+    generation: int = 0
+
+    def __init__(
+        self,
+        terms: list[str],
+        term_ids: np.ndarray,
+        postings: dict[str, np.ndarray],
+        term_counts: np.ndarray,
+        doc_count: int,
+        lengths: np.ndarray,
+    ):
+        self.terms = terms
+        self.term_ids = term_ids  # TERMS id of each saved term
+        self.vocabulary = {term: row for (row, term) in enumerate(terms)}
+        # term_indptr, term_doc_bytes, term_doc_offsets, term_tf_bytes, term_tf_offsets
+        self.postings = postings
+        self.indptr = postings["term_indptr"]
+        self.counts = term_counts
+        self.doc_count = doc_count
+        self.id_count = doc_count
+        self.lengths = lengths
+        self.total_length = int(lengths.sum())
+        self.lock = threading.RLock()
+        self._idfs = TermCache()
+        self._term_weights: dict[object, TermCache] = {}
+        self._segment = None
+
+    @property
+    def average_length(self) -> float:
+        return self.total_length / self.doc_count if self.doc_count else 0.0
+
+    def add(self, terms: np.ndarray, counts: np.ndarray) -> int:
+        raise TypeError("a memory-mapped index is read-only; rebuild it to add documents")
+
+    def delete(self, doc_id: int):
+        raise TypeError("a memory-mapped index is read-only; rebuild it to delete documents")
+
+    def segment_views(self) -> list[Segment]:
+        if self._segment is None:
+            postings = self.postings
+            matrix = CompressedTermDocumentMatrix(
+                self.term_ids, self.indptr, postings["term_doc_bytes"], postings["term_doc_offsets"],
+                postings["term_tf_bytes"], postings["term_tf_offsets"], self.lengths)
+            self._segment = Segment(np.arange(self.doc_count, dtype=np.int64), matrix, matrix.lengths)
+        return [self._segment]
+
+    @property
+    def matrix(self) -> CompressedTermDocumentMatrix:
+        return self.segment_views()[0].matrix
+
+    def live_mask(self) -> np.ndarray:
+        return np.ones(self.doc_count, dtype=bool)
+
+    def document_frequency(self, term: str) -> int:
+        row = self.vocabulary.get(term)
+        if row is None:
+            return 0
+        return int(self.indptr[row + 1] - self.indptr[row])
+
+    def term_count(self, term: str) -> int:
+        row = self.vocabulary.get(term)
+        return 0 if row is None else int(self.counts[row])
+
+    def idf(self, term: str) -> float:
+        return float(self.idfs(np.array([TERMS.lookup(term)]))[0])
+
+    def term_counts_of(self, term_ids: np.ndarray) -> np.ndarray:
+        rows = self.matrix.rows(term_ids)
+        return np.where(rows >= 0, self.counts[rows], 0)
+
+    def document_frequencies(self, term_ids: np.ndarray) -> np.ndarray:
+        rows = self.matrix.rows(term_ids)
+        return np.where(rows >= 0, self.indptr[rows + 1] - self.indptr[rows], 0)
+
+    def idfs(self, term_ids: np.ndarray) -> np.ndarray:
+        def compute(missing):
+            if not self.doc_count:
+                return [0.0] * len(missing)
+            return [math.log(self.doc_count / (1 + count)) for count in self.term_counts_of(missing).tolist()]
+        # nothing changes, so everything stays valid at generation 0
+        return self._idfs.get(term_ids, self.generation, compute)
+
+    def cached_term_weights(
+        self,
+        key,
+        term_ids: np.ndarray,
+        compute: Callable[[np.ndarray], np.ndarray],
+    ) -> np.ndarray:
+        return self._term_weights.setdefault(key, TermCache()).get(term_ids, self.generation, compute)
+
+    def collection_totals(self, model) -> dict[str, float]:
+        return model.totals(self)
+
+    def term_postings(self, term: str) -> list[tuple[int, int]]:
+        row = self.vocabulary.get(term)
+        if row is None:
+            return []
+        (doc_ids, tfs) = self.matrix.row_postings(row)
+        return list(zip(doc_ids.tolist(), tfs.tolist()))
+
+    def candidates(self, terms: Iterable[str]) -> list[int]:
+        rows = [self.vocabulary[term] for term in terms if term in self.vocabulary]
+        if not rows:
+            return []
+        (_, doc_ids, _) = self.matrix.postings(np.array(rows, dtype=np.int64))
+        return np.unique(doc_ids).tolist()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.terms)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+
+class MappedDocuments(Sequence):
+    """The document table of a loaded index; Documents are built on first access."""
+
+    def __init__(
+        self,
+        document_class: Type,
+        term_ids: np.ndarray,
+        idents: np.ndarray,
+        lengths: np.ndarray,
+        norms: np.ndarray,
+        indptr: np.ndarray,
+        doc_term_ids: np.ndarray,
+        tfs: np.ndarray,
+    ):
+        self.document_class = document_class
+        self.term_ids = term_ids  # TERMS id of each saved term
+        self.idents = idents
+        self.lengths = lengths
+        self.norms = norms  # full tf-idf vector norm of each document
+        self.indptr = indptr
+        self.doc_term_ids = doc_term_ids
+        self.tfs = tfs
+        self._cache: dict[int, object] = {}
+
+    def __getitem__(self, doc_id: int):
+        try:
+            return self._cache[doc_id]
+        except KeyError:
+            pass
+        if not 0 <= doc_id < len(self):
+            raise IndexError(doc_id)
+        start, end = self.indptr[doc_id], self.indptr[doc_id + 1]
+        doc = self.document_class.from_arrays(int(self.idents[doc_id]),
+                                              self.term_ids[self.doc_term_ids[start:end]],
+                                              np.array(self.tfs[start:end]), int(self.lengths[doc_id]))
+        self._cache[doc_id] = doc
+        return doc
+
+    def __len__(self) -> int:
+        return len(self.idents)
+
+    def append(self, doc):
+        raise TypeError("a memory-mapped index is read-only; rebuild it to add documents")
+
+
+def _encode_terms(terms: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    encoded = [term.encode("utf-8") for term in terms]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(term) for term in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _decode_terms(blob: np.ndarray, offsets: np.ndarray) -> list[str]:
+    raw = blob.tobytes()
+    bounds = offsets.tolist()
+    return [raw[start:end].decode("utf-8") for (start, end) in zip(bounds, bounds[1:])]
+
+
+def save_index(path: Path, documents: Sequence, settings: dict):
+    """Write the normalized corpus of an InfoRet, and its index, to directory `path`.
+
+    Doc ids in the saved index are positions in `documents`; the postings
+    are derived from the documents' term counts.
+    """
+    path = Path(path)
+    path.mkdir(parents = True, exist_ok = True)
+    (path / META_FILE).unlink(missing_ok = True)
+    doc_indptr = np.zeros(len(documents) + 1, dtype=np.int64)
+    np.cumsum([len(doc.terms) for doc in documents], out=doc_indptr[1:])
+    # saved terms are numbered afresh, in process term id order
+    empty = [np.zeros(0, dtype=np.int32)]
+    (global_ids, doc_term_ids) = np.unique(np.concatenate([doc.terms for doc in documents] or empty),
+                                           return_inverse=True)
+    doc_term_ids = doc_term_ids.astype(np.int32)
+    doc_tfs = np.concatenate([doc.counts for doc in documents] or empty).astype(np.int32)
+    terms = TERMS.strings(global_ids)
+
+    # a stable sort by term keeps each postings list in doc id order
+    order = np.argsort(doc_term_ids, kind="stable")
+    term_indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(doc_term_ids, minlength=len(terms)), out=term_indptr[1:])
+    term_doc_ids = np.repeat(np.arange(len(documents), dtype=np.int32), np.diff(doc_indptr))[order]
+    term_tfs = doc_tfs[order]
+    term_counts = np.bincount(doc_term_ids, weights=doc_tfs, minlength=len(terms)).astype(np.int64)
+    idfs = np.log(len(documents) / (1 + term_counts.astype(np.float64)))
+    doc_lengths = np.array([doc.length for doc in documents], dtype=np.int64)
+    # norm of each document's full tf-idf vector
+    weights = (doc_tfs / np.repeat(doc_lengths, np.diff(doc_indptr))) * idfs[doc_term_ids]
+    doc_norms = np.sqrt(np.add.reduceat(weights * weights, doc_indptr[:-1])
+                        if len(weights) else np.zeros(len(documents)))
+
+    vocab_bytes, vocab_offsets = _encode_terms(terms)
+    (term_doc_bytes, term_doc_offsets) = varbyte.encode_lists(term_indptr, term_doc_ids, gaps=True)
+    (term_tf_bytes, term_tf_offsets) = varbyte.encode_lists(term_indptr, term_tfs)
+    (term_indptr, term_doc_offsets, term_tf_offsets) = (
+        compact(offsets) for offsets in (term_indptr, term_doc_offsets, term_tf_offsets))
+    arrays = {
+        "vocab_bytes": vocab_bytes,
+        "vocab_offsets": vocab_offsets,
+        "term_indptr": term_indptr,
+        "term_doc_bytes": term_doc_bytes,
+        "term_doc_offsets": term_doc_offsets,
+        "term_tf_bytes": term_tf_bytes,
+        "term_tf_offsets": term_tf_offsets,
+        "term_counts": term_counts,
+        "doc_idents": np.array([doc.ident for doc in documents], dtype=np.int64),
+        "doc_lengths": doc_lengths,
+        "doc_norms": doc_norms,
+        "doc_indptr": doc_indptr,
+        "doc_term_ids": doc_term_ids,
+        "doc_tfs": doc_tfs,
+    }
+    for (name, array) in arrays.items():
+        np.save(path / f"{name}.npy", array)
+    # written last, so a directory without it is an incomplete save
+    with open(path / META_FILE, "w") as out:
+        json.dump({
+            "format": FORMAT_VERSION,
+            "settings": settings,
+            "doc_count": len(documents),
+            "term_count": len(terms),
+        }, out)
+
+
+def load_index(path: Path, settings: dict, document_class: Type) -> tuple[MappedIndex, MappedDocuments]:
+    """Memory-map an index saved by `save_index`.
+
+    Raises IndexSettingsMismatch if it was built with different
+    normalization settings than `settings`.
+    """
+    path = Path(path)
+    with open(path / META_FILE) as inp:
+        meta = json.load(inp)
+    if meta["format"] != FORMAT_VERSION:
+        raise IndexSettingsMismatch(f"{path} has index format {meta['format']}, expected {FORMAT_VERSION}")
+    if meta["settings"] != settings:
+        differing = sorted(key for key in meta["settings"].keys() | settings.keys()
+                           if meta["settings"].get(key) != settings.get(key))
+        raise IndexSettingsMismatch(f"{path} was built with different {', '.join(differing)}")
+
+    def mapped(name: str) -> np.ndarray:
+        return np.load(path / f"{name}.npy", mmap_mode="r")
+
+    terms = _decode_terms(mapped("vocab_bytes"), mapped("vocab_offsets"))
+    term_ids = TERMS.intern_all(terms)
+    postings = {name: mapped(name) for name in ("term_indptr", "term_doc_bytes", "term_doc_offsets",
+                                                "term_tf_bytes", "term_tf_offsets")}
+    index = MappedIndex(terms, term_ids, postings, mapped("term_counts"), meta["doc_count"],
+                        mapped("doc_lengths"))
+    documents = MappedDocuments(document_class, term_ids, mapped("doc_idents"), mapped("doc_lengths"),
+                                mapped("doc_norms"), mapped("doc_indptr"), mapped("doc_term_ids"),
+                                mapped("doc_tfs"))
+    return index, documents
@@ -0,0 +1,218 @@
+"""Run many InfoRet configurations over one collection and tabulate the results.
+
+usage: python -m inforet.sweep cran.all.1400 cran.qry cranqrel [--workers N] [--only NAME ...] [--out DIR]
+
+The collection, queries and judgements are read, and the text tokenized,
+once in the parent process. Each configuration from
+`cranfield.configurations()` then runs in a fresh worker process that
+inherits all of that: it indexes the documents, answers every query with
+one perform_queries call, and scores the answers in memory with
+cranfield_score. A row of the table has the run's metrics, then the
+seconds and peak resident memory (MB) of the index, query and score stages.
+Memory is the worker's high-water mark at the end of each stage, so it
+never goes down from one stage to the next.
+
+Configurations are independent and deterministic, so a sweep gives the
+same metrics whatever the number of workers; rows are printed in
+configuration order.
+"""
+import argparse
+import fnmatch
+import json
+import multiprocessing
+import sys
+import time
+import traceback
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+from inforet import InfoRet
+from inforet.cache import TokenCache
+from inforet.cranfield import configurations, iter_cran_docs, print_results
+from inforet.collection import iter_cran_records
+from inforet.cranfield_score import Judgements, evaluate_run, means
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+# metrics shown in the printed table; the TSV has every one
+SUMMARY_METRICS = ("average precision", "P@10", "R-precision", "nDCG@10")
+STAGES = ("index", "query", "score")
+
+
+class Corpus:
+    """Everything a configuration needs besides itself, shared by every worker."""
+
+    documents: list[tuple[int, str]]
+    queries: list[tuple[int, str]]
+    judgements: Judgements
+    token_cache: TokenCache
+    ks: Sequence[int]
+    out: Optional[Path]
+
+    def __init__(
+        self,
+        documents: list[tuple[int, str]],
+        queries: list[tuple[int, str]],
+        judgements: Judgements,
+        token_cache: TokenCache,
+        ks: Sequence[int],
+        out: Optional[Path],
+    ):
+        self.documents = documents
+        self.queries = queries
+        self.judgements = judgements
+        self.token_cache = token_cache
+        self.ks = ks
+        self.out = out  # where to write each run's results file, if anywhere
+
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+
+# worker process state
+_corpus: Optional[Corpus] = None
+
+def _init_worker(corpus: Corpus):
+    global _corpus
+    _corpus = corpus
+
+
+def run_configuration(task: tuple[int, str, InfoRet]) -> dict:
+    """Index, query and score one configuration; the row of the sweep table."""
+    (position, name, instance) = task
+    corpus = _corpus
+    row = {"position": position, "name": name}
+    try:
+        instance.token_cache = corpus.token_cache
+        start = time.perf_counter()
+        instance.add_documents(corpus.documents)
+        row["index s"] = time.perf_counter() - start
+        row["index MB"] = peak_rss_mb()
+
+        start = time.perf_counter()
+        queries = [instance.make_query(ident, text) for (ident, text) in corpus.queries]
+        results = instance.perform_queries(queries)
+        row["query s"] = time.perf_counter() - start
+        row["query MB"] = peak_rss_mb()
+
+        start = time.perf_counter()
+        run_queries = np.array([query.ident for (query, ranked) in zip(queries, results) for _ in ranked],
+                               dtype=np.int64)
+        run_docs = np.array([doc.ident for ranked in results for (doc, _) in ranked], dtype=np.int64)
+        (metrics, missing) = evaluate_run(corpus.judgements, run_queries, run_docs, corpus.ks)
+        row.update(means(metrics))
+        row["missing"] = len(missing)
+        row["score s"] = time.perf_counter() - start
+        row["score MB"] = peak_rss_mb()
+
+        if corpus.out is not None:
+            with open(corpus.out / name, "w") as out:
+                for (query, ranked) in zip(queries, results):
+                    print_results(query, ranked, out)
+    except Exception:
+        row["error"] = traceback.format_exc(limit = 3).strip().splitlines()[-1]
+    return row
+
+
+def load_corpus(
+    docs: Path,
+    queries: Path,
+    judgements: Path,
+    workers: int,
+    ks: Sequence[int],
+    out: Optional[Path],
+) -> Corpus:
+    documents = list(iter_cran_docs(docs))
+    # numbered by position, as cranqrel does
+    query_texts = [(ident, record.text()) for (ident, record) in enumerate(iter_cran_records(queries), start = 1)]
+    # raw tokens are the same for every InfoRet configuration; tokenize once, here
+    token_cache = TokenCache()
+    tokenizer = InfoRet(token_cache = token_cache)
+    for _ in tokenizer.normalize_documents(documents + query_texts, workers):
+        pass
+    return Corpus(documents, query_texts, Judgements(judgements), token_cache, ks, out)
+
+
+def sweep(
+    corpus: Corpus,
+    tests: list[tuple[str, InfoRet]],
+    workers: int,
+) -> list[dict]:
+    """Rows for `tests`, in order, run `workers` at a time, each in a new process."""
+    tasks = [(position, name, instance) for (position, (name, instance)) in enumerate(tests)]
+    rows = []
+    # a process per configuration, so each one's peak memory is its own
+    with multiprocessing.Pool(workers, initializer = _init_worker, initargs = (corpus,),
+                              maxtasksperchild = 1) as pool:
+        for row in pool.imap_unordered(run_configuration, tasks):
+            status = row.get("error") or f"MAP {row['average precision']:.4f}"
+            print(f"  {row['name']}: {status}", file = sys.stderr, flush = True)
+            rows.append(row)
+    return sorted(rows, key = lambda row: row["position"])
+
+
+def print_table(rows: list[dict]):
+    columns = SUMMARY_METRICS + tuple(f"{stage} {unit}" for stage in STAGES for unit in ("s", "MB"))
+    width = max(len(row["name"]) for row in rows)
+    print(f"{'configuration':<{width}}" + "".join(f"{column:>12}" for column in columns))
+    for row in rows:
+        if "error" in row:
+            print(f"{row['name']:<{width}}  {row['error']}")
+            continue
+        cells = []
+        for column in columns:
+            cells.append(f"{row[column]:>12.4f}" if column in SUMMARY_METRICS else f"{row[column]:>12.2f}")
+        print(f"{row['name']:<{width}}" + "".join(cells))
+
+
+def write_tsv(rows: list[dict], path: Path):
+    columns = ["name"]
+    for row in rows:
+        columns.extend(column for column in row if column not in columns and column != "position")
+    with open(path, "w") as out:
+        out.write("\t".join(columns) + "\n")
+        for row in rows:
+            out.write("\t".join(str(row.get(column, "")) for column in columns) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("docs", type = Path)
+    parser.add_argument("queries", type = Path)
+    parser.add_argument("judgements", type = Path)
+    parser.add_argument("--workers", type = int, default = multiprocessing.cpu_count())
+    parser.add_argument("--only", nargs = "+", metavar = "NAME",
+                        help = "configurations to run, by name or glob, e.g. '1?_*' (default all)")
+    parser.add_argument("--k", type = int, nargs = "+", default = [5, 10, 20], help = "cutoffs for P@k and nDCG@k")
+    parser.add_argument("--out", type = Path, help = "directory for each run's results and sweep.tsv")
+    parser.add_argument("--json", action = "store_true", help = "print the rows as JSON instead of a table")
+    args = parser.parse_args()
+
+    tests = configurations()
+    if args.only:
+        tests = [(name, instance) for (name, instance) in tests
+                 if any(fnmatch.fnmatch(name, pattern) for pattern in args.only)]
+    if args.out is not None:
+        args.out.mkdir(parents = True, exist_ok = True)
+
+    start = time.perf_counter()
+    corpus = load_corpus(args.docs, args.queries, args.judgements, args.workers, args.k, args.out)
+    print(f"read and tokenized the collection in {time.perf_counter() - start:.1f}s", file = sys.stderr)
+    rows = sweep(corpus, tests, args.workers)
+    print(f"{len(rows)} configurations in {time.perf_counter() - start:.1f}s", file = sys.stderr)
+
+    if args.json:
+        print(json.dumps(rows, indent = 1))
+    else:
+        print_table(rows)
+    if args.out is not None:
+        write_tsv(rows, args.out / "sweep.tsv")
@@ -0,0 +1,119 @@
+"""Process-wide term interning.
+
+Every distinct normalized term is given a small integer id the first time
+any document or query in the process contains it, and keeps it for the life
+of the process. Documents, queries and index segments then store int32 id
+arrays rather than their own copies of the strings, and term lookups in the
+index are array operations. Ids mean nothing outside the process that gave
+them out: anything pickled to another process carries the term strings.
+"""
+import threading
+from typing import Callable, Iterable, Sequence
+
+import numpy as np
+
+TERM_DTYPE = np.int32
+
+
+class TermTable:
+    """Two-way map between terms and their ids; ids count up from 0."""
+
+    ids: dict[str, int]
+    terms: list[str]  # the term of each id
+
+    def __init__(self):
+        self.ids = {}
+        self.terms = []
+        self.lock = threading.Lock()
+
+    def intern(self, term: str) -> int:
+        term_id = self.ids.get(term)
+        if term_id is None:
+            with self.lock:
+                term_id = self.ids.get(term)
+                if term_id is None:
+                    # the string first, so an id is never seen before its term
+                    term_id = len(self.terms)
+                    self.terms.append(term)
+                    self.ids[term] = term_id
+        return term_id
+
+    def intern_all(self, terms: Sequence[str]) -> np.ndarray:
+        """The id of each of `terms`, giving new ones ids as needed."""
+        get = self.ids.get
+        found = [get(term) for term in terms]
+        if None in found:
+            found = [self.intern(term) if term_id is None else term_id
+                     for (term, term_id) in zip(terms, found)]
+        return np.array(found, dtype=TERM_DTYPE)
+
+    def lookup(self, term: str) -> int:
+        """The id of `term`, or -1 if no document or query has contained it."""
+        return self.ids.get(term, -1)
+
+    def lookup_all(self, terms: Iterable[str]) -> np.ndarray:
+        get = self.ids.get
+        return np.array([get(term, -1) for term in terms], dtype=TERM_DTYPE)
+
+    def strings(self, term_ids: np.ndarray) -> list[str]:
+        terms = self.terms
+        return [terms[term_id] for term_id in term_ids.tolist()]
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+
+TERMS = TermTable()
+
+
+def count_terms(term_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Distinct ids of a token sequence and how often each occurs.
+
+    Ids come out in order of first occurrence, the order a Counter of the
+    tokens iterates in, so sums over them add up in the same order.
+    """
+    (unique, first, counts) = np.unique(term_ids, return_index=True, return_counts=True)
+    order = np.argsort(first)
+    return unique[order].astype(TERM_DTYPE), counts[order].astype(np.int32)
+
+
+class TermCache:
+    """Per-term values, computed on demand and kept until the generation changes.
+
+    Values sit in an array indexed by term id, each tagged with the index
+    generation it was computed at, so a change to the index makes them all
+    stale without touching them.
+    """
+
+    def __init__(self):
+        self.values = np.zeros(0)
+        self.generations = np.zeros(0, dtype=np.int64)
+
+    def get(
+        self,
+        term_ids: np.ndarray,
+        generation: int,
+        compute: Callable[[np.ndarray], np.ndarray],
+    ) -> np.ndarray:
+        """The value of each of `term_ids`; compute(distinct ids) fills in stale ones.
+
+        An id of -1, a term no document has contained, is never cached.
+        """
+        unknown = term_ids < 0
+        if unknown.any():
+            values = np.empty(len(term_ids))
+            values[~unknown] = self.get(term_ids[~unknown], generation, compute)
+            values[unknown] = compute(term_ids[unknown])
+            return values
+        if len(self.values) < len(TERMS):
+            size = max(len(TERMS), 2 * len(self.values))
+            self.values = np.resize(self.values, size)
+            generations = np.full(size, -1, dtype=np.int64)
+            generations[:len(self.generations)] = self.generations
+            self.generations = generations
+        stale = self.generations[term_ids] != generation
+        if stale.any():
+            missing = np.unique(term_ids[stale])
+            self.values[missing] = compute(missing)
+            self.generations[missing] = generation
+        return self.values[term_ids]
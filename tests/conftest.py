@@ -0,0 +1,54 @@
+"""Shared fixtures. The checkout is the `inforet` package itself, so it is
+imported under that name from wherever it lives.
+"""
+import importlib.util
+import sys
+from pathlib import Path
+
+import nltk
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+if "inforet" not in sys.modules:
+    spec = importlib.util.spec_from_file_location("inforet", ROOT / "__init__.py",
+                                                  submodule_search_locations = [str(ROOT)])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["inforet"] = module
+    spec.loader.exec_module(module)
+
+from inforet.collection import iter_cran_records
+from inforet.cranfield import iter_cran_docs
+
+CRAN = ROOT / "cran"
+
+
+@pytest.fixture(scope = "session")
+def cran_documents() -> list[tuple[int, str]]:
+    return list(iter_cran_docs(CRAN / "cran.all.1400"))
+
+
+@pytest.fixture(scope = "session")
+def cran_texts() -> list[tuple[int, list[str]]]:
+    """The Cranfield abstracts, split on whitespace, so no tokenizer data is needed.
+
+    A few are empty; those get a lone ".", as a Document needs a word.
+    """
+    return [(record.ident, record.text().split() or ["."])
+            for record in iter_cran_records(CRAN / "cran.all.1400")]
+
+
+@pytest.fixture(scope = "session")
+def cran_queries() -> list[tuple[int, list[str]]]:
+    # numbered by position, as cranqrel does
+    return [(ident, record.text().split())
+            for (ident, record) in enumerate(iter_cran_records(CRAN / "cran.qry"), start = 1)]
+
+
+@pytest.fixture(scope = "session")
+def punkt():
+    """Skips the test unless nltk.word_tokenize has the Punkt data it needs."""
+    try:
+        nltk.word_tokenize("One sentence. Another.")
+    except LookupError:
+        pytest.skip("nltk Punkt data is not installed")
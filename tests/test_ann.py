@@ -0,0 +1,65 @@
+import numpy as np
+
+from inforet import Document, SpacyInfoRet
+from inforet.ann import IVFIndex
+
+
+def trained_index(count: int) -> IVFIndex:
+    vectors = np.random.default_rng(0).normal(size = (count, 16)).astype(np.float32)
+    ann = IVFIndex(n_lists = 8)
+    ann.train(vectors / np.linalg.norm(vectors, axis = 1, keepdims = True))
+    return ann
+
+
+def test_constructor_keeps_a_trained_index():
+    ann = trained_index(100)
+    assert SpacyInfoRet(use_vector = 1, ann = ann).ann is ann
+
+
+def test_clear_drops_an_index_of_its_documents():
+    instance = SpacyInfoRet(use_vector = 1, ann = trained_index(100))
+    instance.clear()
+    assert not instance.ann.trained
+
+
+def test_save_load_keeps_the_ann_index(tmp_path, cran_texts):
+    documents = cran_texts[:100]
+    ann = trained_index(len(documents))
+    # use_vector = 0 while indexing, so no spaCy model is needed for the embeddings
+    built = SpacyInfoRet(ann = ann)
+    for (ident, words) in documents:
+        built.index_document(Document(ident, words))
+    built.save_index(tmp_path / "index")
+
+    loaded = SpacyInfoRet(ann = IVFIndex(n_lists = 8))
+    loaded.load_index(tmp_path / "index")
+    assert loaded.ann.trained and loaded.ann.count == ann.count
+    assert np.array_equal(loaded.ann.centroids, ann.centroids)
+    query = ann.centroids[:3]
+    for ((ids, scores), (expected_ids, expected_scores)) in zip(loaded.ann.search(query, 5), ann.search(query, 5)):
+        assert np.array_equal(ids, expected_ids) and np.allclose(scores, expected_scores)
+
+
+def test_save_skips_the_ann_index_after_deletes(tmp_path, cran_texts):
+    built = SpacyInfoRet(ann = trained_index(100))
+    for (ident, words) in cran_texts[:100]:
+        built.index_document(Document(ident, words))
+    built.delete_document(cran_texts[0][0])
+    built.save_index(tmp_path / "index")
+
+    loaded = SpacyInfoRet(ann = IVFIndex(n_lists = 8))
+    loaded.load_index(tmp_path / "index")
+    assert not loaded.ann.trained
+
+
+def test_load_keeps_the_training_parameters(tmp_path):
+    vectors = np.random.default_rng(0).normal(size = (200, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis = 1, keepdims = True)
+    ann = IVFIndex(n_lists = 8, iterations = 3, training_sample = 17, seed = 5)
+    ann.train(vectors)
+    ann.save(tmp_path / "ann")
+    copy = IVFIndex.load(tmp_path / "ann").untrained_copy()
+    assert (copy.iterations, copy.training_sample, copy.seed) == (3, 17, 5)
+    # so training again gives the same index
+    copy.train(vectors)
+    assert np.array_equal(copy.centroids, ann.centroids)
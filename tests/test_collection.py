@@ -0,0 +1,62 @@
+from pathlib import Path
+
+import pytest
+
+from inforet.collection import _block_records, iter_cran_records
+from inforet.cranfield import iter_cran_docs
+
+CRAN = Path(__file__).resolve().parent.parent / "cran"
+
+
+def readlines_documents(path) -> list[tuple[int, str]]:
+    # the line-by-line parser iter_cran_docs replaced
+    documents = []
+    (text, ident) = ("", 0)
+    with open(path) as inp:
+        for line in inp.readlines():
+            if line[0:2] == ".I":
+                if text and ident:
+                    documents.append((ident, text))
+                (text, ident) = ("", int(line[3:]))
+            elif line[0] == ".":
+                text += line[3:]
+            else:
+                text += line
+    documents.append((ident, text))
+    return documents
+
+
+def readlines_queries(path) -> list[tuple[int, str]]:
+    queries = []
+    (text, ident) = ("", 0)
+    with open(path) as inp:
+        for line in inp.readlines():
+            if line[0:2] == ".I":
+                if ident:
+                    queries.append((ident, text))
+                (text, ident) = ("", ident + 1)
+            elif line[0:2] == ".W":
+                text += line[3:]
+            else:
+                text += line
+    queries.append((ident, text))
+    return queries
+
+
+def test_documents_match_readlines_parser():
+    path = CRAN / "cran.all.1400"
+    assert list(iter_cran_docs(path)) == readlines_documents(path)
+
+
+def test_queries_match_readlines_parser():
+    path = CRAN / "cran.qry"
+    records = iter_cran_records(path)
+    assert [(ident, record.text()) for (ident, record) in enumerate(records, start = 1)] == readlines_queries(path)
+
+
+@pytest.mark.parametrize("block_size", [4096, 1 << 20])
+def test_block_reads_match_mmap(block_size):
+    path = CRAN / "cran.all.1400"
+    expected = [(record.ident, record.text()) for record in iter_cran_records(path)]
+    with open(path, "rb") as inp:
+        assert [(record.ident, record.text()) for record in _block_records(inp, block_size)] == expected
@@ -0,0 +1,89 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from inforet.cranfield_score import Judgements, evaluate
+
+CRANQREL = Path(__file__).resolve().parent.parent / "cran" / "cranqrel"
+
+
+def judged() -> dict[int, list[int]]:
+    keys = {}
+    with open(CRANQREL) as inp:
+        for line in inp:
+            (query, doc, _) = (int(field) for field in line.split())
+            if doc not in keys.setdefault(query, []):
+                keys[query].append(doc)
+    return keys
+
+
+# the per-query loop cranfield_score.py used to be, with the f-score and the
+# empty interpolated average precision made total
+def interpolated_average_precision(keys, responses):
+    (correct, incorrect, milestone, precisions) = (0, 0, .1, [])
+    for doc in responses:
+        if doc in keys:
+            correct += 1
+            while correct / len(keys) > milestone:
+                precisions.append(correct / (correct + incorrect))
+                milestone += .1
+        else:
+            incorrect += 1
+    return sum(precisions) / len(precisions) if precisions else 0
+
+
+def f_score(precision, recall):
+    return 2 / ((1 / precision) + (1 / recall)) if precision and recall else 0
+
+
+def legacy_metrics(keys, responses) -> dict[str, float]:
+    correct = sum(1 for doc in responses if doc in keys)
+    truncated = sum(1 for doc in responses[:len(keys)] if doc in keys)
+    (precision, recall) = (correct / len(responses), correct / len(keys))
+    (truncated_precision, truncated_recall) = (truncated / len(responses[:len(keys)]), truncated / len(keys))
+    hits = [doc in keys for doc in responses]
+    return {
+        "interpolated average precision": interpolated_average_precision(keys, responses),
+        "average precision": sum(sum(hits[:rank]) / rank for rank in range(1, len(hits) + 1)
+                                 if hits[rank - 1]) / len(keys),
+        "P@10": sum(hits[:10]) / 10,
+        "R-precision": sum(hits[:len(keys)]) / len(keys),
+        "precision": precision,
+        "recall": recall,
+        "f-score": f_score(precision, recall),
+        "truncated precision": truncated_precision,
+        "truncated recall": truncated_recall,
+        "truncated f-score": f_score(truncated_precision, truncated_recall),
+    }
+
+
+def write_run(path: Path, seed: int) -> dict[int, list[int]]:
+    """A random run over most judged queries, some relevant documents and some repeats among them."""
+    rng = np.random.default_rng(seed)
+    responses = {}
+    with open(path, "w") as out:
+        for (query, keys) in judged().items():
+            if rng.random() < 0.05:
+                continue  # a query with no results
+            docs = rng.integers(1, 1401, int(rng.integers(1, 120))).tolist()
+            relevant = rng.choice(keys, int(rng.integers(0, len(keys) + 1)), replace = False).tolist()
+            for doc in relevant:
+                docs.insert(int(rng.integers(0, len(docs) + 1)), doc)
+            for doc in docs:
+                out.write(f"{query} {doc} 0.5\n")
+            # a repeated document only counts where it first appears
+            responses[query] = list(dict.fromkeys(docs))
+    return responses
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_matches_per_query_loop(tmp_path, seed):
+    responses = write_run(tmp_path / "run", seed)
+    (metrics, missing) = evaluate(Judgements(CRANQREL), tmp_path / "run", ks = (10,))
+    keys = judged()
+    assert sorted(missing.tolist()) == sorted(set(keys) - set(responses))
+    assert metrics["query"].tolist() == sorted(responses)
+    for (position, query) in enumerate(metrics["query"].tolist()):
+        for (name, expected) in legacy_metrics(keys[query], responses[query]).items():
+            assert metrics[name][position] == pytest.approx(expected, rel = 1e-12, abs = 1e-15), (query, name)
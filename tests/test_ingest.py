@@ -0,0 +1,15 @@
+from inforet import InfoRet
+
+
+def postings_of(instance: InfoRet) -> dict:
+    return {term: instance.index.term_postings(term) for term in instance.index}
+
+
+def test_parallel_add_documents_matches_serial(punkt, cran_documents):
+    documents = cran_documents[:300]
+    serial = InfoRet()
+    serial.add_documents(documents)
+    parallel = InfoRet()
+    parallel.add_documents(documents, workers = 2, chunksize = 8)
+    assert [doc.ident for doc in parallel.document_table] == [doc.ident for doc in serial.document_table]
+    assert postings_of(parallel) == postings_of(serial)
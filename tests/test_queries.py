@@ -0,0 +1,131 @@
+import itertools
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from inforet import Document, InfoRet, Query
+from inforet.cranfield import class_stop_words
+from inforet.scoring import BM25, BM25Plus, PivotedNormalization
+from inforet.shards import GlobalStatistics
+from inforet.terms import TERMS
+
+STOPWORDS = set(class_stop_words)
+
+
+def normalized(words: list[str]) -> list[str]:
+    return [word for word in (word.lower() for word in words) if word not in STOPWORDS] or ["."]
+
+
+def build(cran_texts, **kwargs) -> InfoRet:
+    instance = InfoRet(**kwargs)
+    for (ident, words) in cran_texts:
+        instance.index_document(Document(ident, normalized(words)))
+    return instance
+
+
+def ranking(results) -> list[tuple[int, float]]:
+    return [(doc.ident, score) for (doc, score) in results]
+
+
+@pytest.fixture(scope = "module")
+def queries(cran_queries) -> list[Query]:
+    return [Query(ident, normalized(words)) for (ident, words) in cran_queries]
+
+
+@pytest.mark.parametrize("scoring", [None, BM25(), BM25Plus(), PivotedNormalization()], ids = repr)
+def test_batch_equals_per_query(cran_texts, queries, scoring):
+    instance = build(cran_texts, scoring = scoring)
+    batch = instance.perform_queries(queries, 50)
+    for (query, ranked) in zip(queries, batch):
+        assert ranking(instance.perform_query(query, 50)) == ranking(ranked)
+
+
+def reference_scores(instance: InfoRet, texts: dict[int, list[str]], words: list[str]) -> dict[int, float]:
+    """Cosine of every document sharing a term with the query, one (query, document) pair at a time.
+
+    idfs are counted from the texts, and the vectors have one dimension
+    per query token, as the original perform_query built them.
+    """
+    totals = Counter(itertools.chain.from_iterable(texts.values()))
+    idf = {term: math.log(len(texts) / (1 + totals[term])) for term in words}
+    query_counts = Counter(words)
+    query_vec = np.array([query_counts[term] / len(words) * idf[term] for term in words])
+    scores = {}
+    for (ident, text) in texts.items():
+        counts = Counter(text)
+        if any(counts[term] for term in words):
+            doc_vec = np.array([counts[term] / len(text) * idf[term] for term in words])
+            scores[ident] = float(instance.vector_similarity(query_vec, doc_vec))
+    return scores
+
+
+def test_batch_matches_per_pair_cosine(cran_texts, queries, cran_queries):
+    instance = build(cran_texts)
+    texts = {ident: normalized(words) for (ident, words) in cran_texts}
+    for ((_, words), ranked) in zip(cran_queries, instance.perform_queries(queries, 50)):
+        expected = reference_scores(instance, texts, normalized(words))
+        passing = sorted((score for score in expected.values() if score > instance.inclusion_threshold),
+                         reverse = True)[:50]
+        assert [score for (_, score) in ranking(ranked)] == pytest.approx(passing, rel = 1e-12)
+        for (ident, score) in ranking(ranked):
+            assert score == pytest.approx(expected[ident], rel = 1e-12)
+
+
+def test_batch_equals_per_query_untruncated(cran_texts, queries):
+    instance = build(cran_texts)
+    for (query, ranked) in zip(queries[:25], instance.perform_queries(queries[:25])):
+        assert ranking(instance.perform_query(query)) == ranking(ranked)
+
+
+@pytest.mark.parametrize("k", [1, 10, 100])
+def test_pruned_top_k_equals_truncated(cran_texts, queries, k):
+    instance = build(cran_texts)
+    for query in queries:
+        assert ranking(instance.perform_query(query, k, prune = True)) == ranking(instance.perform_query(query, k))
+
+
+def test_pruned_top_k_with_global_statistics(cran_texts, queries):
+    # a shard with a quarter of the documents, scoring with the idfs of all of them
+    full = build(cran_texts)
+    shard = build([(ident, words) for (ident, words) in cran_texts if ident % 4 == 0])
+    statistics = GlobalStatistics(shard.index)
+    term_ids = np.flatnonzero(full.index.doc_frequencies)
+    statistics.update(full.index.doc_count, full.index.total_length, TERMS.strings(term_ids),
+                      full.index.term_counts[term_ids], full.index.doc_frequencies[term_ids])
+    shard.global_statistics = statistics
+    for query in queries:
+        pruned = ranking(shard.perform_query(query, 10, prune = True))
+        assert pruned == ranking(shard.perform_query(query, 10))
+        expected = dict(ranking(full.perform_query(query)))
+        assert [score for (_, score) in pruned] == [expected[ident] for (ident, _) in pruned]
+
+
+def test_pruned_query_on_an_empty_index(queries):
+    instance = InfoRet()
+    assert instance.perform_query(queries[0], 5, prune = True) == []
+    assert instance.perform_query(queries[0], 0, prune = True) == []
+    # a query of terms no document has
+    assert build([(1, ["wing"])]).perform_query(Query(1, ["nowhere"]), 5, prune = True) == []
+
+
+def test_query_timings_break_down_the_stages(cran_texts, queries):
+    instance = build(cran_texts[:200])
+    instance.perform_query(queries[0], 10)
+    assert list(instance.last_query_timings.stages) == ["idf", "query_vector", "score", "rank"]
+    instance = build(cran_texts[:200], scoring = BM25())
+    instance.perform_queries(queries[:5], 10)
+    assert list(instance.last_query_timings.stages) == ["score", "rank"]
+
+
+@pytest.mark.parametrize("scoring", [None, BM25()], ids = repr)
+def test_only_candidate_documents_are_scored(cran_texts, queries, scoring):
+    instance = build(cran_texts, scoring = scoring)
+    instance.delete_document(cran_texts[0][0])
+    for (query, (doc_ids, scores)) in zip(queries[:50], instance.query_score_rows(queries[:50])):
+        terms = set(TERMS.strings(query.terms))
+        expected = [doc_id for (doc_id, doc) in enumerate(instance.document_table)
+                    if doc is not None and terms & set(TERMS.strings(doc.terms))]
+        assert doc_ids.tolist() == expected
+        assert len(scores) == len(expected)
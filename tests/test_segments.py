@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from inforet import Document, InfoRet, Query
+from inforet.scoring import BM25, BM25Plus, PivotedNormalization
+from inforet.segments import SegmentedIndex
+from inforet.shards import GlobalStatistics
+from inforet.terms import TERMS
+
+
+def build(texts, scoring = None, flush_size = 256, background_merges = False) -> InfoRet:
+    instance = InfoRet(scoring = scoring)
+    instance.flush_size = flush_size
+    instance.background_merges = background_merges
+    instance.clear()
+    for (ident, words) in texts:
+        instance.index_document(Document(ident, words))
+    return instance
+
+
+def ranking(results) -> list[tuple[int, float]]:
+    return [(doc.ident, score) for (doc, score) in results]
+
+
+@pytest.mark.parametrize("background_merges", [False, True])
+@pytest.mark.parametrize("scoring", [None, BM25()], ids = repr)
+def test_delete_and_merge_equal_rebuild(cran_texts, cran_queries, scoring, background_merges):
+    # small segments, so deletes leave many of them mostly empty and due for merging
+    instance = build(cran_texts, scoring, flush_size = 16, background_merges = background_merges)
+    deleted = set(np.random.default_rng(0).choice([ident for (ident, _) in cran_texts], 500,
+                                                  replace = False).tolist())
+    for ident in sorted(deleted):
+        instance.delete_document(ident)
+        instance.index.maybe_merge()
+    instance.index.wait_for_merges()
+    rebuilt = build([(ident, words) for (ident, words) in cran_texts if ident not in deleted], scoring)
+
+    index = instance.index
+    assert (index.doc_count, index.total_length) == (rebuilt.index.doc_count, rebuilt.index.total_length)
+    assert {term: index.term_count(term) for term in index} == \
+        {term: rebuilt.index.term_count(term) for term in rebuilt.index}
+
+    queries = [Query(ident, words) for (ident, words) in cran_queries]
+    expected = [ranking(ranked) for ranked in rebuilt.perform_queries(queries, 50)]
+    assert [ranking(ranked) for ranked in instance.perform_queries(queries, 50)] == expected
+    # and once everything is merged into one segment
+    index.merge()
+    assert len(index.segment_views()) == 1
+    assert [ranking(ranked) for ranked in instance.perform_queries(queries, 50)] == expected
+
+
+def test_deleted_documents_are_not_returned(cran_texts, cran_queries):
+    instance = build(cran_texts, flush_size = 16)
+    query = Query(1, cran_queries[0][1])
+    top = [doc.ident for (doc, _) in instance.perform_query(query, 5)]
+    for ident in top:
+        instance.delete_document(ident)
+    remaining = [doc.ident for (doc, _) in instance.perform_query(query)]
+    assert not set(top) & set(remaining)
+    with pytest.raises(KeyError):
+        instance.delete_document(top[0])
+
+
+@pytest.mark.parametrize("scoring", [None, BM25(), BM25Plus(), PivotedNormalization()], ids = repr)
+def test_queries_after_deleting_everything(cran_texts, cran_queries, tmp_path, scoring):
+    instance = build(cran_texts[:40], scoring, flush_size = 16)
+    for (ident, _) in cran_texts[:40]:
+        instance.delete_document(ident)
+    assert instance.index.doc_count == 0
+    query = Query(1, cran_queries[0][1])
+    assert instance.perform_query(query, 5) == []
+    assert instance.perform_query(query, 5, prune = True) == []
+    assert instance.perform_query(query) == []
+    assert instance.perform_queries([query, query], 5) == [[], []]
+    # and saved without them
+    instance.save_index(tmp_path / "index")
+    loaded = InfoRet(scoring = scoring)
+    loaded.load_index(tmp_path / "index")
+    assert loaded.perform_query(query, 5) == []
+    assert loaded.perform_query(query, 5, prune = True) == []
+
+
+def test_idfs_of_no_documents(cran_texts):
+    instance = build(cran_texts[:40])
+    term_ids = TERMS.lookup_all(cran_texts[0][1])
+    # before the coordinator sends any totals, a shard's collection is empty
+    for statistics in (SegmentedIndex(), GlobalStatistics(instance.index)):
+        assert statistics.doc_count == 0
+        assert statistics.idfs(term_ids).tolist() == [0.0] * len(term_ids)
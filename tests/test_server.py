@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+from inforet import Document, InfoRet
+from inforet.matrix import top_k
+from inforet.server import QueryServer, top_k_argument
+
+
+class SplitInfoRet(InfoRet):
+    # whitespace tokens, so the server needs no tokenizer data
+    def normalize_text(self, text: str) -> list[str]:
+        return text.split()
+
+
+@pytest.fixture(scope = "module")
+def instance(cran_texts) -> InfoRet:
+    instance = SplitInfoRet()
+    for (ident, words) in cran_texts:
+        instance.index_document(Document(ident, words))
+    return instance
+
+
+async def responses(instance: InfoRet, requests: list[dict]) -> list[dict]:
+    """The server's reply to each request, all sent at once so they share batches."""
+    server = QueryServer(instance, workers = 0, max_wait = 0.05)
+    listener = await server.start(port = 0)
+    try:
+        # bounded, so a dead batcher fails the test instead of hanging it
+        replies = await asyncio.wait_for(
+            asyncio.gather(*(server.respond(json.dumps(request).encode()) for request in requests)), 30)
+        # the batcher is still alive for later queries
+        later = await asyncio.wait_for(
+            server.respond(json.dumps({"id": "later", "query": "boundary layer"}).encode()), 30)
+        assert "results" in later
+        return replies
+    finally:
+        listener.close()
+        server.close()
+
+
+@pytest.mark.parametrize("bad", ["5", 0, -3, 2.5, True])
+def test_bad_top_k_fails_only_its_request(instance, bad):
+    replies = asyncio.run(responses(instance, [
+        {"id": 1, "query": "slipstream wing", "top_k": 5},
+        {"id": 2, "query": "slipstream wing", "top_k": bad},
+        {"id": 3, "query": "heat transfer"},
+    ]))
+    assert len(replies[0]["results"]) == 5
+    assert "top_k" in replies[1]["error"]
+    assert len(replies[2]["results"]) == 10
+
+
+def test_server_results_match_perform_query(instance):
+    (reply,) = asyncio.run(responses(instance, [{"id": 1, "query": "slipstream wing", "top_k": 20}]))
+    expected = instance.perform_query(instance.make_query(1, "slipstream wing"), 20)
+    assert reply["results"] == [[doc.ident, round(score, 6)] for (doc, score) in expected]
+
+
+def test_top_k_of_zero_selects_nothing():
+    scores = np.array([0.5, 0.2, np.nan, 0.9])
+    assert len(top_k(scores, 0.0, 0)) == 0
+    assert len(top_k(scores, 0.0, -1)) == 0
+    assert top_k(scores, 0.0, 2).tolist() == [3, 0]
+
+
+def test_top_k_argument():
+    assert top_k_argument("5") == 5
+    assert top_k_argument("none") is None and top_k_argument("None") is None
+    for bad in ("0", "-1", "2.5", "ten"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            top_k_argument(bad)
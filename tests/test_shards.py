@@ -0,0 +1,81 @@
+import multiprocessing
+import socket
+import time
+from multiprocessing import AuthenticationError
+
+import pytest
+
+from inforet import InfoRet
+from inforet.shards import ShardedIndex, serve
+
+KEY = b"shard test key"
+
+
+class SplitInfoRet(InfoRet):
+    # whitespace tokens, so the shards need no tokenizer data
+    def normalize_text(self, text: str) -> list[str]:
+        return text.split()
+
+
+def free_address() -> tuple[str, int]:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()
+
+
+def served(address: tuple[str, int], authkey: bytes) -> multiprocessing.Process:
+    process = multiprocessing.Process(target = serve, args = (address, authkey), daemon = True)
+    process.start()
+    return process
+
+
+def connect(instance: InfoRet, address: tuple[str, int], authkey: bytes) -> ShardedIndex:
+    # the shard may not be listening yet
+    for _ in range(100):
+        try:
+            return ShardedIndex(instance, shards = 1, addresses = [address], authkey = authkey)
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise TimeoutError(f"no shard at {address}")
+
+
+def test_serve_needs_an_authkey():
+    with pytest.raises(ValueError, match = "authkey"):
+        serve(free_address(), None)
+    with pytest.raises(ValueError, match = "authkey"):
+        serve(free_address(), b"")
+
+
+def test_remote_shards_need_an_authkey():
+    with pytest.raises(ValueError, match = "authkey"):
+        ShardedIndex(SplitInfoRet(), shards = 1, addresses = [free_address()])
+
+
+def test_wrong_authkey_is_refused():
+    address = free_address()
+    process = served(address, KEY)
+    try:
+        with pytest.raises(AuthenticationError):
+            connect(SplitInfoRet(), address, b"some other key")
+    finally:
+        process.join(10)
+        process.kill()
+
+
+def test_served_shard_matches_one_index(cran_texts, cran_queries):
+    documents = [(ident, " ".join(words)) for (ident, words) in cran_texts]
+    single = SplitInfoRet()
+    single.add_documents(documents)
+    queries = [single.make_query(ident, " ".join(words)) for (ident, words) in cran_queries]
+    expected = [[(doc.ident, score) for (doc, score) in ranked] for ranked in single.perform_queries(queries, 20)]
+
+    address = free_address()
+    process = served(address, KEY)
+    try:
+        # one local shard and one over the socket
+        with connect(SplitInfoRet(), address, KEY) as sharded:
+            sharded.add_documents(documents)
+            assert sharded.perform_queries(queries, 20) == expected
+    finally:
+        process.join(10)
+        process.kill()
@@ -0,0 +1,43 @@
+import pytest
+
+from inforet import Document, InfoRet, Query
+from inforet.scoring import BM25
+from inforet.storage import IndexSettingsMismatch
+
+
+def ranking(results) -> list[tuple[int, float]]:
+    return [(doc.ident, score) for (doc, score) in results]
+
+
+@pytest.mark.parametrize("scoring", [None, BM25()], ids = repr)
+def test_save_load_round_trip(tmp_path, cran_texts, cran_queries, scoring):
+    built = InfoRet(scoring = scoring)
+    for (ident, words) in cran_texts:
+        built.index_document(Document(ident, words))
+    # deleted documents are left out of the saved index
+    for ident in range(1, 1400, 7):
+        built.delete_document(ident)
+    built.save_index(tmp_path / "index")
+
+    loaded = InfoRet(scoring = scoring)
+    loaded.load_index(tmp_path / "index")
+    assert sorted(doc.ident for doc in loaded.documents) == sorted(doc.ident for doc in built.documents)
+    for doc in built.documents:
+        assert loaded.document_table[loaded.doc_ids_by_ident[doc.ident]].word_frequencies == doc.word_frequencies
+
+    queries = [Query(ident, words) for (ident, words) in cran_queries]
+    for (expected, found) in zip(built.perform_queries(queries, 20), loaded.perform_queries(queries, 20)):
+        assert ranking(found) == ranking(expected)
+    for query in queries[:20]:
+        assert ranking(loaded.perform_query(query, 20, prune = True)) == ranking(built.perform_query(query, 20))
+
+
+def test_load_refuses_other_settings(tmp_path, cran_texts):
+    built = InfoRet()
+    for (ident, words) in cran_texts[:50]:
+        built.index_document(Document(ident, words))
+    built.save_index(tmp_path / "index")
+    with pytest.raises(IndexSettingsMismatch):
+        InfoRet(downcase = True).load_index(tmp_path / "index")
+    with pytest.raises(IndexSettingsMismatch, match = "tokenizer"):
+        InfoRet(tokenizer = "fast").load_index(tmp_path / "index")
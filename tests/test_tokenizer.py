@@ -0,0 +1,65 @@
+import re
+
+import nltk
+import pytest
+
+from inforet.tokenizer import FastTokenizer, _treebank
+
+TRICKY = [
+    "It's the wing's lift, isn't it?",
+    "They said \"no\" and 'maybe' -- then ``yes''.",
+    "The students' results weren't (quite) final.",
+    "I cannot say; gonna try, wanna see.",
+    "Mach 2.5 at 10,000 ft. and x=y+1, a/b, e.g. f(x).",
+    "Values... dropped -- sharply -- at 3:45 p.m.",
+    "Ends with a quote.'",
+    "Ends with brackets.)]",
+    "tab\tseparated 'quoted\tword' here",
+    "Don't, won't, can't, y'all'd've.",
+    "«Guillemets» and „low quotes“ and ‘single’ ones.",
+    "O'Neil's rock'n'roll -- 'tis '90s.",
+    "...",
+    ".",
+    "Mr. Smith's figure 3.",
+]
+
+
+def sentence_tokens(tokenizer: FastTokenizer, sentence: str) -> list[str]:
+    words = []
+    tokenizer.tokenize_sentence(sentence, words)
+    return words
+
+
+def cran_sentences(cran_documents) -> list[str]:
+    # near enough to sentences for the rules that look at the end of one
+    return [sentence.strip() + " ." for (_, text) in cran_documents
+            for sentence in re.split(r"\s\.\s", text) if sentence.strip()]
+
+
+@pytest.mark.parametrize("sentence", TRICKY)
+def test_tricky_sentences_match_treebank(sentence):
+    tokenizer = FastTokenizer()
+    assert sentence_tokens(tokenizer, sentence) == _treebank.tokenize(sentence)
+    # again, now answered from the memo
+    assert sentence_tokens(tokenizer, sentence) == _treebank.tokenize(sentence)
+
+
+def test_cranfield_sentences_match_treebank(cran_documents):
+    tokenizer = FastTokenizer()
+    for sentence in cran_sentences(cran_documents):
+        assert sentence_tokens(tokenizer, sentence) == _treebank.tokenize(sentence), sentence
+
+
+def test_normalize_is_applied_per_token(cran_documents):
+    normalize = lambda tokens: [token.lower() for token in tokens if token.isalnum()]
+    tokenizer = FastTokenizer(normalize)
+    for sentence in cran_sentences(cran_documents)[:2000]:
+        assert sentence_tokens(tokenizer, sentence) == normalize(_treebank.tokenize(sentence))
+
+
+def test_full_text_matches_word_tokenize(punkt, cran_documents):
+    tokenizer = FastTokenizer()
+    for (_, text) in cran_documents:
+        assert tokenizer.tokenize(text) == nltk.word_tokenize(text)
+    text = " ".join(TRICKY)
+    assert tokenizer.tokenize(text) == nltk.word_tokenize(text)
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from inforet import varbyte
+from inforet.matrix import CompressedTermDocumentMatrix, TermDocumentMatrix
+from inforet.terms import TERMS
+
+
+def test_round_trip_across_byte_boundaries():
+    values = np.array([0, 1, 127, 128, 16383, 16384, 2 ** 21, 2 ** 31 - 1, 2 ** 40], dtype = np.int64)
+    data = varbyte.encode(values)
+    assert len(data) == int(varbyte.encoded_sizes(values.astype(np.uint64)).sum())
+    assert varbyte.decode(data).tolist() == values.tolist()
+
+
+@pytest.mark.parametrize("gaps", [False, True])
+def test_lists_round_trip(gaps):
+    rng = np.random.default_rng(0)
+    sizes = rng.integers(0, 50, 200)
+    indptr = np.concatenate([[0], np.cumsum(sizes)])
+    values = rng.integers(0, 10 ** 6, int(indptr[-1]))
+    if gaps:
+        # gaps need each list ascending
+        values = np.concatenate([np.sort(values[start:end]) for (start, end) in zip(indptr, indptr[1:])])
+    (data, offsets) = varbyte.encode_lists(indptr, values, gaps = gaps)
+    rows = rng.permutation(len(sizes))[:120]
+    decoded = varbyte.decode_lists(data, offsets, sizes[rows], rows, gaps = gaps)
+    expected = np.concatenate([values[indptr[row]:indptr[row + 1]] for row in rows])
+    assert decoded.tolist() == expected.tolist()
+
+
+def test_compressed_matrix_postings_match_plain(cran_texts):
+    documents = [TERMS.intern_all(words) for (_, words) in cran_texts[:300]]
+    frequencies = [np.unique(terms, return_counts=True) for terms in documents]
+    plain = TermDocumentMatrix.build(frequencies)
+    compressed = CompressedTermDocumentMatrix.build(frequencies)
+    rows = np.arange(len(plain.terms))
+    for (expected, found) in zip(plain.postings(rows), compressed.postings(rows)):
+        assert found.tolist() == expected.tolist()
+    assert compressed.nbytes < plain.nbytes
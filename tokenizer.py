@@ -0,0 +1,103 @@
+"""nltk.word_tokenize, memoized, with per-token normalization fused in.
+
+nltk.word_tokenize splits text into sentences with Punkt, then puts each
+sentence through some thirty regular expression substitutions, the Treebank
+rules, each one a pass over the whole sentence. Apart from the rules for
+quotation marks and for the end of the sentence, none of them looks across
+whitespace: a token never spans it, and what is on one side never changes
+how the other side splits. So a sentence without quotation marks tokenizes
+as its whitespace-separated chunks do one by one, and text is made of the
+same few thousand chunks over and over. `FastTokenizer` tokenizes each
+distinct chunk once and remembers the answer, already normalized: one
+compiled pattern recognizes the chunks no rule would touch, mostly plain
+words and numbers, and the rest go through the Treebank rules. Sentences
+with quotation marks get the rules in full, as before.
+"""
+import itertools
+import re
+from typing import Callable, Optional
+
+import nltk
+from nltk.tokenize.destructive import NLTKWordTokenizer
+
+# the word tokenizer nltk.word_tokenize uses
+_treebank = NLTKWordTokenizer()
+
+# quotation marks, whose rules depend on the whitespace around them; an
+# apostrophe only matters when it ends the sentence or precedes a tab or newline
+QUOTES = re.compile("[\"`«»“”‘’„]|''|'(?:[^\\S ]|\\s*$)")
+# what the end of sentence rule lets follow a final period
+CLOSERS = "])}>'"
+# a chunk no rule touches before the end of a sentence: word characters, and
+# single dashes, periods and the like between them
+PLAIN = re.compile(r"(?:\w|[-/=+^|~](?!-)|\.(?!\.)|[:,](?=\d))+")
+# words the contraction rules split, e.g. cannot -> can not
+CONTRACTED = re.compile(r"(?i)cannot|gimme|gonna|gotta|lemme|wanna")
+
+
+class FastTokenizer:
+    """Same tokens as nltk.word_tokenize, normalized by `normalize` if given.
+
+    `normalize` maps a list of tokens to the words they become, token by
+    token and independently of one another, as InfoRet.normalize_tokens
+    does; tokenize(text) is then normalize(nltk.word_tokenize(text)), with
+    both done once per distinct chunk rather than at every occurrence. Each
+    memo is dropped and started over when it reaches `max_chunks` entries.
+    """
+
+    max_chunks: int = 1_000_000
+
+    def __init__(self, normalize: Optional[Callable[[list[str]], list[str]]] = None):
+        self.normalize = normalize
+        # words of a chunk with more of the sentence after it
+        self.chunks: dict[str, tuple[str, ...]] = {}
+        # words of a sentence's last chunk
+        self.tails: dict[str, tuple[str, ...]] = {}
+
+    def tokenize(self, text: str) -> list[str]:
+        words = []
+        for sentence in nltk.sent_tokenize(text):
+            self.tokenize_sentence(sentence, words)
+        return words
+
+    def tokenize_sentence(self, sentence: str, words: list[str]):
+        """Append the words of `sentence` to `words`."""
+        chunks = sentence.split()
+        if not chunks:
+            return
+        if QUOTES.search(sentence) or not chunks[-1].strip(CLOSERS):
+            # the rules for these look across chunks; apply them in full
+            words.extend(self._normalized(_treebank.tokenize(sentence)))
+            return
+        heads = chunks[:-1]
+        found = list(map(self.chunks.get, heads))
+        if None in found:
+            found = [self._chunk(chunk) if tokens is None else tokens
+                     for (chunk, tokens) in zip(heads, found)]
+        words.extend(itertools.chain.from_iterable(found))
+        tail = self.tails.get(chunks[-1])
+        if tail is None:
+            tail = self._tail(chunks[-1])
+        words.extend(tail)
+
+    def _normalized(self, tokens: list[str]) -> list[str]:
+        return tokens if self.normalize is None else self.normalize(tokens)
+
+    def _chunk(self, chunk: str) -> tuple[str, ...]:
+        if PLAIN.fullmatch(chunk) and not CONTRACTED.search(chunk):
+            tokens = [chunk]
+        else:
+            # followed by a word, so the end of sentence rules leave the chunk alone
+            tokens = _treebank.tokenize(chunk + " a")[:-1]
+        tokens = tuple(self._normalized(tokens))
+        if len(self.chunks) >= self.max_chunks:
+            self.chunks = {}
+        self.chunks[chunk] = tokens
+        return tokens
+
+    def _tail(self, chunk: str) -> tuple[str, ...]:
+        tokens = tuple(self._normalized(_treebank.tokenize(chunk)))
+        if len(self.tails) >= self.max_chunks:
+            self.tails = {}
+        self.tails[chunk] = tokens
+        return tokens
@@ -0,0 +1,105 @@
+"""Variable-byte coding of integer lists, vectorized with numpy.
+
+A value is written as 7-bit groups, least significant first, one per byte;
+the last byte of each value has its high bit set. Postings lists are
+stored as the gaps between consecutive doc ids, so the long lists of
+common terms are mostly one byte per posting, as are most term
+frequencies. Encoding and decoding work on whole arrays of lists at once,
+never a Python loop per value.
+"""
+import numpy as np
+
+STOP = 0x80  # marks the last byte of a value
+
+
+def ranges(starts: np.ndarray, sizes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """(index into `starts`, position) of every position in every range starts[i]:starts[i] + sizes[i]."""
+    owner = np.repeat(np.arange(len(starts)), sizes)
+    offsets = np.arange(len(owner)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    return owner, starts[owner] + offsets
+
+
+def encoded_sizes(values: np.ndarray) -> np.ndarray:
+    """Bytes taken by each of `values`."""
+    sizes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        sizes += rest > 0
+        rest >>= np.uint64(7)
+    return sizes
+
+
+def encode(values: np.ndarray) -> np.ndarray:
+    """The bytes of non-negative `values`, as a uint8 array."""
+    values = np.asarray(values).astype(np.uint64)
+    return _pack(values, encoded_sizes(values))
+
+
+def _pack(values: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    ends = np.cumsum(sizes)
+    data = np.zeros(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    starts = ends - sizes
+    for group in range(int(sizes.max()) if len(sizes) else 0):
+        longer = sizes > group
+        data[starts[longer] + group] = (values[longer] >> np.uint64(7 * group)) & np.uint64(0x7F)
+    data[ends - 1] |= STOP
+    return data
+
+
+def decode(data: np.ndarray) -> np.ndarray:
+    """The values coded in `data`, which must end on a value boundary, as int64."""
+    data = np.asarray(data, dtype=np.uint8)
+    groups = (data & 0x7F).astype(np.int64)
+    ends = np.flatnonzero(data & STOP)
+    if len(ends) == len(data):
+        # every value fits in one byte
+        return groups
+    starts = np.zeros(len(ends), dtype=np.int64)
+    starts[1:] = ends[:-1] + 1
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+    return np.add.reduceat(groups << shifts, starts)
+
+
+def encode_lists(indptr: np.ndarray, values: np.ndarray, gaps: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    """Code each list values[indptr[i]:indptr[i + 1]]; returns (data, offsets).
+
+    List i's bytes are data[offsets[i]:offsets[i + 1]]. With `gaps` the
+    lists must be ascending, and every value but the first of its list is
+    stored as its difference from the one before.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if gaps:
+        firsts = indptr[:-1][np.diff(indptr) > 0]
+        deltas = np.diff(values, prepend=0)
+        deltas[firsts] = values[firsts]
+        values = deltas
+    values = values.astype(np.uint64)
+    sizes = encoded_sizes(values)
+    # bytes before each value, then before each list
+    before = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=before[1:])
+    return _pack(values, sizes), before[indptr]
+
+
+def decode_lists(
+    data: np.ndarray,
+    offsets: np.ndarray,
+    sizes: np.ndarray,
+    lists: np.ndarray,
+    gaps: bool = False,
+) -> np.ndarray:
+    """The values of `lists`, concatenated in that order.
+
+    `sizes` is the number of values in each of `lists`; `data`, `offsets`
+    and `gaps` are as encode_lists made them.
+    """
+    (_, positions) = ranges(offsets[lists], offsets[lists + 1] - offsets[lists])
+    values = decode(data[positions])
+    if gaps and len(values):
+        totals = np.cumsum(values)
+        firsts = (np.cumsum(sizes) - sizes)[sizes > 0]
+        # a list's running total starts over at its first value
+        bases = np.zeros(len(sizes), dtype=np.int64)
+        bases[sizes > 0] = totals[firsts] - values[firsts]
+        values = totals - np.repeat(bases, sizes)
+    return values